@@ -1,15 +1,44 @@
-from flask import Flask, request, render_template, send_file
+from flask import Flask, Request, request, render_template, send_file, jsonify, url_for, Response
+import time
 import uuid
 
 import service
+from jobs import JobQueue, QueueFull, DONE, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, DEFAULT_KEEP_SECONDS
+import cli_path  # исходники CLI в sys.path, до импорта services
+from services.cpu_budget import CpuBudget
+from uploads import UploadBuffer, DEFAULT_SPILL_BYTES
 import subprocess
+import math
 import os
 from pathlib import Path
 
 
+class UploadRequest(Request):
+    # файлы из multipart хэшируются по мере приема и остаются в памяти, на диск -- только большие
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadBuffer(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_SPILL_BYTES'])
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['UPLOAD_FOLDER'] = "uploads/"
 app.config['TEMP_FOLDER'] = "temp/"
+app.config['UPLOAD_SPILL_BYTES'] = int(os.environ.get("UPLOAD_SPILL_MB", DEFAULT_SPILL_BYTES // (1024 * 1024))) \
+    * 1024 * 1024
+app.config['ANALYSIS_CACHE_DIR'] = os.environ.get("ANALYSIS_CACHE_DIR")
+app.config['ANALYSIS_CACHE_SIZE'] = int(os.environ.get("ANALYSIS_CACHE_SIZE", 512)) * 1024 * 1024
+# сколько видео рендерится одновременно, сколько задач ждет в очереди и сколько процессов на кадры у каждой
+app.config['JOB_WORKERS'] = int(os.environ.get("JOB_WORKERS", DEFAULT_WORKERS))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get("JOB_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+# сколько секунд хранятся завершенные задачи; видео забытой задачи удаляется из generated/
+app.config['JOB_KEEP_SECONDS'] = float(os.environ.get("JOB_KEEP_SECONDS", DEFAULT_KEEP_SECONDS))
+app.config['FRAME_WORKERS'] = int(os.environ.get("FRAME_WORKERS", 8))
+# ядра хоста, общие для всех задач (и запусков cli), задача ждет, пока не освободится хотя бы половина нужных
+app.config['CPU_BUDGET'] = int(os.environ.get("CPU_BUDGET", 0)) or None
+# stream -- один проход ffmpeg с фрагментированным mp4, который отдается по мере кодирования,
+# two-pass -- прежний вариант: png кадры, кодирование, затем отдельное добавление звука
+app.config['ENCODE_MODE'] = os.environ.get("ENCODE_MODE", "stream")
+app.config['STREAM_CHUNK_SIZE'] = 64 * 1024
 
 
 assets =  { 
@@ -31,52 +60,219 @@ def create_folder(folder_path):
 
 
 
+jobs = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_SIZE'],
+                keep_seconds=app.config['JOB_KEEP_SECONDS'])
+cpu_budget = CpuBudget(app.config['CPU_BUDGET'])
+
+
+def output_path(request_id):
+    return "generated/{}.mp4".format(request_id)
+
+
+def render_job(progress, request_id, smooth, beat, cover, beat_name, author_name):
+    lease = cpu_budget.acquire(app.config['FRAME_WORKERS'], max(1, app.config['FRAME_WORKERS'] // 2),
+                               on_wait=lambda: progress("waiting for cpu"))
+
+    temp_path = os.path.join(app.config['TEMP_FOLDER'], request_id)
+    output_file = output_path(request_id)
+
+    try:
+        create_folder(temp_path)
+        service.process_track(
+                smooth,
+                temp_path,
+                beat,
+                cover,
+                beat_name,
+                author_name,
+                assets,
+                dbg=False,
+                output_file=output_file,
+                analysis_cache_dir=app.config['ANALYSIS_CACHE_DIR'],
+                analysis_cache_size=app.config['ANALYSIS_CACHE_SIZE'],
+                n_jobs=lease.cores,
+                progress=progress,
+                threads=lease.cores,
+                single_pass=app.config['ENCODE_MODE'] == "stream"
+            )
+    except BaseException:
+        # прерванная или упавшая задача не оставляет кадров и недописанного видео
+        clean_folder(temp_path)
+        clean_folder(output_file)
+        raise
+    finally:
+        lease.release()
+        beat.discard()
+        cover.discard()
+
+    return output_file
+
+
+class InvalidUpload(ValueError):
+    pass
+
+
+def upload_params(form):
+    missing = [name for name in ["smooth", "beat_name", "author_name"] if not form.get(name)]
+    if missing:
+        raise InvalidUpload("missing form fields: {}".format(", ".join(missing)))
+
+    try:
+        smooth = float(form["smooth"])
+    except ValueError:
+        raise InvalidUpload("smooth must be a number") from None
+
+    # из smooth считается размер ядра сглаживания: sr / smooth
+    if not math.isfinite(smooth) or smooth <= 0:
+        raise InvalidUpload("smooth must be a positive number")
+
+    return {"smooth": smooth, "beat_name": form["beat_name"], "author_name": form["author_name"]}
+
+
+def discard_uploads():
+    # большие загрузки парсер формы уже перенес на диск, отклоненный запрос не должен их оставлять
+    for _, file in request.files.items(multi=True):
+        file.stream.discard()
+
+
+def submit_upload(request_id):
+    if not all(ele in request.files for ele in ["beat_file", "cover_file"]):
+        discard_uploads()
+        return None
+
+    # поля формы проверяются до того, как загрузки передаются задаче
+    try:
+        params = upload_params(request.form)
+    except InvalidUpload:
+        discard_uploads()
+        raise
+
+    beat_file = request.files["beat_file"]
+    cover_file = request.files["cover_file"]
+
+    # содержимое уже принято и захэшировано парсером формы, задача получает его без записи на диск
+    beat = beat_file.stream.upload(beat_file.filename)
+    cover = cover_file.stream.upload(cover_file.filename)
+
+    try:
+        return jobs.submit(render_job,
+                           job_id=request_id,
+                           request_id=request_id,
+                           beat=beat,
+                           cover=cover,
+                           **params)
+    except QueueFull:
+        beat.discard()
+        cover.discard()
+        raise
+
+
 @app.route("/generate", methods=['GET', 'POST'])
 def generate():
     request_id = str(uuid.uuid4().hex[:10])
     
     if request.method == "POST":
-        if not all(ele in request.files for ele in ["beat_file", "cover_file"]):
+        # старый синхронный вариант: задача проходит через ту же очередь, запрос ждет ее завершения
+        try:
+            job = submit_upload(request_id)
+        except InvalidUpload as err:
+            return str(err), 400
+        except QueueFull as err:
+            return str(err), 503
+
+        if job is None:
             return "not enough mana", 500
 
-        beat_name = request.form["beat_name"]
-        author_name = request.form["author_name"]
+        job.finished.wait()
 
-        beat_file = request.files["beat_file"]
-        cover_file = request.files["cover_file"]
+        if job.status != DONE:
+            return job.error or job.status, 500
 
-        smooth = request.form["smooth"]
+        return send_file(job.result, as_attachment=True)
+    else:
+        return render_template("upload.html")
 
-        base_uploaded_path = os.path.join(app.config['UPLOAD_FOLDER'], request_id)
-        create_folder(base_uploaded_path)
 
-        temp_path = os.path.join(app.config['TEMP_FOLDER'], request_id)
-        create_folder(temp_path)
+@app.route("/jobs", methods=['POST'])
+def submit_job():
+    try:
+        job = submit_upload(str(uuid.uuid4().hex[:10]))
+    except InvalidUpload as err:
+        return jsonify(error=str(err)), 400
+    except QueueFull as err:
+        return jsonify(error=str(err)), 503
 
+    if job is None:
+        return jsonify(error="beat_file and cover_file are required"), 400
 
+    return jsonify(job.to_dict()), 202, {"Location": url_for("job_status", job_id=job.id)}
 
 
-        uploaded_beat_file_path = os.path.join(base_uploaded_path, beat_file.filename)
-        uploaded_cover_file_path = os.path.join(base_uploaded_path, cover_file.filename)
+@app.route("/jobs/<job_id>", methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
 
-        beat_file.save(uploaded_beat_file_path)
-        cover_file.save(uploaded_cover_file_path)
+    return jsonify(job.to_dict())
 
-        service.process_track(
-                float(smooth),
-                temp_path,
-                uploaded_beat_file_path,
-                uploaded_cover_file_path,
-                beat_name,
-                author_name,
-                assets,
-                dbg=False,
-                output_file="generated/{}.mp4".format(request_id)
-            )
 
-        return send_file("generated/{}.mp4".format(request_id),as_attachment=True)
-    else:
-        return render_template("upload.html")
+@app.route("/jobs/<job_id>/result", methods=['GET'])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+
+    if job.status != DONE:
+        return jsonify(job.to_dict()), 409
+
+    return send_file(job.result, as_attachment=True)
+
+
+@app.route("/jobs/<job_id>/stream", methods=['GET'])
+def job_stream(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+
+    path = output_path(job_id)
+    progressive = app.config['ENCODE_MODE'] == "stream"
+
+    def follow():
+        # фрагменты отдаются по мере появления в файле, пока задача не завершится;
+        # обычный mp4 ffmpeg дописывает в начало в конце кодирования, его можно отдать только целиком
+        while not os.path.exists(path) or not (progressive or job.finished.is_set()):
+            if job.finished.is_set():
+                return
+            time.sleep(0.1)
+
+        with open(path, "rb") as video:
+            while True:
+                finished = job.finished.is_set()
+                chunk = video.read(app.config['STREAM_CHUNK_SIZE'])
+
+                if chunk:
+                    yield chunk
+                elif finished:
+                    return
+                else:
+                    time.sleep(0.1)
+
+    if job.finished.is_set() and job.status != DONE:
+        return jsonify(job.to_dict()), 409
+
+    return Response(follow(), mimetype="video/mp4",
+                    headers={"Content-Disposition": "attachment; filename={}.mp4".format(job_id)})
+
+
+@app.route("/jobs/<job_id>", methods=['DELETE'])
+@app.route("/jobs/<job_id>/cancel", methods=['POST'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+
+    return jsonify(job.to_dict()), 202
 
 @app.route("/test_download")
 def test_download():
@@ -100,3 +296,10 @@ def test():
     return "ok"
 
 
+if __name__ == "__main__":
+    # waitress принимает запросы в своем цикле событий и передает их потокам приложения уже целиком,
+    # так что медленная загрузка не занимает поток
+    from waitress import serve
+
+    serve(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5001)),
+          threads=int(os.environ.get("SERVER_THREADS", 8)))
@@ -0,0 +1,13 @@
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# аудио, кэш анализа, слои и бюджет ядер сервис берет из исходников CLI, а не держит их копии:
+# в образе сервиса они лежат в /app/cli (см. Dockerfile), при запуске из репозитория -- в ../cli
+CLI_ROOT = os.environ.get("CLI_ROOT") or next(
+    (path for path in (os.path.join(here, 'cli'), os.path.join(here, '..', 'cli')) if os.path.isdir(path)),
+    os.path.join(here, 'cli'))
+
+if CLI_ROOT not in sys.path:
+    sys.path.append(CLI_ROOT)
@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+DEFAULT_WORKERS = 1
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_KEEP_FINISHED = 256
+DEFAULT_KEEP_SECONDS = 24 * 60 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    task: Callable
+    kwargs: dict
+    status: str = QUEUED
+    stage: str = QUEUED
+    frames_done: int = 0
+    frames_total: int = 0
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cancel_requested: threading.Event = field(default_factory=threading.Event)
+    finished: threading.Event = field(default_factory=threading.Event)
+
+    def progress(self, stage: str, done: Optional[int] = None, total: Optional[int] = None):
+        """
+        Progress callback handed to the task. Raises JobCancelled once cancel was requested,
+        so the task stops at its next report.
+        """
+
+        if self.cancel_requested.is_set():
+            raise JobCancelled(self.id)
+
+        self.stage = stage
+        if done is not None:
+            self.frames_done = done
+        if total is not None:
+            self.frames_total = total
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        started = self.started_at or now
+
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "frames_done": self.frames_done,
+            "frames_total": self.frames_total,
+            "percent": round(100.0 * self.frames_done / self.frames_total, 1) if self.frames_total else 0.0,
+            # время в очереди и время работы считаются отдельно
+            "queue_seconds": round(started - self.created_at, 3),
+            "run_seconds": round((self.finished_at or now) - started, 3) if self.started_at else 0.0,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Bounded queue of render jobs served by a fixed pool of worker threads.
+    Tasks are called as task(progress=job.progress, **kwargs) and return the result file path.
+    Finished jobs are kept up to keep_finished of them and for keep_seconds, a forgotten job's result file
+    is deleted.
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 keep_finished: int = DEFAULT_KEEP_FINISHED,
+                 keep_seconds: Optional[float] = DEFAULT_KEEP_SECONDS) -> None:
+        self.workers = workers
+        self.keep_finished = keep_finished
+        self.keep_seconds = keep_seconds
+        self.__queue: "queue.Queue[Job]" = queue.Queue(maxsize=queue_size)
+        self.__jobs: Dict[str, Job] = {}
+        self.__lock = threading.Lock()
+        self.__threads = [threading.Thread(target=self.__work, name=f"job-worker-{i}", daemon=True)
+                          for i in range(workers)]
+
+        for thread in self.__threads:
+            thread.start()
+
+    def submit(self, task: Callable, job_id: Optional[str] = None, **kwargs) -> Job:
+        self.__forget_finished()
+        job = Job(job_id or uuid.uuid4().hex[:10], task, kwargs)
+
+        with self.__lock:
+            self.__jobs[job.id] = job
+
+        try:
+            self.__queue.put_nowait(job)
+        except queue.Full:
+            with self.__lock:
+                del self.__jobs[job.id]
+            raise QueueFull(f"{self.__queue.maxsize} jobs are already waiting")
+
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.__lock:
+            return self.__jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+
+        if job is not None and job.status in (QUEUED, RUNNING):
+            job.cancel_requested.set()
+
+        return job
+
+    @property
+    def queued(self) -> int:
+        return self.__queue.qsize()
+
+    def __work(self):
+        while True:
+            job = self.__queue.get()
+
+            try:
+                self.__run(job)
+            finally:
+                self.__queue.task_done()
+
+    def __run(self, job: Job):
+        if job.cancel_requested.is_set():
+            self.__finish(job, CANCELLED)
+            return
+
+        job.started_at = time.time()
+        job.status = RUNNING
+
+        try:
+            job.result = job.task(progress=job.progress, **job.kwargs)
+        except JobCancelled:
+            self.__finish(job, CANCELLED)
+        except Exception as error:
+            traceback.print_exc()
+            job.error = str(error)
+            self.__finish(job, FAILED)
+        else:
+            self.__finish(job, DONE)
+
+    def __finish(self, job: Job, status: str):
+        job.status = status
+        job.stage = status
+        job.finished_at = time.time()
+        job.finished.set()
+
+        self.__forget_finished()
+
+    def __forget_finished(self):
+        # завершенные задачи хранятся ограниченно: самые старые и просроченные забываются вместе с результатом
+        expires = None if self.keep_seconds is None else time.time() - self.keep_seconds
+
+        with self.__lock:
+            finished = sorted((item for item in self.__jobs.values() if item.finished.is_set()),
+                              key=lambda item: item.finished_at)
+            excess = len(finished) - self.keep_finished
+            forgotten = [item for index, item in enumerate(finished)
+                         if index < excess or (expires is not None and item.finished_at < expires)]
+
+            for item in forgotten:
+                del self.__jobs[item.id]
+
+        for item in forgotten:
+            self.__remove_result(item)
+
+    @staticmethod
+    def __remove_result(job: Job):
+        if job.result is None:
+            return
+
+        try:
+            os.remove(job.result)
+        except FileNotFoundError:
+            pass
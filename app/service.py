@@ -1,28 +1,104 @@
-# %matplotlib inline
-
 import librosa
-from scipy.ndimage.filters import gaussian_filter
-import matplotlib
 import numpy as np
 import subprocess
-import matplotlib.pyplot as plt
+import threading
 
+from functools import lru_cache
 from pathlib import Path
-from scipy.signal import hilbert, chirp
-from PIL import Image, ImageFilter
+from scipy.signal import hilbert
 import math
-# from IPython.display import Video
 
 from joblib import Parallel, delayed
-from scipy import interpolate
-from PIL import Image, ImageFont, ImageDraw
+from PIL import Image, ImageFilter, ImageFont, ImageDraw
 
+import cli_path  # исходники CLI в sys.path, до импорта services
+from services.analysis_cache import AnalysisCache, DEFAULT_MAX_BYTES
+from services.audio import AudioIngest
+from services.cpu_budget import limit_threads
+from services.enums import DEFAULT_SAMPLE_RATE
+from services.layers import Layer, LayerCompositor, ZoomLayer
+from uploads import Upload
 
-# 576x1024
-def process_track(smooth, temp_path, song_path, image_path, beat_name, author_name, asset_path, output_file,
-                  framerate=30, size_w=720, size_h=1280, size_a=400, dbg=True):
-    print("Loading song at {}".format(song_path))
-    y, sr = librosa.load(song_path)
+# кэши живут все время работы процесса: одинаковые подписи (и шрифты) в следующих задачах не рисуются заново
+FONT_CACHE_SIZE = 16
+TEXT_LAYER_CACHE_SIZE = 256
+
+# метаданные трека в кэше анализа: пространство имен сервиса и поля, без которых запись считается промахом
+META_PIPELINE = "service"
+META_FIELDS = ("sample_rate", "samples", "duration")
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_asset(path):
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def corners_mask(size, rad):
+    circle = Image.new('L', (rad * 2, rad * 2), 0)
+    draw = ImageDraw.Draw(circle)
+    draw.ellipse((0, 0, rad * 2 - 1, rad * 2 - 1), fill=255)
+    alpha = Image.new('L', size, 255)
+    w, h = size
+    alpha.paste(circle.crop((0, 0, rad, rad)), (0, 0))
+    alpha.paste(circle.crop((0, rad, rad, rad * 2)), (0, h - rad))
+    alpha.paste(circle.crop((rad, 0, rad * 2, rad)), (w - rad, 0))
+    alpha.paste(circle.crop((rad, rad, rad * 2, rad * 2)), (w - rad, h - rad))
+    return alpha
+
+
+@lru_cache(maxsize=TEXT_LAYER_CACHE_SIZE)
+def text_layer(size, text, font_path, font_size, color, offset, max_len):
+    """
+    Text drawn on a transparent canvas of size, returned as a layer cropped to the drawn pixels.
+    Layers are cached by all arguments and shared, they must not be modified.
+    """
+
+    font = load_font(font_path, font_size)
+
+    txt = Image.new('RGBA', size, (255, 255, 255, 0))
+
+    txt_d = ImageDraw.Draw(txt)
+
+    short_text = ""
+
+    if len(text) > max_len:
+        short_text = text[0:max_len]
+        short_text += "..."
+    else:
+        short_text = text
+
+    txt_d.multiline_text(offset, short_text, fill=color, font=font, anchor="mm", spacing=0, align="center")
+
+    # в кэше хранится только прямоугольник с текстом, а не весь кадр
+    box = txt.getbbox()
+    if box is None:
+        return Layer(Image.new('RGBA', (1, 1), (255, 255, 255, 0)))
+
+    return Layer(txt.crop(box), box[:2])
+
+
+def load_song(song, sr, pcm_dir=None):
+    # загрузка приходит из памяти (или из файла, если была больше порога), повторно с диска не читается
+    if isinstance(song, Upload):
+        if song.data is not None:
+            return AudioIngest(sr, pcm_dir).load_bytes(song.data, song.digest, Path(song.filename).suffix)
+        song = song.path
+
+    return AudioIngest(sr, pcm_dir).load(song)
+
+
+def analyse_track(smooth, song_path, pcm_dir=None):
+    print("Loading song at {}".format(song_path.filename if isinstance(song_path, Upload) else song_path))
+    sr = DEFAULT_SAMPLE_RATE
+    y = load_song(song_path, sr, pcm_dir)
 
     print("Generating percussive")
 
@@ -46,20 +122,75 @@ def process_track(smooth, temp_path, song_path, image_path, beat_name, author_na
 
     y_perc = np.convolve(y_perc, kernel, mode='valid')
 
+    meta = {"sample_rate": int(sr), "samples": len(y_percussive), "duration": librosa.get_duration(y=y, sr=sr)}
+
+    return y_perc, meta
+
+
+def analyse_track_cached(smooth, song_path, cache_dir, max_bytes=DEFAULT_MAX_BYTES, pcm_dir=None, verbose=False):
+    cache = AnalysisCache(cache_dir, max_bytes, verbose)
+    # у загрузки хэш уже посчитан при приеме
+    digest = song_path.digest if isinstance(song_path, Upload) else cache.file_digest(song_path)
+    key = cache.key(digest, {"pipeline": "service", "smooth": float(smooth)})
+
+    y_perc = cache.get(key)
+    meta = cache.get_meta(digest, META_PIPELINE, META_FIELDS)
+
+    if y_perc is not None and meta is not None:
+        return y_perc, meta
+
+    y_perc, meta = analyse_track(smooth, song_path, pcm_dir)
+    cache.put_meta(digest, META_PIPELINE, meta)
+
+    return cache.put(key, y_perc), meta
+
+
+# 576x1024
+def process_track(smooth, temp_path, song_path, image_path, beat_name, author_name, asset_path, output_file,
+                  framerate=30, size_w=720, size_h=1280, size_a=400, dbg=True,
+                  analysis_cache_dir=None, analysis_cache_size=DEFAULT_MAX_BYTES, n_jobs=8, progress=None,
+                  threads=None, single_pass=False):
+    # progress(stage, done, total) может прервать обработку исключением (отмена задачи)
+    def report(stage, done=None, total=None):
+        if progress is not None:
+            progress(stage, done, total)
+
+    report("analysis")
+
+    # потоки BLAS и ffmpeg ограничены выделенными задаче ядрами (по умолчанию -- как у кадров)
+    threads = threads or n_jobs
+
+    # звук декодируется в память: PCM в каталоге задачи не переиспользуется и остался бы после нее
+    with limit_threads(threads):
+        if analysis_cache_dir:
+            y_perc, meta = analyse_track_cached(smooth, song_path, analysis_cache_dir, analysis_cache_size,
+                                                verbose=dbg)
+        else:
+            y_perc, meta = analyse_track(smooth, song_path)
+
+    sr = meta["sample_rate"]
+
     print("Loading images")
 
-    original_image = Image.open(image_path)
+    def open_image():
+        return Image.open(image_path.open() if isinstance(image_path, Upload) else image_path)
+
+    original_image = open_image()
     original_image = original_image.resize((size_a, size_a))
     original_image.putalpha(255)
 
-    blurred_image = Image.open(image_path)
+    blurred_image = open_image()
     blurred_image.putalpha(255)
 
     blurred_image = blurred_image.filter(ImageFilter.GaussianBlur(10))
 
     blurred_image = blurred_image.resize((size_h, size_h))
 
-    shade_image = Image.open(asset_path["shade"])
+    shade_image = load_asset(asset_path["shade"])
+
+    def song_file():
+        # ffmpeg сводит звук из файла: загрузка из памяти записывается только на этом шаге
+        return song_path.materialize(temp_path) if isinstance(song_path, Upload) else song_path
 
     def clean_frames():
         subprocess.check_output("rm -rf {}/temp.mp4".format(temp_path), shell=True, text=True)
@@ -78,84 +209,47 @@ def process_track(smooth, temp_path, song_path, image_path, beat_name, author_na
 
     def assemble_video():
         subprocess.call(
-            "ffmpeg -y -framerate {} -pattern_type glob -i '{}/frames/*.png' -c:v libx264 -b:v 4108k -pix_fmt yuv420p {}/temp.mp4".format(
-                framerate, temp_path, temp_path), shell=True, text=True, stdout=subprocess.DEVNULL,
+            "ffmpeg -y -framerate {} -pattern_type glob -i '{}/frames/*.png' -c:v libx264 -b:v 4108k -pix_fmt yuv420p -threads {} {}/temp.mp4".format(
+                framerate, temp_path, threads, temp_path), shell=True, text=True, stdout=subprocess.DEVNULL,
             stderr=subprocess.STDOUT)
 
     def attach_audio():
         subprocess.call(
-            "ffmpeg -y -i {}/temp.mp4 -i {} -map 0:v -map 1:a -c:v copy -shortest {}".format(temp_path, song_path,
+            "ffmpeg -y -i {}/temp.mp4 -i {} -map 0:v -map 1:a -c:v copy -shortest {}".format(temp_path, song_file(),
                                                                                              output_file), shell=True,
             text=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
 
     def add_corners(im, rad):
-        circle = Image.new('L', (rad * 2, rad * 2), 0)
-        draw = ImageDraw.Draw(circle)
-        draw.ellipse((0, 0, rad * 2 - 1, rad * 2 - 1), fill=255)
-        alpha = Image.new('L', im.size, 255)
-        w, h = im.size
-        alpha.paste(circle.crop((0, 0, rad, rad)), (0, 0))
-        alpha.paste(circle.crop((0, rad, rad, rad * 2)), (0, h - rad))
-        alpha.paste(circle.crop((rad, 0, rad * 2, rad)), (w - rad, 0))
-        alpha.paste(circle.crop((rad, rad, rad * 2, rad * 2)), (w - rad, h - rad))
-        im.putalpha(alpha)
+        im.putalpha(corners_mask(im.size, rad))
         return im
 
-    def add_text(im_p, text, font_path, font_size, color, offset, max_len):
-
-        font = ImageFont.truetype(font_path, font_size)
-
-        txt = Image.new('RGBA', im_p.size, (255, 255, 255, 0))
-
-        draw = ImageDraw.Draw(im_p)
-        txt_d = ImageDraw.Draw(txt)
-
-        short_text = ""
-
-        if len(text) > max_len:
-            short_text = text[0:max_len]
-            short_text += "..."
-        else:
-            short_text = text
-
-        txt_d.multiline_text(offset, short_text, fill=color, font=font, anchor="mm", spacing=0, align="center")
-
-        #         txt_d.text(offset,text,anchor='mm',fill= color,font=font)
-
-        im_p = Image.alpha_composite(im_p, txt)
-
-        return im_p
-
-    def create_save_frame_img_proto(intensity, image, blurred):
-        #         reds = np.zeros([size_h, size_w, 3], dtype=np.float32)
-        reds = np.zeros([size_h, size_w, 4], dtype=np.float32)
+    def static_layers(image):
+        # тень, аватар и подписи одинаковы во всех кадрах, поэтому сливаются один раз
+        rounded = add_corners(image, 40)
 
-        img = Image.fromarray((reds * 255).astype(np.uint8), "RGBA")
+        return LayerCompositor(size_w, size_h, [
+            Layer(shade_image),
+            Layer(rounded, (160, 246)),
+            text_layer((size_w, size_h), beat_name, asset_path["beat_name"], 25, (255, 255, 255, 255),
+                       (size_w / 2, 50 + 400 + 246 + 11), 20),
+            text_layer((size_w, size_h), author_name, asset_path["author_name"], 22,
+                       (255, 255, 255, int(0.6 * 255)), (size_w / 2, 11 + 50 + 400 + 246 + 12 + 16 + 11), 20),
+        ])
 
+    def create_save_frame_img_proto(intensity, layers, zoom):
         def new_size():
             return int((1.0 - intensity) * size_h + (intensity) * size_h * 2)
 
         def new_offset(size):
             return int((1.0 - intensity) * (size_w - size_h) / 2 + (intensity) * (size_w - size) / 2)
 
-        blurred_resized = blurred.resize((new_size(), new_size()))
-
-        img.paste(blurred_resized, (new_offset(size_h * 2), 0))
+        # пересэмплируется только видимая часть размытого фона
+        visible = zoom.render((new_size(), new_size()), (new_offset(size_h * 2), 0))
 
-        img = Image.alpha_composite(img, shade_image)
-
-        rounded = add_corners(image, 40)
-        img.paste(rounded, (160, 246), rounded)
+        return layers.render(visible, (0, 0))
 
-        img = add_text(img, beat_name, asset_path["beat_name"], 25, (255, 255, 255, 255),
-                       (size_w / 2, 50 + 400 + 246 + 11), 20)
-        img = add_text(img, author_name, asset_path["author_name"], 22, (255, 255, 255, int(0.6 * 255)),
-                       (size_w / 2, 11 + 50 + 400 + 246 + 12 + 16 + 11), 20)
-
-        return img
-
-    def create_save_frame_img(number, maxNumbers, intensity, image, blurred):
-        new_img = create_save_frame_img_proto(intensity, image, blurred)
+    def create_save_frame_img(number, maxNumbers, intensity, layers, zoom):
+        new_img = create_save_frame_img_proto(intensity, layers, zoom)
         new_img.save('{}/frames/img{}.png'.format(temp_path, str(number).zfill(maxNumbers)))
 
     def process2(i):
@@ -163,39 +257,112 @@ def process_track(smooth, temp_path, song_path, image_path, beat_name, author_na
         frame_to_time = float(i) / float(framerate)
         audio_time_sample = int(frame_to_time * sr)
 
-        if audio_time_sample < len(y_percussive):
+        if audio_time_sample < meta["samples"]:
             intensity = y_perc[audio_time_sample]
 
-            create_save_frame_img(i, max_numbers, intensity, original_image, blurred_image)
+            create_save_frame_img(i, max_numbers, intensity, frame_layers, background_zoom)
+
+    def render_frame(i):
+        frame_to_time = float(i) / float(framerate)
+        audio_time_sample = int(frame_to_time * sr)
+
+        if audio_time_sample < meta["samples"]:
+            return create_save_frame_img_proto(y_perc[audio_time_sample], frame_layers, background_zoom).tobytes()
+
+        return None
+
+    def stream_video():
+        # кадры и звук идут в один процесс ffmpeg, фрагментированный mp4 пишется в output_file по мере
+        # кодирования (только дописывается), поэтому файл можно отдавать клиенту, пока рендер идет
+        command = ["ffmpeg", "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{}x{}".format(size_w, size_h),
+                   "-framerate", str(framerate), "-i", "-",
+                   "-i", song_file(), "-map", "0:v", "-map", "1:a",
+                   "-c:v", "libx264", "-b:v", "4108k", "-pix_fmt", "yuv420p", "-g", str(framerate),
+                   "-threads", str(threads), "-c:a", "aac", "-shortest",
+                   "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", "pipe:1"]
+
+        encoder = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def copy_output():
+            with open(output_file, "wb") as output:
+                for chunk in iter(lambda: encoder.stdout.read1(1 << 16), b""):
+                    output.write(chunk)
+                    output.flush()
+
+        copier = threading.Thread(target=copy_output, daemon=True)
+        copier.start()
+
+        # пачки меньше, чем для png: готовые кадры возвращаются из воркеров в память
+        batch = n_jobs * 2
+        report("frames", 0, total_frames)
+
+        try:
+            with Parallel(n_jobs=n_jobs, verbose=0 if progress else total_frames) as parallel:
+                for start in range(0, total_frames, batch):
+                    for frame in parallel(delayed(render_frame)(i)
+                                          for i in range(start, min(start + batch, total_frames))):
+                        if frame is not None:
+                            encoder.stdin.write(frame)
+                    report("frames", min(start + batch, total_frames), total_frames)
+
+            encoder.stdin.close()
+        except BaseException:
+            encoder.kill()
+            raise
+        finally:
+            return_code = encoder.wait()
+            copier.join()
+
+        if return_code != 0:
+            raise RuntimeError("ffmpeg exited with code {}".format(return_code))
+
+    frame_layers = static_layers(original_image)
+    background_zoom = ZoomLayer(blurred_image, size_w, size_h)
 
     if dbg:
-        display(create_save_frame_img_proto(0.0, original_image, blurred_image))
+        display(create_save_frame_img_proto(0.0, frame_layers, background_zoom))
         return
 
     print("Cleaning old frames")
 
     clean_frames()
 
-    print("Initing frames directory")
-
-    init_frames()
-
-    duration = math.ceil(librosa.get_duration(y=y))
+    duration = math.ceil(meta["duration"])
 
     total_frames = duration * framerate
 
     max_numbers = int(math.log10(total_frames)) + 1
 
+    if single_pass:
+        print("Generation and encoding")
+
+        stream_video()
+        return
+
+    print("Initing frames directory")
+
+    init_frames()
+
     print("Generation")
 
-    Parallel(n_jobs=8, verbose=total_frames)(delayed(process2)(i) for i in range(total_frames))
+    # кадры отправляются пачками, между пачками сообщается прогресс и проверяется отмена
+    batch = n_jobs * 16
+    report("frames", 0, total_frames)
+
+    with Parallel(n_jobs=n_jobs, verbose=0 if progress else total_frames) as parallel:
+        for start in range(0, total_frames, batch):
+            parallel(delayed(process2)(i) for i in range(start, min(start + batch, total_frames)))
+            report("frames", min(start + batch, total_frames), total_frames)
 
     print("Starting assembling")
 
+    report("encoding")
     assemble_video()
 
     print("Attaching audio")
 
+    report("muxing")
     attach_audio()
 
     clean_frames()
@@ -0,0 +1,106 @@
+import hashlib
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+DEFAULT_SPILL_BYTES = 32 * 1024 * 1024
+
+
+@dataclass
+class Upload:
+    """
+    Uploaded file kept in memory, or on disk when it was larger than the spill threshold.
+    digest is the sha256 of the content, computed while the upload was received.
+    """
+
+    filename: str
+    digest: str
+    size: int
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+
+    def open(self) -> BinaryIO:
+        return io.BytesIO(self.data) if self.data is not None else open(self.path, "rb")
+
+    def materialize(self, directory: str) -> str:
+        # для программ, которым нужен файл (ffmpeg при сведении звука)
+        if self.path is None:
+            path = os.path.join(directory, "{}{}".format(self.digest[:16], os.path.splitext(self.filename)[1]))
+            with open(path, "wb") as file:
+                file.write(self.data)
+            self.path = path
+
+        return self.path
+
+    def discard(self) -> None:
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadBuffer(io.RawIOBase):
+    """
+    Stream the multipart parser writes an uploaded file into. Hashes the content as it arrives and keeps it
+    in memory until spill_bytes, then moves it to a file in directory.
+    """
+
+    def __init__(self, directory: str, spill_bytes: int = DEFAULT_SPILL_BYTES) -> None:
+        super().__init__()
+        self.directory = directory
+        self.spill_bytes = spill_bytes
+        self.size = 0
+        self.path: Optional[str] = None
+        self.__digest = hashlib.sha256()
+        self.__stream: BinaryIO = io.BytesIO()
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.path is None and self.size + len(data) > self.spill_bytes:
+            self.__spill()
+
+        self.__digest.update(data)
+        self.size += len(data)
+        return self.__stream.write(data)
+
+    def __spill(self):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=self.directory, prefix="upload-")
+
+        spilled = os.fdopen(fd, "w+b")
+        spilled.write(self.__stream.getbuffer())
+        self.__stream = spilled
+
+    def readinto(self, buffer) -> int:
+        return self.__stream.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.__stream.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.__stream.tell()
+
+    def close(self) -> None:
+        self.__stream.close()
+        super().close()
+
+    def discard(self) -> None:
+        # загрузка отклонена до передачи задаче: файл, в который она перенесена, удаляется
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def upload(self, filename: str) -> Upload:
+        if self.path is None:
+            return Upload(filename, self.__digest.hexdigest(), self.size, data=self.__stream.getvalue())
+
+        self.__stream.flush()
+        return Upload(filename, self.__digest.hexdigest(), self.size, path=self.path)
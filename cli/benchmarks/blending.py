@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+here = os.path.dirname(__file__)
+sys.path.append(os.path.join(here, '..'))
+
+from services.blending import OverlayBlender
+
+
+def initArgParse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]...",
+        description="Benchmarks fixed-point overlay blending against blend_modes.overlay and checks the difference"
+    )
+
+    parser.add_argument("--width", help="frame width", type=int, default=720, required=False)
+    parser.add_argument("--height", help="frame height", type=int, default=1280, required=False)
+    parser.add_argument("-b", "--batch", help="frames per batch", type=int, default=4, required=False)
+    parser.add_argument("-r", "--repeats", help="best of N runs", type=int, default=3, required=False)
+    parser.add_argument("--tolerance", help="allowed max abs difference per channel",
+                        type=int, default=1, required=False)
+
+    return parser
+
+
+def best_of(repeats: int, fn) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    import blend_modes
+
+    args = initArgParse().parse_args()
+
+    rng = np.random.default_rng(0)
+    shape = (args.batch, args.height, args.width, 4)
+    images = rng.integers(0, 256, shape, dtype=np.uint8)
+    layers = rng.integers(0, 256, shape, dtype=np.uint8)
+
+    # типичные случаи шаблонов: непрозрачные области и полностью прозрачные области
+    images[:, :args.height // 4, :, 3] = 255
+    layers[:, :args.height // 4, :, 3] = 255
+    images[:, args.height // 4:args.height // 2, :, 3] = 0
+
+    report = {"shape": list(shape), "opacities": {}}
+    failures = []
+
+    for opacity in (0.0, 0.25, 0.5, 0.8, 1.0):
+        blender = OverlayBlender(opacity)
+        out = np.empty_like(images)
+
+        reference = np.stack([np.uint8(blend_modes.overlay(image.astype(float), layer.astype(float), opacity))
+                              for image, layer in zip(images, layers)])
+        blended = blender.blend(images, layers, out=out)
+        diff = np.abs(reference.astype(np.int16) - blended.astype(np.int16))
+
+        reference_seconds = best_of(args.repeats, lambda: blend_modes.overlay(
+            images[0].astype(float), layers[0].astype(float), opacity))
+        frame_seconds = best_of(args.repeats, lambda: blender.blend(images[0], layers[0], out=out[0]))
+        batch_seconds = best_of(args.repeats, lambda: blender.blend(images, layers, out=out))
+
+        report["opacities"][str(opacity)] = {
+            "blend_modes_seconds": reference_seconds,
+            "frame_seconds": frame_seconds,
+            "batch_seconds_per_frame": batch_seconds / args.batch,
+            "max_abs_diff": int(diff.max()),
+            "differing_fraction": float(np.mean(diff > 0))
+        }
+
+        if diff.max() > args.tolerance:
+            failures.append(f"opacity {opacity}: max abs diff {int(diff.max())} > {args.tolerance}")
+
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
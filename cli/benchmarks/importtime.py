@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+cli_root = os.path.join(here, '..')
+repo_root = os.path.join(cli_root, '..')
+
+HEAVY_MODULES = ("librosa", "scipy", "PIL", "blend_modes", "joblib", "natsort", "matplotlib")
+
+# команды, которые должны стартовать без тяжелых зависимостей
+LIGHT_COMMANDS = {
+    "cli --help": ([os.path.join(cli_root, "cli.py"), "--help"], cli_root),
+    "cli --version": ([os.path.join(cli_root, "cli.py"), "--version"], cli_root),
+    "histo-cli --help": ([os.path.join(repo_root, "histo-cli", "cli.py"), "--help"],
+                         os.path.join(repo_root, "histo-cli")),
+}
+
+# модули, которые импортирует каждый воркер joblib при распаковке генератора
+WORKER_MODULES = ("services.frames",)
+
+
+def initArgParse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]...",
+        description="Reports startup import time (python -X importtime) of the CLI entry points"
+    )
+
+    parser.add_argument("-n", "--top", help="number of slowest modules to report per command",
+                        type=int, default=10, required=False)
+    parser.add_argument("--baseline", help="compare with a previous JSON report and fail on regressions",
+                        type=str, required=False)
+    parser.add_argument("--tolerance", help="allowed slowdown against baseline, fraction",
+                        type=float, default=0.5, required=False)
+
+    return parser
+
+
+def parse_importtime(stderr: str):
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+
+        # вложенность модуля задается отступом в два пробела на уровень
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append({"module": name.strip(), "level": level,
+                        "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+
+    return modules
+
+
+def measure(argv, cwd, top: int) -> dict:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime"] + argv, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+
+    modules = parse_importtime(result.stderr)
+    top_level = [module for module in modules if module["level"] == 0]
+    heavy = sorted({module["module"].split(".")[0] for module in modules
+                    if module["module"].split(".")[0] in HEAVY_MODULES})
+
+    return {
+        "wall_ms": wall * 1000.0,
+        "import_ms": sum(module["cumulative_us"] for module in top_level) / 1000.0,
+        "heavy_modules": heavy,
+        "slowest": sorted(top_level, key=lambda module: -module["cumulative_us"])[:top]
+    }
+
+
+def main() -> None:
+    args = initArgParse().parse_args()
+
+    report = {"light": {}, "worker": {}}
+
+    for name, (argv, cwd) in LIGHT_COMMANDS.items():
+        report["light"][name] = measure(argv, cwd, args.top)
+
+    for module in WORKER_MODULES:
+        report["worker"][module] = measure(["-c", f"import {module}"], cli_root, args.top)
+
+    failures = [f"{name} imports {', '.join(result['heavy_modules'])}"
+                for name, result in report["light"].items() if result["heavy_modules"]]
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+        for group in ("light", "worker"):
+            for name, result in report[group].items():
+                previous = baseline.get(group, {}).get(name)
+                if previous and result["import_ms"] > previous["import_ms"] * (1.0 + args.tolerance):
+                    failures.append(f"{name} import time {result['import_ms']:.1f}ms, "
+                                    f"baseline {previous['import_ms']:.1f}ms")
+
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+here = os.path.dirname(__file__)
+sys.path.append(os.path.join(here, '..'))
+
+from services.smoothing import SMOOTHING_ENGINES, SmootherLoader
+
+
+def initArgParse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]...",
+        description="Benchmarks envelope smoothing engines against the reference convolution"
+    )
+
+    parser.add_argument("-d", "--duration", help="synthetic track duration, seconds",
+                        type=float, default=180.0, required=False)
+    parser.add_argument("-sr", "--sample_rate", help="synthetic track sample rate",
+                        type=int, default=22050, required=False)
+    parser.add_argument("-s", "--smooth", help="smooth factor, as in cli.py",
+                        type=int, default=8, required=False)
+    parser.add_argument("-r", "--repeats", help="best of N runs",
+                        type=int, default=3, required=False)
+
+    return parser
+
+
+def main() -> None:
+    args = initArgParse().parse_args()
+
+    rng = np.random.default_rng(0)
+    signal = np.abs(rng.standard_normal(int(args.duration * args.sample_rate))).astype(np.float32)
+    kernel_size = int(float(args.sample_rate) / float(args.smooth))
+
+    reference = SmootherLoader.load("convolve").smooth(signal, kernel_size)
+    report = {"samples": len(signal), "kernel_size": kernel_size, "engines": {}}
+
+    for engine in SMOOTHING_ENGINES:
+        smoother = SmootherLoader.load(engine)
+        timings = []
+
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            smoothed = smoother.smooth(signal, kernel_size)
+            timings.append(time.perf_counter() - start)
+
+        report["engines"][engine] = {
+            "seconds": min(timings),
+            "samples_per_second": len(signal) / min(timings),
+            "max_abs_diff_vs_convolve": float(np.max(np.abs(smoothed - reference))),
+            "length_matches": len(smoothed) == len(reference)
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+sys.path.append(os.path.join(here, '..', '..', 'histo-cli'))
+
+STAGES = ("audio_load", "hpss", "smoothing", "planning", "decode_templates", "composite_classic",
+          "composite_blender", "encode_png", "encode_stream", "histos")
+
+# длины шаблонов как у blender-сцен: main, user info, overlay
+TEMPLATE_LENGTHS = {"scene": 90, "user_info": 105, "overlay": 30}
+
+# для кодирования хватает нескольких разных кадров, остальные повторяются
+ENCODE_POOL_SIZE = 8
+
+MIN_STAGE_SECONDS = 1.0
+MAX_STAGE_REPEATS = 1000
+
+
+def initArgParse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTION]...",
+        description="Times every pipeline stage separately on synthetic beats and template sequences "
+                    "(no blender, no network) and reports throughput and peak memory"
+    )
+
+    parser.add_argument("-d", "--duration", help="synthetic track duration, seconds",
+                        type=float, default=180.0, required=False)
+    parser.add_argument("-sr", "--sample_rate", help="synthetic track sample rate",
+                        type=int, default=22050, required=False)
+    parser.add_argument("-f", "--framerate", help="video framerate, as in cli.py",
+                        type=int, default=30, required=False)
+    parser.add_argument("-s", "--smooth", help="smooth factor, as in cli.py",
+                        type=int, default=8, required=False)
+    parser.add_argument("--width", help="frame width", type=int, default=720, required=False)
+    parser.add_argument("--height", help="frame height", type=int, default=1280, required=False)
+    parser.add_argument("--frames", help="frames composited and encoded per stage",
+                        type=int, default=60, required=False)
+    parser.add_argument("--histos", help="histos count, as in histo-cli",
+                        type=int, default=90, required=False)
+    parser.add_argument("--stages", help="stages to run (default: all)", nargs="+",
+                        choices=STAGES, default=list(STAGES), required=False)
+    parser.add_argument("-r", "--repeats", help="best of N runs",
+                        type=int, default=1, required=False)
+    parser.add_argument("--no-memory", required=False, default=False, action='store_true',
+                        help="skip the extra traced run that measures peak memory of every stage")
+    parser.add_argument("--workdir", help="keep generated beats and template sequences here and reuse them "
+                                          "on later runs (default: temporary directory)",
+                        type=str, required=False)
+    parser.add_argument("--baseline", help="compare with a previous JSON report and fail on regressions",
+                        type=str, required=False)
+    parser.add_argument("--tolerance", help="allowed throughput loss and memory growth against baseline, fraction",
+                        type=float, default=0.5, required=False)
+
+    return parser
+
+
+def synthetic_beat(duration: float, sample_rate: int, bpm: float = 140.0) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(duration * sample_rate)) / float(sample_rate)
+
+    # гармоническая часть -- аккорд, ударная -- бочка на каждую долю и хэты на восьмые
+    harmonic = sum(np.sin(2 * np.pi * frequency * t) for frequency in (110.0, 138.6, 164.8)) / 3.0
+    kick = np.exp(-((t * bpm / 60.0) % 1.0) * 30.0) * np.sin(2 * np.pi * 55.0 * t)
+    hats = np.exp(-((t * bpm / 30.0) % 1.0) * 80.0) * rng.standard_normal(len(t))
+
+    y = 0.4 * harmonic + 0.5 * kick + 0.1 * hats
+    return (y / np.max(np.abs(y))).astype(np.float32)
+
+
+def write_wav(path: Path, y: np.ndarray, sample_rate: int) -> None:
+    with wave.open(str(path), 'wb') as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        file.writeframes((y * 32767).astype('<i2').tobytes())
+
+
+def synthetic_sequence(directory: Path, name: str, count: int, width: int, height: int) -> List[Path]:
+    from PIL import Image
+
+    # кадры как у blender: RGBA PNG; сцена непрозрачная, у user info и оверлея есть прозрачные области
+    directory.mkdir(parents=True, exist_ok=True)
+    y, x = np.mgrid[0:height, 0:width]
+    rng = np.random.default_rng(len(name))
+    paths = []
+
+    for i in range(count):
+        path = directory / f"{i}.png"
+        paths.append(path)
+
+        if path.exists():
+            continue
+
+        frame = np.zeros((height, width, 4), dtype=np.uint8)
+        phase = i / float(count)
+
+        if name == "scene":
+            frame[..., 0] = (x * 255 // width + int(phase * 255)) % 256
+            frame[..., 1] = (y * 255 // height) % 256
+            frame[..., 2] = int(phase * 255)
+            frame[..., 3] = 255
+        elif name == "user_info":
+            top = int(height * (0.2 + 0.3 * phase))
+            frame[top:top + height // 4, width // 8:width * 7 // 8] = (240, 240, 240, 255)
+        else:
+            frame[..., :3] = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            frame[..., 3] = np.where((x + y + i * 8) % 64 < 32, 255, 0)
+
+        Image.fromarray(frame, "RGBA").save(path, compress_level=1)
+
+    return paths
+
+
+def prepare_inputs(workdir: Path, args) -> Tuple[Path, Dict[str, List[Path]], Path, Path]:
+    from PIL import Image, ImageDraw
+
+    beat_path = workdir / f"beat_{args.duration:g}s_{args.sample_rate}.wav"
+    if not beat_path.exists():
+        write_wav(beat_path, synthetic_beat(args.duration, args.sample_rate), args.sample_rate)
+
+    sequences = {name: synthetic_sequence(workdir / f"{name}_{args.width}x{args.height}", name, count,
+                                          args.width, args.height)
+                 for name, count in TEMPLATE_LENGTHS.items()}
+
+    avatar_path = workdir / "avatar.png"
+    if not avatar_path.exists():
+        avatar = Image.new("RGB", (1024, 1024), (200, 40, 120))
+        ImageDraw.Draw(avatar).ellipse((256, 256, 768, 768), fill=(40, 120, 220))
+        avatar.save(avatar_path)
+
+    shade_path = workdir / f"shade_{args.width}x{args.height}.png"
+    if not shade_path.exists():
+        alpha = np.linspace(0, 200, args.height, dtype=np.float32)[:, None].repeat(args.width, axis=1)
+        shade = np.zeros((args.height, args.width, 4), dtype=np.uint8)
+        shade[..., 3] = alpha.astype(np.uint8)
+        Image.fromarray(shade, "RGBA").save(shade_path)
+
+    return beat_path, sequences, avatar_path, shade_path
+
+
+def best_of(repeats: int, fn: Callable[[], None]) -> float:
+    timings = []
+
+    # короткие этапы повторяются, пока не наберется MIN_STAGE_SECONDS, иначе шум больше самого замера
+    while len(timings) < repeats or (sum(timings) < MIN_STAGE_SECONDS and len(timings) < MAX_STAGE_REPEATS):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def peak_memory(fn: Callable[[], None]) -> float:
+    # учитываются аллокации python и numpy; буферы PIL и память ffmpeg сюда не попадают
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def measure(fn: Callable[[], None], count: int, unit: str, repeats: int, memory: bool) -> dict:
+    seconds = best_of(repeats, fn)
+
+    result = {
+        "seconds": seconds,
+        unit: count,
+        f"{unit}_per_second": count / seconds if seconds > 0 else float("inf"),
+    }
+
+    if memory:
+        result["peak_memory_mb"] = peak_memory(fn)
+
+    return result
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    failures = []
+
+    for name, result in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if not previous:
+            continue
+
+        for key, value in result.items():
+            if key.endswith("_per_second") and key in previous and value < previous[key] / (1.0 + tolerance):
+                failures.append(f"{name} {key} {value:.1f}, baseline {previous[key]:.1f}")
+
+        if "peak_memory_mb" in result and "peak_memory_mb" in previous \
+                and result["peak_memory_mb"] > previous["peak_memory_mb"] * (1.0 + tolerance):
+            failures.append(f"{name} peak memory {result['peak_memory_mb']:.1f}MB, "
+                            f"baseline {previous['peak_memory_mb']:.1f}MB")
+
+    return failures
+
+
+def run(args, workdir: Path) -> dict:
+    import librosa
+    from PIL import Image
+
+    from services.audio import AudioIngest
+    from services.smoothing import SmootherLoader
+    from services.plan import RenderPlanner
+    from services.layers import Layer, LayerCompositor, ZoomLayer
+    from services.sequences import SequenceStore
+    from services.video import VideoStreamWriter
+    from services.waveforms import WaveformGeneratorParams
+    from services.graphics import GraphicsGeneratorParams
+    from services.frames import FrameGeneratorParams, UGCParams, ProcessingCache, FrameGenerator, \
+        FrameGeneratorLegacy
+    from histos import Histos
+    from packer import Packer
+
+    beat_path, sequences, avatar_path, shade_path = prepare_inputs(workdir, args)
+
+    y = AudioIngest(args.sample_rate).load(str(beat_path))
+    kernel_size = int(float(args.sample_rate) / float(args.smooth))
+    smoothed = SmootherLoader.load("cumsum").smooth(np.abs(y), kernel_size)
+    intensities = 0.5 * (smoothed - smoothed.min()) / (smoothed.max() - smoothed.min())
+
+    total_frames_count = int(np.ceil(args.duration)) * args.framerate
+    lengths = {name: len(sequence) for name, sequence in sequences.items()}
+    plan = RenderPlanner.blender(intensities, args.sample_rate, args.framerate, total_frames_count,
+                                 lengths["scene"], lengths["user_info"], lengths["overlay"], False)
+
+    # композитинг идет по кадрам сразу после интро, где сцена уже выбирается по интенсивности
+    frames = plan[lengths["scene"]:lengths["scene"] + args.frames]
+    frames = frames[~frames['skip']]
+
+    generator_params = FrameGeneratorParams(
+        shade_path=str(shade_path),
+        output_path=str(workdir),
+        waveform_generator=None,
+        graphics_generator=None,
+        jobs=1
+    )
+
+    ugc_params = UGCParams(
+        username="benchmark",
+        track_name="benchmark",
+        avatar_path=str(avatar_path),
+        avatar_size=400,
+        framerate=args.framerate,
+        width=args.width,
+        height=args.height,
+        blur_radius=50,
+        overlay_opacity=0.25,
+        waveform_generator_params=WaveformGeneratorParams(args.smooth, 0.5, 0.5, 0.5, 1.0, 1.0),
+        graphics_generator_params=GraphicsGeneratorParams(1, 1, 1, False)
+    )
+
+    report = {
+        "inputs": {
+            "duration": args.duration,
+            "sample_rate": args.sample_rate,
+            "samples": len(y),
+            "width": args.width,
+            "height": args.height,
+            "frames": len(frames),
+            "template_frames": lengths
+        },
+        "stages": {}
+    }
+
+    stages: Dict[str, Tuple[Callable[[], None], int, str]] = {}
+    memory = not args.no_memory
+
+    stages["audio_load"] = (lambda: AudioIngest(args.sample_rate).load(str(beat_path)), len(y), "samples")
+    stages["hpss"] = (lambda: librosa.effects.hpss(y), len(y), "samples")
+    stages["smoothing"] = (lambda: SmootherLoader.load("cumsum").smooth(np.abs(y), kernel_size), len(y), "samples")
+    stages["planning"] = (lambda: (
+        RenderPlanner.legacy(intensities, args.sample_rate, args.framerate, total_frames_count),
+        RenderPlanner.blender(intensities, args.sample_rate, args.framerate, total_frames_count,
+                              lengths["scene"], lengths["user_info"], lengths["overlay"], False)
+    ), total_frames_count, "frames")
+
+    def decode_templates():
+        with SequenceStore(jobs=1) as store:
+            for name in sequences:
+                store.put(name, sequences[name], np.arange(lengths[name]))
+
+    stages["decode_templates"] = (decode_templates, sum(lengths.values()), "frames")
+
+    # кэш классического режима собирается так же, как в FrameGeneratorLegacy.process
+    classic = FrameGeneratorLegacy(generator_params, ugc_params, False)
+    classic_cache = ProcessingCache()
+    avatar = Image.open(avatar_path).convert("RGBA").resize((ugc_params.avatar_size, ugc_params.avatar_size))
+    background = Image.open(avatar_path).convert("RGBA").resize((args.height, args.height))
+    classic_cache.zoom = ZoomLayer(background, args.width, args.height)
+    classic_cache.layers = LayerCompositor(args.width, args.height,
+                                           [Layer(Image.open(shade_path)), Layer(avatar, (160, 246))])
+    classic_plan = RenderPlanner.legacy(intensities, args.sample_rate, args.framerate, total_frames_count)
+    classic_frames = classic_plan[frames['frame']]
+
+    stages["composite_classic"] = (lambda: [classic.render(classic_cache, frame) for frame in classic_frames],
+                                   len(classic_frames), "frames")
+
+    blender = FrameGenerator(generator_params, ugc_params, False)
+    blender_cache = ProcessingCache()
+    store = SequenceStore(jobs=1)
+
+    try:
+        blender_cache.scene_frames = store.put("scene", sequences["scene"], frames['scene'])
+        blender_cache.user_info_frames = store.put("user_info", sequences["user_info"], frames['user_info'])
+        blender_cache.overlay_frames = store.put("overlay", sequences["overlay"], frames['overlay'])
+
+        stages["composite_blender"] = (lambda: [blender.render(blender_cache, frame) for frame in frames],
+                                       len(frames), "frames")
+
+        pool = [blender.render(blender_cache, frame).convert("RGB") for frame in frames[:ENCODE_POOL_SIZE]]
+        raw_pool = [image.tobytes() for image in pool]
+        png_dir = workdir / "encoded"
+        png_dir.mkdir(exist_ok=True)
+
+        def encode_png():
+            for i in range(len(frames)):
+                pool[i % len(pool)].save(png_dir / f"img{i}.png")
+
+        def encode_stream():
+            with VideoStreamWriter(str(workdir / "encoded.mp4"), args.width, args.height, args.framerate) as writer:
+                for i in range(len(frames)):
+                    writer.write(i, raw_pool[i % len(raw_pool)])
+
+        stages["encode_png"] = (encode_png, len(frames), "frames")
+        if shutil.which("ffmpeg"):
+            stages["encode_stream"] = (encode_stream, len(frames), "frames")
+
+        raw_intensities = np.asarray(intensities)
+        stages["histos"] = (lambda: Packer().pack(Histos(args.histos).process(raw_intensities)),
+                            len(raw_intensities), "samples")
+
+        for name in args.stages:
+            if name not in stages:
+                report["stages"][name] = {"skipped": "ffmpeg not found"}
+                continue
+
+            fn, count, unit = stages[name]
+            report["stages"][name] = measure(fn, count, unit, args.repeats, memory)
+    finally:
+        store.close()
+
+    return report
+
+
+def main() -> None:
+    args = initArgParse().parse_args()
+
+    if args.workdir:
+        workdir = Path(args.workdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+    else:
+        workdir = Path(tempfile.mkdtemp(prefix="ugc-benchmark-"))
+
+    try:
+        report = run(args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = []
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+        # пропускная способность зависит от размеров входов (кэш процессора), сравнивать можно только равные
+        if baseline.get("inputs") != report["inputs"]:
+            failures = [f"baseline inputs {baseline.get('inputs')} differ from {report['inputs']}"]
+        else:
+            failures = compare(report, baseline, args.tolerance)
+
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
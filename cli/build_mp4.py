@@ -1,3 +1,19 @@
 import os
+import subprocess
 
-os.system('ffmpeg -framerate 30 -i output/final/img%04d.png -i tests/sources/shum.mp3 -c:v libx264 -c:a aac -pix_fmt yuv420p -r 30 output.mp4')
\ No newline at end of file
+from settings import FINAL_RENDER
+from services.video import ConcatManifest
+
+FRAMERATE = 30
+AUDIO_PATH = 'tests/sources/shum.mp3'
+
+manifest_path = ConcatManifest.resolve_path(FINAL_RENDER)
+
+if os.path.exists(manifest_path):
+    # кадры сохранены с --dedupe: каждый кадр записан один раз, длительности -- в манифесте
+    subprocess.run(ConcatManifest.command(manifest_path, 'output.mp4', FRAMERATE,
+                                          ConcatManifest.frames_count(manifest_path, FRAMERATE), AUDIO_PATH),
+                   check=True)
+else:
+    os.system(f'ffmpeg -framerate {FRAMERATE} -i {FINAL_RENDER}/img%04d.png -i {AUDIO_PATH} -c:v libx264 -c:a aac '
+              f'-pix_fmt yuv420p -r {FRAMERATE} output.mp4')
@@ -2,10 +2,12 @@ import argparse
 import os
 import zipfile
 
-from services.graphics import GraphicsGeneratorParams, GraphicsGeneratorLoader
-from services.waveforms import WaveformLoader, WaveformGeneratorParams
 import sys
-from services.frames import FrameGeneratorParams, UGCParams, FrameGeneratorLoader
+from services.enums import SMOOTHING_ENGINES, ANALYSIS_MODES, PREVIEW_TYPES, DEFAULT_SAMPLE_RATE, LOW_SAMPLE_RATE
+from settings import RENDER_CACHE, BLENDER_PATH
+
+# тяжелые зависимости (librosa, scipy, PIL, joblib) импортируются только там, где нужны,
+# чтобы --help, --version и --output_type raw стартовали быстро
 
 
 def initArgParse() -> argparse.ArgumentParser:
@@ -62,8 +64,18 @@ def initArgParse() -> argparse.ArgumentParser:
     # General Options
     def add_general_arguments() -> None:
         general.add_argument("-j", "--jobs",
-                             help="number of parallel jobs",
-                             type=int, default=16, required=False)
+                             help="number of cpu cores to use (frame workers, analysis and encoder threads). "
+                                  "defaults to all cores, fewer are used when the cpu budget has fewer free",
+                             type=int, default=os.cpu_count() or 1, required=False)
+
+        general.add_argument("--cpu-budget",
+                             help="cpu cores shared by all concurrent runs on this host, a run takes up to "
+                                  "--jobs of the free cores and waits only while none is free. "
+                                  "defaults to all cores",
+                             type=int, required=False)
+
+        general.add_argument("--no-cpu-budget", required=False, default=False,
+                             action='store_true', help="do not wait for free cores, use --jobs as is")
 
         general.add_argument("-v", "--verbose",
                              help="verbose computations",
@@ -71,10 +83,65 @@ def initArgParse() -> argparse.ArgumentParser:
 
         general.add_argument("--output_type", help="select output presentation. available types: \n "
                                                    "* frames (--output_type=frames) \n"
+                                                   "* video (--output_type=video, -o is .mp4 file or directory)\n"
                                                    "* raw (--output_type=raw)\n"
-                                                   "* preview (--output_type=preview)\n",
+                                                   "* preview (--output_type=preview, a draft in a few seconds, "
+                                                   "-o is a file or directory)\n",
                              default="frames", type=str, required=False)
 
+        general.add_argument("--preview-type",
+                             help="preview output: clip (short low framerate video of the loudest part) | "
+                                  "sheet (png contact sheet of frames at intensity peaks)",
+                             default="clip", choices=PREVIEW_TYPES, type=str, required=False)
+
+        general.add_argument("--preview-scale",
+                             help="preview frame size relative to --width and --height",
+                             type=float, default=0.25, required=False)
+
+        general.add_argument("--preview-framerate",
+                             help="preview clip framerate",
+                             type=int, default=10, required=False)
+
+        general.add_argument("--preview-duration",
+                             help="preview clip length in seconds",
+                             type=float, default=10.0, required=False)
+
+        general.add_argument("--preview-frames",
+                             help="number of frames on the preview contact sheet",
+                             type=int, default=12, required=False)
+
+        general.add_argument("--intensity-levels",
+                             help="classic mode: quantize intensity to N levels and render each level only once",
+                             type=int, required=False)
+
+        general.add_argument("--frame-cache-size",
+                             help="number of rendered levels kept in memory in video output mode",
+                             type=int, default=64, required=False)
+
+        general.add_argument("--plan_path",
+                             help="save render plan (per-frame intensity and template indices) as .npy",
+                             type=str, required=False)
+
+        general.add_argument("--sequence-store-dir",
+                             help="blender mode: directory for decoded template frames shared by workers "
+                                  "(default: /dev/shm when it has room, otherwise system temp)",
+                             type=str, required=False)
+
+        general.add_argument("--background-reduce",
+                             help="classic mode: keep the blurred background reduced N times, "
+                                  "it is resampled per frame from the smaller copy",
+                             type=int, default=1, required=False)
+
+        general.add_argument("--chunk-size",
+                             help="frames per worker task (default: split the work into a few chunks per worker)",
+                             type=int, required=False)
+
+        general.add_argument("--dedupe",
+                             help="render each run of identical consecutive frames once; "
+                                  "frames output then holds only the first frame of every run "
+                                  "and frames.ffconcat, an ffmpeg concat manifest with durations",
+                             action='store_true', required=False, default=False)
+
     # Graphics Options
     def add_graphics_arguments() -> None:
         graphics.add_argument("--width",
@@ -127,12 +194,83 @@ def initArgParse() -> argparse.ArgumentParser:
                               help="path to shade image (alpha, .png) / only for classic mode",
                               type=str, default="sources/images/shade.png", required=False)
 
+        graphics.add_argument("--render-cache-dir",
+                              help="reuse blender renders of the same template, textures and resolution "
+                                   "stored in this directory",
+                              type=str, default=RENDER_CACHE, required=False)
+
+        graphics.add_argument("--render-cache-size",
+                              help="render cache size limit in megabytes, least recently used "
+                                   "renders are evicted",
+                              default=2048, type=int, required=False)
+
+        graphics.add_argument("--no-render-cache", required=False, default=False,
+                              action='store_true', help="always render blender templates")
+
+        graphics.add_argument("--blender-path",
+                              help="blender executable",
+                              type=str, default=BLENDER_PATH, required=False)
+
+        graphics.add_argument("--render-shards",
+                              help="split every template frame range across this many blender processes "
+                                   "(useful with --use-cpu)",
+                              type=int, default=1, required=False)
+
+        graphics.add_argument("--render-threads",
+                              help="render threads per blender process. by default cpu cores are divided "
+                                   "between all running blender processes when sharding",
+                              type=int, required=False)
+
+        graphics.add_argument("--render-timeout",
+                              help="fail a blender template render that takes longer than this many seconds",
+                              type=float, required=False)
+
+        graphics.add_argument("--blender-workers", required=False, default=False,
+                              action='store_true', help="keep a background blender process per template and "
+                                                        "send renders to it instead of starting blender every time")
+
     # Music Analyzer Options
     def add_music_analyzer_arguments() -> None:
         music_analyzer.add_argument("-s", "--smooth",
                                     help="set smooth factor by int value\nthe less -- the smoother",
                                     default=8, type=int, required=False)
 
+        music_analyzer.add_argument("--analysis_sample_rate",
+                                    help="sample rate the beat is decoded to before analysis, "
+                                         "{} is a cheap mode that is enough for a 30 fps envelope. "
+                                         "defaults to {} ({} for preview)"
+                                    .format(LOW_SAMPLE_RATE, DEFAULT_SAMPLE_RATE, LOW_SAMPLE_RATE),
+                                    type=int, required=False)
+
+        music_analyzer.add_argument("--pcm-cache-dir",
+                                    help="keep decoded mono float32 PCM in this directory and memory-map it "
+                                         "on later runs",
+                                    type=str, required=False)
+
+        music_analyzer.add_argument("--analysis-cache-dir",
+                                    help="reuse analysis results of the same beat and analyzer options "
+                                         "stored in this directory",
+                                    type=str, required=False)
+
+        music_analyzer.add_argument("--analysis-cache-size",
+                                    help="analysis cache size limit in megabytes, least recently used "
+                                         "entries are evicted",
+                                    default=512, type=int, required=False)
+
+        music_analyzer.add_argument("--analysis_mode",
+                                    help="set analysis mode: waveform | spectrogram | envelope\n"
+                                         "spectrogram skips HPSS resynthesis and returns one value per video frame, "
+                                         "envelope skips HPSS entirely and approximates the mix by the rms of "
+                                         "the whole signal (closest with equal influences and margins of 1.0). "
+                                         "defaults to waveform (envelope for preview)",
+                                    choices=ANALYSIS_MODES, type=str, required=False)
+
+        music_analyzer.add_argument("--smoothing",
+                                    help="set smoothing engine: {}\n"
+                                         "cumsum and convolve give the same box average, cumsum is O(N)"
+                                    .format(" | ".join(SMOOTHING_ENGINES)),
+                                    default="cumsum", choices=SMOOTHING_ENGINES, type=str, required=False)
+
         music_analyzer.add_argument("-w", "--widening",
                                     help="set widening factor by float value\nthe less -- the smoother",
                                     default=0.5, type=float, required=False)
@@ -169,6 +307,8 @@ def main() -> None:
     parser = initArgParse()
     args = parser.parse_args()
 
+    from services.waveforms import WaveformLoader, WaveformGeneratorParams
+
     try:
         if not args.mode.lower() == "blender" and not args.username:
             raise Exception('--username required while run in blender mode.')
@@ -176,15 +316,21 @@ def main() -> None:
         if not args.mode.lower() == "blender" and not args.track_name:
             raise Exception('--track_name required while run in blender mode.')
 
-        graphics_generator = GraphicsGeneratorLoader.load(args.verbose)
-        if args.output_type == "preview":
-            print(123)
+        # превью должно быть готово за секунды, поэтому по умолчанию анализ дешевый
+        preview = args.output_type == "preview"
+        analysis_sample_rate = args.analysis_sample_rate or (LOW_SAMPLE_RATE if preview else DEFAULT_SAMPLE_RATE)
+        analysis_mode = args.analysis_mode or ("envelope" if preview else "waveform")
 
         if args.demo:
             waveform_generator = WaveformLoader.load_demo(args.verbose)
             args.framerate = 2
+        elif args.analysis_cache_dir:
+            waveform_generator = WaveformLoader.load_cached(args.beat, args.analysis_cache_dir, args.verbose,
+                                                            args.analysis_cache_size * 1024 * 1024,
+                                                            analysis_sample_rate, args.pcm_cache_dir)
         else:
-            waveform_generator = WaveformLoader.load(args.beat, args.verbose)
+            waveform_generator = WaveformLoader.load(args.beat, args.verbose,
+                                                     analysis_sample_rate, args.pcm_cache_dir)
 
         waveform_generator_params = WaveformGeneratorParams(
             smooth_factor=args.smooth,
@@ -192,23 +338,62 @@ def main() -> None:
             percussive_influence=args.percussive_influence,
             harmonic_influence=args.harmonic_influence,
             percussive_margin=args.percussive_margin,
-            harmonic_margin=args.harmonic_margin
+            harmonic_margin=args.harmonic_margin,
+            smoothing=args.smoothing,
+            analysis_mode=analysis_mode,
+            analysis_rate=args.framerate
         )
 
-        graphics_generator_params = GraphicsGeneratorParams(
-            scene_template_id=args.template_id,
-            user_info_template_id=args.user_info_template_id,
-            overlay_template_id=args.overlay_template_id,
-            disable_intro=args.disable_intro
-        )
+        if args.output_type in ("frames", "video", "preview"):
+            from services.graphics import GraphicsGeneratorParams, GraphicsGeneratorLoader
+            from services.frames import FrameGeneratorParams, UGCParams, FrameGeneratorLoader
+            from services.preview import PreviewGenerator, PreviewParams
+            from services.cpu_budget import CpuBudget, limit_threads
+
+            # ядра берутся из общего бюджета хоста и делятся между воркерами кадров, BLAS и кодировщиком.
+            # превью короткое и не рендерит шаблоны, в очередь за ядрами оно не встает
+            if args.no_cpu_budget or preview:
+                lease, jobs, encoder_threads = None, args.jobs, None
+            else:
+                # свободные ядра берутся сразу, даже если их меньше --jobs: иначе запуск ждал бы,
+                # пока освободятся все ядра, а сервис держит часть из них постоянно
+                lease = CpuBudget(args.cpu_budget, verbose=args.verbose).acquire(args.jobs, min_cores=1)
+                jobs, encoder_threads = lease.split(args.output_type == "video")
+
+            graphics_generator = GraphicsGeneratorLoader.load(
+                args.verbose,
+                None if args.no_render_cache else args.render_cache_dir,
+                args.render_cache_size * 1024 * 1024,
+                args.blender_path,
+                args.use_cpu,
+                args.render_shards,
+                args.render_threads,
+                args.blender_workers,
+                args.render_timeout)
+
+            graphics_generator_params = GraphicsGeneratorParams(
+                scene_template_id=args.template_id,
+                user_info_template_id=args.user_info_template_id,
+                overlay_template_id=args.overlay_template_id,
+                disable_intro=args.disable_intro
+            )
 
-        if args.output_type == "frames":
             generator_params = FrameGeneratorParams(
                 shade_path=args.shade_path,
                 output_path=args.output_path,
                 waveform_generator=waveform_generator,
                 graphics_generator=graphics_generator,
-                jobs=args.jobs
+                jobs=jobs,
+                output_type=args.output_type,
+                audio_path=None if args.demo else args.beat,
+                intensity_levels=args.intensity_levels,
+                frame_cache_size=args.frame_cache_size,
+                plan_path=args.plan_path,
+                sequence_store_dir=args.sequence_store_dir,
+                background_reduce=args.background_reduce,
+                chunk_size=args.chunk_size,
+                dedupe=args.dedupe,
+                encoder_threads=encoder_threads
             )
 
             ugc_params = UGCParams(
@@ -225,7 +410,25 @@ def main() -> None:
                 graphics_generator_params=graphics_generator_params
             )
 
-            FrameGeneratorLoader.load(generator_params, ugc_params, args.verbose, args.mode).process()
+            try:
+                with limit_threads(lease.cores if lease else args.jobs):
+                    if preview:
+                        preview_params = PreviewParams(
+                            preview_type=args.preview_type,
+                            scale=args.preview_scale,
+                            framerate=args.preview_framerate,
+                            duration=args.preview_duration,
+                            sheet_frames=args.preview_frames
+                        )
+
+                        PreviewGenerator(generator_params, ugc_params, preview_params, args.verbose,
+                                         args.mode).process()
+                    else:
+                        FrameGeneratorLoader.load(generator_params, ugc_params, args.verbose, args.mode).process()
+            finally:
+                graphics_generator.close()
+                if lease is not None:
+                    lease.release()
 
         elif args.output_type == "raw":
             intensities = waveform_generator.process(waveform_generator_params)
@@ -0,0 +1,122 @@
+# модуль импортирует и сервис (app/cli_path.py), поэтому из CLI он берет только settings и services
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+ANALYSIS_VERSION = 1
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class AnalysisCache:
+    """
+    Content-addressed on-disk store of analysis results.
+    Entries are float32 .npy files opened memory-mapped, least recently used ones are evicted above max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES, verbose: bool = False) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.__verbose = verbose
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    @staticmethod
+    def file_digest(path: str, block_size: int = 1024 * 1024) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(audio_digest: str, params: dict) -> str:
+        payload = json.dumps({"audio": audio_digest, "params": params, "version": ANALYSIS_VERSION}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def __entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.npy"
+
+    def __meta_path(self, audio_digest: str, pipeline: str) -> Path:
+        # у CLI и сервиса разные поля метаданных, а каталог кэша может быть общим
+        return self.cache_dir / f"{audio_digest}.{pipeline}.json"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self.__entry_path(key)
+
+        try:
+            intensities = np.load(path, mmap_mode='r', allow_pickle=False)
+        except (FileNotFoundError, ValueError):
+            self.__logger(f"analysis cache miss {key[:12]}")
+            return None
+
+        # время модификации служит меткой последнего использования для вытеснения
+        os.utime(path)
+        self.__logger(f"analysis cache hit {key[:12]}")
+        return intensities
+
+    def put(self, key: str, intensities: np.ndarray) -> np.ndarray:
+        self.__atomic_write(self.__entry_path(key),
+                            lambda file: np.save(file, np.asarray(intensities, dtype=np.float32), allow_pickle=False))
+        self.evict()
+
+        cached = self.get(key)
+        return cached if cached is not None else np.asarray(intensities, dtype=np.float32)
+
+    def get_meta(self, audio_digest: str, pipeline: str, required: Sequence[str] = ()) -> Optional[dict]:
+        try:
+            with open(self.__meta_path(audio_digest, pipeline), 'r') as file:
+                meta = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # метаданные без нужных полей (например, записанные старой версией) считаются промахом
+        if not isinstance(meta, dict) or any(field not in meta for field in required):
+            self.__logger(f"analysis cache meta {audio_digest[:12]} is incomplete")
+            return None
+
+        return meta
+
+    def put_meta(self, audio_digest: str, pipeline: str, meta: dict) -> None:
+        self.__atomic_write(self.__meta_path(audio_digest, pipeline),
+                            lambda file: file.write(json.dumps(meta).encode()))
+
+    def __atomic_write(self, path: Path, write) -> None:
+        # запись во временный файл и переименование, чтобы параллельные запуски не читали недописанное
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                write(file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.cache_dir.glob("*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            self.__logger(f"analysis cache evicting {path.name}")
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,145 @@
+# модуль импортирует и сервис (app/cli_path.py), поэтому из CLI он берет только settings и services
+import hashlib
+import io
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from settings import FFMPEG_PATH
+from .enums import DEFAULT_SAMPLE_RATE
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class AudioIngest:
+    """
+    Decodes audio to mono float32 PCM once, optionally into a memory-mapped file reused by later runs.
+    Uses ffmpeg pipe when available, falls back to librosa otherwise.
+    """
+
+    def __init__(self, sample_rate: int = DEFAULT_SAMPLE_RATE, pcm_dir: Optional[str] = None,
+                 verbose: bool = False) -> None:
+        self.sample_rate = sample_rate
+        self.pcm_dir = Path(pcm_dir) if pcm_dir else None
+        self.__verbose = verbose
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    def pcm_path(self, path: str) -> Path:
+        stat = os.stat(path)
+        source = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        name = hashlib.sha256(source.encode()).hexdigest()[:16]
+        return self.pcm_dir / f"{name}_{self.sample_rate}.f32"
+
+    def load(self, path: str) -> np.ndarray:
+        if self.pcm_dir is None:
+            return self.__decode_to_memory(path)
+
+        pcm_path = self.pcm_path(path)
+
+        if not pcm_path.exists():
+            self.pcm_dir.mkdir(parents=True, exist_ok=True)
+            self.__decode_to_file(path, pcm_path)
+        else:
+            self.__logger(f"reusing decoded audio {pcm_path}")
+
+        if pcm_path.stat().st_size == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        return np.memmap(pcm_path, dtype=np.float32, mode='r')
+
+    def load_bytes(self, data: bytes, digest: Optional[str] = None, suffix: str = '') -> np.ndarray:
+        """
+        Decodes audio held in memory (an upload) without writing it to disk first.
+        With pcm_dir the decoded PCM is kept under the content digest.
+        """
+
+        if self.pcm_dir is not None and digest is not None:
+            pcm_path = self.pcm_dir / f"{digest[:16]}_{self.sample_rate}.f32"
+
+            if not pcm_path.exists():
+                self.pcm_dir.mkdir(parents=True, exist_ok=True)
+                y = self.__decode_bytes(data, suffix)
+                fd, temp_path = tempfile.mkstemp(dir=pcm_path.parent, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(y.tobytes())
+                os.replace(temp_path, pcm_path)
+            else:
+                self.__logger(f"reusing decoded audio {pcm_path}")
+
+            if pcm_path.stat().st_size == 0:
+                return np.zeros(0, dtype=np.float32)
+
+            return np.memmap(pcm_path, dtype=np.float32, mode='r')
+
+        return self.__decode_bytes(data, suffix)
+
+    def __decode_bytes(self, data: bytes, suffix: str) -> np.ndarray:
+        try:
+            self.__logger(f"decoding {len(data)} bytes with ffmpeg at {self.sample_rate} Hz")
+            output = subprocess.run(self.__ffmpeg_command('pipe:0'), input=data, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, check=True).stdout
+            return np.frombuffer(output, dtype=np.float32)
+        except FileNotFoundError:
+            import librosa
+
+            self.__logger(f"ffmpeg not found, decoding {len(data)} bytes with librosa at {self.sample_rate} Hz")
+            y, _ = librosa.load(io.BytesIO(data), sr=self.sample_rate, mono=True, res_type='polyphase')
+            return y.astype(np.float32)
+        except subprocess.CalledProcessError:
+            # контейнеры с индексом в конце (mp4/m4a) из pipe не читаются, такие декодируются из файла
+            fd, temp_path = tempfile.mkstemp(suffix=suffix)
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(data)
+                return self.__decode_to_memory(temp_path)
+            finally:
+                os.remove(temp_path)
+
+    def __ffmpeg_command(self, path: str):
+        return [FFMPEG_PATH, '-v', 'error', '-nostdin', '-i', path,
+                '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', '1', '-ar', str(self.sample_rate), '-']
+
+    def __decode_to_memory(self, path: str) -> np.ndarray:
+        try:
+            self.__logger(f"decoding {path} with ffmpeg at {self.sample_rate} Hz")
+            output = subprocess.run(self.__ffmpeg_command(path), stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, check=True).stdout
+            return np.frombuffer(output, dtype=np.float32)
+        except FileNotFoundError:
+            return self.__decode_librosa(path)
+
+    def __decode_to_file(self, path: str, pcm_path: Path) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=pcm_path.parent, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                try:
+                    self.__logger(f"decoding {path} with ffmpeg at {self.sample_rate} Hz into {pcm_path}")
+                    process = subprocess.Popen(self.__ffmpeg_command(path), stdout=subprocess.PIPE,
+                                               stderr=subprocess.DEVNULL)
+                except FileNotFoundError:
+                    file.write(self.__decode_librosa(path).tobytes())
+                else:
+                    for block in iter(lambda: process.stdout.read(BLOCK_SIZE), b''):
+                        file.write(block)
+                    if process.wait() != 0:
+                        raise RuntimeError(f'ffmpeg failed to decode {path}')
+
+            os.replace(temp_path, pcm_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def __decode_librosa(self, path: str) -> np.ndarray:
+        import librosa
+
+        self.__logger(f"ffmpeg not found, decoding {path} with librosa at {self.sample_rate} Hz")
+        y, _ = librosa.load(path, sr=self.sample_rate, mono=True, res_type='polyphase')
+        return y.astype(np.float32)
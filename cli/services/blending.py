@@ -0,0 +1,89 @@
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+
+# фиксированная точка: доли смешивания в 1/2**15, значения каналов в 1/2**8
+MIX_BITS = 15
+VALUE_BITS = 8
+SHIFT = MIX_BITS + VALUE_BITS
+
+
+@lru_cache(maxsize=1)
+def overlay_lut() -> np.ndarray:
+    # результат overlay для каждой пары (канал изображения, канал слоя), плоская таблица 256 * 256
+    a = np.arange(256, dtype=np.float64)[:, None] / 255.0
+    b = np.arange(256, dtype=np.float64)[None, :] / 255.0
+    comp = np.where(a < 0.5, 2 * a * b, 1 - 2 * (1 - a) * (1 - b))
+    return np.rint(comp * 255.0 * (1 << VALUE_BITS)).astype(np.uint32).ravel()
+
+
+@lru_cache(maxsize=16)
+def alpha_luts(opacity: float) -> Tuple[np.ndarray, np.ndarray]:
+    # доли исходного пикселя и результата overlay для каждой пары (альфа изображения, альфа слоя)
+    a = np.arange(256, dtype=np.float64)[:, None] / 255.0
+    b = np.arange(256, dtype=np.float64)[None, :] / 255.0
+    comp_alpha = np.minimum(a, b) * opacity
+    new_alpha = a + (1.0 - a) * comp_alpha
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = comp_alpha / new_alpha
+
+    mix = np.rint(np.nan_to_num(ratio) * (1 << MIX_BITS)).astype(np.uint32)
+    keep = (1 << MIX_BITS) - mix
+
+    # при нулевой альфе изображения blend_modes получает nan и обнуляет цвет
+    mix[0, :] = 0
+    keep[0, :] = 0
+
+    return keep.ravel(), mix.ravel()
+
+
+class OverlayBlender:
+    """
+    Overlay blend of uint8 RGBA arrays in fixed point, same math as blend_modes.overlay.
+    Accepts single frames (H, W, 4) or batches (N, H, W, 4), alpha of the image is kept.
+    """
+
+    def __init__(self, opacity: float) -> None:
+        if not 0.0 <= opacity <= 1.0:
+            raise ValueError(f"opacity must be in [0, 1], got {opacity}")
+
+        self.opacity = opacity
+        self.__keep, self.__mix = alpha_luts(float(opacity))
+        self.__overlay = overlay_lut()
+
+    def blend(self, image: np.ndarray, layer: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        if image.dtype != np.uint8 or layer.dtype != np.uint8:
+            raise TypeError("overlay blend expects uint8 arrays")
+        if image.shape != layer.shape or image.shape[-1] != 4:
+            raise ValueError(f"expected matching RGBA arrays, got {image.shape} and {layer.shape}")
+
+        if out is None:
+            out = np.empty_like(image)
+        elif out.shape != image.shape or out.dtype != np.uint8:
+            raise ValueError(f"output buffer {out.shape} {out.dtype} does not match {image.shape} uint8")
+
+        alpha_pair = (image[..., 3].astype(np.uint16) << 8) | layer[..., 3]
+        keep = self.__keep[alpha_pair]
+        mix = self.__mix[alpha_pair]
+
+        pair = np.empty(image.shape[:-1], dtype=np.uint16)
+        value = np.empty(image.shape[:-1], dtype=np.uint32)
+
+        # по одному каналу, чтобы промежуточные массивы оставались размером с один канал
+        for channel in range(3):
+            np.left_shift(image[..., channel], 8, out=pair, dtype=np.uint16)
+            np.bitwise_or(pair, layer[..., channel], out=pair)
+
+            np.left_shift(image[..., channel], VALUE_BITS, out=value, dtype=np.uint32)
+            np.multiply(value, keep, out=value)
+            value += self.__overlay[pair] * mix
+            np.right_shift(value, SHIFT, out=value)
+
+            out[..., channel] = value
+
+        if out is not image:
+            out[..., 3] = image[..., 3]
+
+        return out
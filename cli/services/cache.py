@@ -0,0 +1,32 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Bounded mapping which evicts least recently used entries.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.__entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__entries
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        if key not in self.__entries:
+            return default
+
+        self.__entries.move_to_end(key)
+        return self.__entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
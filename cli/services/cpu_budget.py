@@ -0,0 +1,145 @@
+# модуль импортирует и сервис (app/cli_path.py), поэтому из CLI он берет только settings и services
+import fcntl
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+from .sequences import SHARED_MEMORY_DIR
+
+DEFAULT_BUDGET_DIR = os.path.join(SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else tempfile.gettempdir(),
+                                  "ugc-cpu-budget")
+POLL_INTERVAL = 0.25
+
+
+class CpuLease:
+    """
+    Cores granted by CpuBudget, held until release.
+    """
+
+    def __init__(self, slots: List[int]) -> None:
+        self.__slots = slots
+
+    @property
+    def cores(self) -> int:
+        return len(self.__slots)
+
+    def split(self, encoder: bool) -> Tuple[int, int]:
+        """
+        Frame workers and encoder threads for the lease. With an encoder running alongside the workers
+        (streamed video) about a quarter of the cores goes to it, otherwise both may use every core.
+        """
+
+        if not encoder or self.cores == 1:
+            return self.cores, self.cores
+
+        encoder_threads = max(1, self.cores // 4)
+        return self.cores - encoder_threads, encoder_threads
+
+    def release(self) -> None:
+        slots, self.__slots = self.__slots, []
+        for slot in slots:
+            os.close(slot)
+
+    def __enter__(self) -> "CpuLease":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
+
+
+class CpuBudget:
+    """
+    Host-wide budget of CPU cores shared by every render on the machine.
+    Each core is a lock file, a lease holds flock on the files of its cores, so concurrent CLI runs
+    and service workers queue for cores instead of oversubscribing them. Locks of a crashed process
+    are dropped by the kernel.
+    """
+
+    def __init__(self, total: Optional[int] = None, directory: str = DEFAULT_BUDGET_DIR,
+                 verbose: bool = False) -> None:
+        self.total = total or os.cpu_count() or 1
+        self.directory = directory
+        self.__verbose = verbose
+        os.makedirs(directory, exist_ok=True)
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    def __try_acquire(self, cores: int, min_cores: int) -> Optional[CpuLease]:
+        slots = []
+
+        # поиск начинается со случайного ядра, чтобы процессы не конкурировали за одни и те же файлы
+        offset = random.randrange(self.total)
+        for index in range(self.total):
+            if len(slots) == cores:
+                break
+
+            path = os.path.join(self.directory, f"core-{(offset + index) % self.total}.lock")
+            slot = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(slot)
+                continue
+
+            slots.append(slot)
+
+        if len(slots) < min_cores:
+            CpuLease(slots).release()
+            return None
+
+        return CpuLease(slots)
+
+    def acquire(self, cores: int, min_cores: Optional[int] = None, timeout: Optional[float] = None,
+                on_wait: Optional[Callable[[], None]] = None) -> CpuLease:
+        """
+        Blocks until at least min_cores (default: all requested) of cores are free and takes up to cores of them.
+        on_wait is called on every retry and may raise to stop waiting.
+        """
+
+        cores = max(1, min(cores, self.total))
+        min_cores = max(1, min(min_cores or cores, cores))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiting = False
+
+        while True:
+            lease = self.__try_acquire(cores, min_cores)
+
+            if lease is not None:
+                self.__logger(f"cpu budget: {lease.cores} of {self.total} cores granted")
+                return lease
+
+            if not waiting:
+                self.__logger(f"cpu budget: waiting for {min_cores} of {self.total} cores")
+                waiting = True
+
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{min_cores} cpu cores were not freed in {timeout} s")
+
+            if on_wait is not None:
+                on_wait()
+
+            time.sleep(POLL_INTERVAL * (0.5 + random.random()))
+
+
+@contextmanager
+def limit_threads(threads: int):
+    """
+    Caps BLAS/OpenMP thread pools of this process (numpy, scipy, librosa) for the duration of the block.
+    """
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        print(f"threadpoolctl is not installed, BLAS/OpenMP threads are not limited to {threads}", file=sys.stderr)
+        yield
+        return
+
+    with threadpool_limits(limits=threads):
+        yield
@@ -1,11 +1,23 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import NewType, Optional, Callable, Union
+from typing import NewType, Optional, Callable, Union, List
 
 RenderEngine = NewType('RenderEngine', str)
 RenderDevice = NewType('RenderDevice', str)
 
 
+@dataclass
+class RenderStats:
+    frames: int = 0
+    seconds: float = 0.0
+    frame_seconds: List[float] = field(default_factory=list)
+
+    @property
+    def mean_frame_seconds(self) -> float:
+        return sum(self.frame_seconds) / len(self.frame_seconds) if self.frame_seconds else 0.0
+
+
 class BaseEngine(ABC):
 
     def __init__(self, engine_path: Union[Path, str]):
@@ -22,6 +34,10 @@ class BaseEngine(ABC):
                script: Optional[Callable],
                render_engine: Optional[RenderEngine],
                render_device: Optional[RenderDevice],
-               params: Optional[str]
-               ):
+               params: Optional[str],
+               shards: int,
+               threads: Optional[int],
+               progress: Optional[Callable[[int, int], None]],
+               timeout: Optional[float]
+               ) -> RenderStats:
         raise NotImplemented
\ No newline at end of file
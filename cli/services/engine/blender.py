@@ -1,12 +1,21 @@
+import asyncio
 import inspect
 import os
+import re
+import shlex
 import sys
+import tempfile
+import time
+from collections import deque
 from pathlib import Path
-from typing import Union, Optional, Callable
+from typing import Union, Optional, Callable, List
 
-from .abstract import BaseEngine, RenderEngine
+from .abstract import BaseEngine, RenderEngine, RenderStats
 from .enums import DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_ENGINE, DEFAULT_DEVICE, DEFAULT_TEMP_PATH
 
+# blender печатает время кадра строкой " Time: 00:01.23 (Saving: 00:00.05)" после Saved:
+FRAME_TIME_PATTERN = re.compile(r'^\s*Time: (?:(\d+):)?(\d+):(\d+\.\d+)')
+
 # █████████████████████████████████████████████████████████████████████████████████████████████████████
 # █▄─▄▄─█▄─▄███▄─▄▄─██▀▄─██─▄▄▄▄█▄─▄▄─███▄─▄▄▀█─▄▄─███▄─▀█▄─▄█─▄▄─█─▄─▄─███─▄─▄─█─▄▄─█▄─██─▄█─▄▄▄─█─█─█
 # ██─▄▄▄██─██▀██─▄█▀██─▀─██▄▄▄▄─██─▄█▀████─██─█─██─████─█▄▀─██─██─███─███████─███─██─██─██─██─███▀█─▄─█
@@ -25,10 +34,6 @@ class BlenderEngine(BaseEngine):
     def __init__(self, engine_path):
         super().__init__(engine_path)
 
-        if not os.path.exists(DEFAULT_TEMP_PATH):
-            with open(DEFAULT_TEMP_PATH, 'w') as file:
-                file.write('')
-
         self._current_path = Path(__file__)
         self._work_path = Path(os.path.abspath(sys._getframe(0).f_back.f_code.co_filename))
 
@@ -41,30 +46,149 @@ class BlenderEngine(BaseEngine):
                script: Optional[Callable] = None,
                render_engine: Optional[RenderEngine] = DEFAULT_ENGINE,
                render_device: Optional[bool] = DEFAULT_DEVICE,
-               params: Optional[str] = ''
-               ):
+               params: Optional[str] = '',
+               shards: int = 1,
+               threads: Optional[int] = None,
+               progress: Optional[Callable[[int, int], None]] = None,
+               timeout: Optional[float] = None
+               ) -> RenderStats:
         """
         Use project file as main scene.
         Pass int in frames for render image, or range for render animation.
+        Range may be split into shards rendered by parallel blender processes with threads each,
+        progress is called with (rendered, total) frame counts.
+        Blocking wrapper over render_async, use render_async inside a running event loop.
+        """
+
+        return asyncio.run(self.render_async(project_file, output, frames, width, height, script, render_engine,
+                                             render_device, params, shards, threads, progress, timeout))
+
+    async def render_async(self,
+                           project_file: Union[Path, str],
+                           output: Union[Path, str],
+                           frames: Union[int, range],
+                           width: Optional[int] = DEFAULT_WIDTH,
+                           height: Optional[int] = DEFAULT_HEIGHT,
+                           script: Optional[Callable] = None,
+                           render_engine: Optional[RenderEngine] = DEFAULT_ENGINE,
+                           render_device: Optional[bool] = DEFAULT_DEVICE,
+                           params: Optional[str] = '',
+                           shards: int = 1,
+                           threads: Optional[int] = None,
+                           progress: Optional[Callable[[int, int], None]] = None,
+                           timeout: Optional[float] = None
+                           ) -> RenderStats:
+        """
+        Same as render. Blender processes are killed when the task is cancelled or timeout
+        (seconds) expires, the latter raises TimeoutError.
         """
 
-        _frames_param = self._get_frames_argv(frames)
+        script_path = self._create_temp_code_file(self.__null_func if script is None else script, width, height)
+        stats = RenderStats()
+        started = time.perf_counter()
+
+        try:
+            commands = [self._command(project_file, script_path, output, shard, render_engine, render_device,
+                                      params, threads)
+                        for shard in self._split_frames(frames, shards)]
+            await asyncio.wait_for(self._run(commands, self._frames_count(frames), progress, stats), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'blender render of {project_file} did not finish in {timeout} s') from None
+        finally:
+            os.remove(script_path)
+
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def _command(self, project_file, script_path, output, frames, render_engine, render_device, params,
+                 threads) -> List[str]:
+        # -t должен стоять до -a: blender обрабатывает аргументы по порядку
+        threads_argv = ['-t', str(threads)] if threads else []
+
+        return [self.engine_path, '-b', str(project_file), '-E', str(render_engine),
+                '--python', str(script_path), '-o', str(Path(output) / "#")] + threads_argv + \
+            self._get_frames_argv(frames).split() + shlex.split(params or '') + \
+            ['--', '--cycles-device', str(render_device)]
 
-        if script is None:
-            os.system(f'{str(self.engine_path)} -b {str(project_file)} -E {render_engine} '
-                      f'--python {str(self._create_temp_code_file(self.__null_func, width, height))} '
-                      f'-o {str(Path(output) / "#")} {_frames_param} {params} -- --cycles-device {render_device}')
-        else:
-            os.system(f'{str(self.engine_path)} -b {str(project_file)} -E {render_engine} '
-                      f'--python {str(self._create_temp_code_file(script, width, height))} '
-                      f'-o {str(Path(output) / "#")} {_frames_param} {params} -- --cycles-device {render_device}')
+    @staticmethod
+    async def _watch(process: asyncio.subprocess.Process, total: int,
+                     progress: Optional[Callable[[int, int], None]], stats: RenderStats) -> deque:
+        tail = deque(maxlen=20)
+        last = time.perf_counter()
+
+        async for raw in process.stdout:
+            line = raw.decode(errors='replace').rstrip()
+            tail.append(line)
+
+            # blender печатает Saved: '<path>' после записи каждого кадра
+            if line.startswith('Saved:'):
+                now = time.perf_counter()
+                stats.frame_seconds.append(now - last)
+                stats.frames += 1
+                last = now
+
+                if progress is not None:
+                    progress(stats.frames, total)
+                continue
+
+            # если blender сообщил время кадра, оно точнее интервала между строками (без запуска процесса)
+            match = FRAME_TIME_PATTERN.match(line)
+            if match and stats.frame_seconds:
+                hours, minutes, seconds = match.groups()
+                stats.frame_seconds[-1] = int(hours or 0) * 3600 + int(minutes) * 60 + float(seconds)
+
+        await process.wait()
+        return tail
+
+    async def _run(self, commands: List[List[str]], total: int, progress: Optional[Callable[[int, int], None]],
+                   stats: RenderStats):
+        processes = []
+
+        try:
+            for command in commands:
+                processes.append(await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                                      stderr=asyncio.subprocess.STDOUT))
+
+            tails = await asyncio.gather(*(self._watch(process, total, progress, stats) for process in processes))
+        finally:
+            # отмена, таймаут или ошибка в одном шарде останавливают все процессы
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+        for command, process, tail in zip(commands, processes, tails):
+            if process.returncode != 0:
+                raise RuntimeError(f'blender exited with code {process.returncode}: {" ".join(command)}\n' +
+                                   '\n'.join(tail))
 
-        self._remove_temp_file()
+    @staticmethod
+    def _split_frames(frames: Union[int, range], shards: int) -> List[Union[int, range]]:
+        # в blender конец диапазона (-e) включается, поэтому range(0, 90) -- это 91 кадр
+        if isinstance(frames, int) or shards <= 1:
+            return [frames]
+
+        total = frames.stop - frames.start + 1
+        size, extra = divmod(total, min(shards, total))
+        result, start = [], frames.start
+
+        for shard in range(min(shards, total)):
+            stop = start + size + (1 if shard < extra else 0) - 1
+            result.append(range(start, stop))
+            start = stop + 1
+
+        return result
+
+    @staticmethod
+    def _frames_count(frames: Union[int, range]) -> int:
+        return 1 if isinstance(frames, int) else frames.stop - frames.start + 1
 
     def _create_temp_code_file(self, func: Callable, width, height) -> Path:
-        with open(DEFAULT_TEMP_PATH, 'w') as file:
+        # у каждого рендера свой файл скрипта, чтобы параллельные рендеры не затирали друг друга
+        fd, path = tempfile.mkstemp(prefix=DEFAULT_TEMP_PATH, suffix='.py')
+        with os.fdopen(fd, 'w') as file:
             file.write(self._func_to_code(func, width, height))
-        return Path(DEFAULT_TEMP_PATH).absolute()
+        return Path(path).absolute()
 
     def __null_func(self):
         print('Project adjustments done.')
@@ -96,7 +220,3 @@ class BlenderEngine(BaseEngine):
             return f'-s {frames.start} -e {frames.stop} -a'
         else:
             raise ValueError('Frames argument needs to be type int or range')
-
-    @staticmethod
-    def _remove_temp_file():
-        os.remove(DEFAULT_TEMP_PATH)
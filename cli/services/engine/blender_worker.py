@@ -0,0 +1,95 @@
+"""
+Long-lived render worker, runs inside blender:
+
+    blender -b project.blend --python blender_worker.py -- --cycles-device CPU --worker /tmp/socket
+
+Connects to the engine over a unix socket and renders jobs sent as JSON lines until told to quit.
+Only the standard library is used outside BlenderRenderer, so the protocol loop can be driven
+by a stand-in renderer without blender.
+"""
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+
+WORKER_ARGUMENT = '--worker'
+
+
+class BlenderRenderer:
+    def __init__(self):
+        import bpy
+
+        self.bpy = bpy
+        self.scene = bpy.data.scenes["Scene"]
+
+    def prepare(self, job: dict):
+        self.scene.render.resolution_x = job["width"]
+        self.scene.render.resolution_y = job["height"]
+
+        # текстуры (аватар, user info) перезаписываются на диске между задачами
+        for name, path in job.get("textures", {}).items():
+            self.bpy.data.images[name].filepath = path
+
+        if job.get("reload", True):
+            for image in self.bpy.data.images:
+                if image.source == 'FILE':
+                    image.reload()
+
+        if job.get("script"):
+            exec(compile(job["script"], "<job script>", "exec"), {"__name__": "__job__"})
+
+    def render(self, frame: int, path: str):
+        self.scene.frame_set(frame)
+        self.scene.render.filepath = path
+        self.bpy.ops.render.render(write_still=True)
+
+
+def send(connection: socket.socket, message: dict):
+    connection.sendall((json.dumps(message) + '\n').encode())
+
+
+def run_job(connection: socket.socket, renderer, job: dict):
+    started = time.perf_counter()
+    start, stop = job["frames"]
+
+    renderer.prepare(job)
+    os.makedirs(job["output"], exist_ok=True)
+
+    # имена кадров как у blender -o <output>/#: номер кадра без дополнения нулями
+    for frame in range(start, stop + 1):
+        path = os.path.join(job["output"], f"{frame}.png")
+        renderer.render(frame, path)
+        send(connection, {"id": job["id"], "event": "frame", "frame": frame, "path": path})
+
+    send(connection, {"id": job["id"], "event": "done", "frames": stop - start + 1,
+                      "seconds": time.perf_counter() - started})
+
+
+def serve(address: str, renderer):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(address)
+    send(connection, {"event": "ready", "pid": os.getpid()})
+
+    with connection, connection.makefile('r') as requests:
+        for line in requests:
+            job = json.loads(line)
+
+            if job.get("command") == "quit":
+                break
+
+            try:
+                run_job(connection, renderer, job)
+            except Exception as error:
+                send(connection, {"id": job.get("id"), "event": "error",
+                                  "message": f"{error}\n{traceback.format_exc()}"})
+
+
+def main():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    serve(argv[argv.index(WORKER_ARGUMENT) + 1], BlenderRenderer())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Union, Optional, Callable, Dict, List
+
+from .abstract import RenderEngine, RenderStats
+from .blender import BlenderEngine
+from .blender_worker import WORKER_ARGUMENT
+from .enums import DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_ENGINE, DEFAULT_DEVICE
+
+WORKER_SCRIPT = Path(__file__).with_name('blender_worker.py')
+DEFAULT_START_TIMEOUT = 120
+
+
+class BlenderWorker:
+    """
+    Background blender process with a loaded project, renders jobs sent as JSON lines over a unix socket.
+    """
+
+    def __init__(self, command: List[str], start_timeout: float = DEFAULT_START_TIMEOUT):
+        self.command = command
+        self.start_timeout = start_timeout
+        self.__lock = threading.Lock()
+        self.__process: Optional[subprocess.Popen] = None
+        self.__connection: Optional[socket.socket] = None
+        self.__messages = None
+        self.__directory: Optional[str] = None
+        self.__tail = deque(maxlen=20)
+        self.__job_id = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.__process is not None and self.__process.poll() is None
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.__process.pid if self.alive else None
+
+    def __drain(self):
+        # вывод blender нужно читать постоянно, иначе процесс встанет на заполненном pipe
+        for line in self.__process.stdout:
+            self.__tail.append(line.rstrip())
+
+    def __failure(self, msg: str) -> RuntimeError:
+        return RuntimeError(f'{msg}: {" ".join(self.command)}\n' + '\n'.join(self.__tail))
+
+    def start(self):
+        # после падения процесса остаются его соединение и каталог сокета, новый процесс подключается заново
+        self.close()
+
+        self.__directory = tempfile.mkdtemp(prefix='ugc-blender-')
+        address = os.path.join(self.__directory, 'worker.sock')
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+        listener.listen(1)
+        listener.settimeout(1)
+
+        self.__process = subprocess.Popen(self.command + [WORKER_ARGUMENT, address], stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT, text=True, errors='replace')
+        threading.Thread(target=self.__drain, daemon=True).start()
+
+        deadline = time.monotonic() + self.start_timeout
+
+        with listener:
+            while self.__connection is None:
+                if not self.alive:
+                    raise self.__failure(f'blender worker exited with code {self.__process.returncode}')
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise self.__failure('blender worker did not connect in time')
+                try:
+                    self.__connection, _ = listener.accept()
+                except socket.timeout:
+                    continue
+
+        self.__connection.settimeout(None)
+        self.__messages = self.__connection.makefile('r')
+
+        ready = self.__receive()
+        if ready.get("event") != "ready":
+            raise self.__failure(f'unexpected worker greeting {ready}')
+
+    def __send(self, message: dict):
+        self.__connection.sendall((json.dumps(message) + '\n').encode())
+
+    def __receive(self) -> dict:
+        line = self.__messages.readline()
+        if not line:
+            self.__process.wait()
+            raise self.__failure(f'blender worker exited with code {self.__process.returncode}')
+        return json.loads(line)
+
+    def render(self, job: dict, progress: Optional[Callable[[int], None]] = None,
+               timeout: Optional[float] = None) -> dict:
+        """
+        Runs job (output, frames [start, stop] inclusive, width, height, textures, script) and waits
+        for completion. progress is called with the frame number after every saved frame.
+        A job running longer than timeout seconds kills the worker and raises TimeoutError.
+        """
+
+        with self.__lock:
+            if not self.alive:
+                self.start()
+
+            self.__job_id += 1
+            self.__send(dict(job, id=self.__job_id))
+            deadline = None if timeout is None else time.monotonic() + timeout
+
+            while True:
+                try:
+                    if deadline is not None:
+                        self.__connection.settimeout(max(deadline - time.monotonic(), 0.001))
+                    message = self.__receive()
+                except socket.timeout:
+                    # занятый воркер не прочитает quit, поэтому процесс останавливается сразу
+                    self.close(kill=True)
+                    raise TimeoutError(f'blender worker job did not finish in {timeout} s') from None
+                finally:
+                    if self.__connection is not None:
+                        self.__connection.settimeout(None)
+
+                if message.get("event") == "frame":
+                    if progress is not None:
+                        progress(message["frame"])
+                elif message.get("event") == "done":
+                    return message
+                elif message.get("event") == "error":
+                    raise RuntimeError(f'blender worker failed: {message.get("message")}')
+
+    def close(self, kill: bool = False):
+        if kill and self.alive:
+            self.__process.kill()
+
+        if self.__connection is not None:
+            try:
+                self.__send({"command": "quit"})
+            except OSError:
+                pass
+            self.__messages.close()
+            self.__connection.close()
+            self.__connection = None
+
+        if self.__process is not None:
+            try:
+                self.__process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.__process.kill()
+                self.__process.wait()
+            self.__process = None
+
+        if self.__directory is not None:
+            shutil.rmtree(self.__directory, ignore_errors=True)
+            self.__directory = None
+
+
+class BlenderWorkerEngine(BlenderEngine):
+    """
+    BlenderEngine that keeps a background blender process per template (and shard) between renders,
+    so blender startup and .blend loading are paid once per process instead of once per render.
+    Images are reloaded before every job, textures maps image datablock names to new files.
+    """
+
+    def __init__(self, engine_path, start_timeout: float = DEFAULT_START_TIMEOUT):
+        super().__init__(engine_path)
+
+        self.start_timeout = start_timeout
+        self.__workers: Dict[tuple, BlenderWorker] = {}
+        self.__lock = threading.Lock()
+
+    def worker(self, project_file, render_engine, render_device, threads, shard) -> BlenderWorker:
+        key = (str(Path(project_file).absolute()), render_engine, render_device, threads, shard)
+
+        with self.__lock:
+            if key not in self.__workers:
+                threads_argv = ['-t', str(threads)] if threads else []
+                command = [self.engine_path, '-b', key[0], '-E', str(render_engine),
+                           '--python', str(WORKER_SCRIPT)] + threads_argv + \
+                          ['--', '--cycles-device', str(render_device)]
+                self.__workers[key] = BlenderWorker(command, self.start_timeout)
+
+            return self.__workers[key]
+
+    def render(self,
+               project_file: Union[Path, str],
+               output: Union[Path, str],
+               frames: Union[int, range],
+               width: Optional[int] = DEFAULT_WIDTH,
+               height: Optional[int] = DEFAULT_HEIGHT,
+               script: Optional[Callable] = None,
+               render_engine: Optional[RenderEngine] = DEFAULT_ENGINE,
+               render_device: Optional[bool] = DEFAULT_DEVICE,
+               params: Optional[str] = '',
+               shards: int = 1,
+               threads: Optional[int] = None,
+               progress: Optional[Callable[[int, int], None]] = None,
+               timeout: Optional[float] = None,
+               textures: Optional[Dict[str, str]] = None
+               ) -> RenderStats:
+        if params:
+            raise ValueError('extra blender arguments are not supported by persistent workers')
+
+        # одиночный кадр -- диапазон из одного кадра (конец включается, как у blender)
+        frames = range(frames, frames) if isinstance(frames, int) else frames
+        total = self._frames_count(frames)
+        lock = threading.Lock()
+        stats = RenderStats()
+        started = time.perf_counter()
+        last = [started]
+
+        def saved(_frame: int):
+            with lock:
+                now = time.perf_counter()
+                stats.frame_seconds.append(now - last[0])
+                stats.frames += 1
+                last[0] = now
+
+                if progress is not None:
+                    progress(stats.frames, total)
+
+        job = {"output": str(Path(output).absolute()), "width": width, "height": height, "textures": textures or {},
+               "script": None if script is None else self._func_to_code(script, width, height)}
+
+        shard_frames = self._split_frames(frames, shards)
+
+        with ThreadPoolExecutor(max_workers=len(shard_frames)) as executor:
+            futures = [executor.submit(self.worker(project_file, render_engine, render_device, threads, shard).render,
+                                       dict(job, frames=[part.start, part.stop]), saved, timeout)
+                       for shard, part in enumerate(shard_frames)]
+
+            for future in futures:
+                future.result()
+
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def close(self):
+        with self.__lock:
+            workers, self.__workers = list(self.__workers.values()), {}
+
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self) -> "BlenderWorkerEngine":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
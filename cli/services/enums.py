@@ -0,0 +1,11 @@
+OUTPUT_TYPES = ("frames", "video", "raw", "preview")
+
+SMOOTHING_ENGINES = ("cumsum", "convolve", "fft", "gaussian", "exponential")
+
+ANALYSIS_MODES = ("waveform", "spectrogram", "envelope")
+
+PREVIEW_TYPES = ("clip", "sheet")
+
+DEFAULT_SAMPLE_RATE = 22050
+# огибающей для 30 fps хватает и 8 кГц, анализ на такой частоте в разы дешевле
+LOW_SAMPLE_RATE = 8000
@@ -1,16 +1,24 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from PIL import ImageDraw
 
 from .graphics import GraphicsGeneratorParams, GraphicsGenerator
 from .waveforms import WaveformGeneratorInterface, WaveformGeneratorParams
+from .video import VideoStreamWriter, ConcatManifest
+from .cache import LRUCache
+from .blending import OverlayBlender
+from .layers import Layer, LayerCompositor, ZoomLayer
+from .plan import RenderPlanner
+from .sequences import SequenceHandle, SequenceStore
+from .scheduler import ChunkScheduler
 from dataclasses import dataclass
 from PIL import Image, ImageFilter
-import blend_modes
 import numpy as np
 import math
-from joblib import Parallel, delayed
 
 
 @dataclass
@@ -20,6 +28,16 @@ class FrameGeneratorParams:
     waveform_generator: WaveformGeneratorInterface
     graphics_generator: GraphicsGenerator
     jobs: int
+    output_type: str = "frames"
+    audio_path: Optional[str] = None
+    intensity_levels: Optional[int] = None
+    frame_cache_size: int = 64
+    plan_path: Optional[str] = None
+    sequence_store_dir: Optional[str] = None
+    background_reduce: int = 1
+    chunk_size: Optional[int] = None
+    dedupe: bool = False
+    encoder_threads: Optional[int] = None
 
 
 @dataclass
@@ -41,13 +59,16 @@ class UGCParams:
 class ProcessingCache:
     avatar: Image.Image = None
     background: Image.Image = None
+    zoom: ZoomLayer = None
     shade: Image.Image = None
+    layers: LayerCompositor = None
     total_frames_count: int = None
     scene_sequence: List[Path] = None
     user_info_sequence: List[Path] = None
     overlay_sequence: List[Path] = None
-    intensities: np.ndarray = None
-    frames_intensity: List[float] = None
+    scene_frames: SequenceHandle = None
+    user_info_frames: SequenceHandle = None
+    overlay_frames: SequenceHandle = None
     max_digits: int = None
 
 
@@ -55,6 +76,111 @@ class BaseFrameGenerator:
     def process(self):
         pass
 
+    def render(self, cache: ProcessingCache, frame: np.void) -> Optional[Image.Image]:
+        pass
+
+    def generator(self, cache: ProcessingCache, frames: np.ndarray):
+        pass
+
+    def stream_generator(self, cache: ProcessingCache, frames: np.ndarray) -> List[Optional[bytes]]:
+        rendered = [self.render(cache, frame) for frame in frames]
+        return [None if frame is None else frame.convert("RGB").tobytes() for frame in rendered]
+
+    def frame_keys(self, plan: np.ndarray) -> np.ndarray:
+        # входы, от которых зависит изображение кадра; по умолчанию все кадры считаются разными
+        return plan['frame']
+
+    @staticmethod
+    def _frame_name(frame_num: int, max_digits: int) -> str:
+        return 'img{}.png'.format(str(frame_num).zfill(max_digits))
+
+    def _dispatch(self,
+                  cache: ProcessingCache,
+                  plan: np.ndarray,
+                  generator_params: FrameGeneratorParams,
+                  ugc_params: UGCParams,
+                  verbose: bool):
+
+        if generator_params.output_type != "video":
+            self._discard_manifest(generator_params)
+
+        if generator_params.dedupe:
+            self._dispatch_runs(cache, plan, generator_params, ugc_params, verbose)
+            return
+
+        scheduler = self._scheduler(cache, generator_params, verbose)
+
+        if generator_params.output_type != "video":
+            with scheduler:
+                scheduler.map_plan("generator", plan)
+            return
+
+        writer = self._video_writer(generator_params, ugc_params, verbose)
+
+        with writer, scheduler:
+            for chunk, frames in self._stream_chunks(scheduler, writer, plan):
+                for frame_num, frame in enumerate(frames, chunk.start):
+                    writer.write(frame_num, frame)
+
+    def _dispatch_runs(self,
+                       cache: ProcessingCache,
+                       plan: np.ndarray,
+                       generator_params: FrameGeneratorParams,
+                       ugc_params: UGCParams,
+                       verbose: bool):
+
+        # из каждой серии одинаковых кадров рендерится только первый
+        starts, lengths = RenderPlanner.runs(self.frame_keys(plan), plan['skip'])
+        heads = plan[starts]
+
+        if verbose:
+            print(f"{len(heads)} distinct runs for {len(plan)} frames")
+
+        scheduler = self._scheduler(cache, generator_params, verbose)
+
+        if generator_params.output_type != "video":
+            rendered = ~heads['skip']
+
+            with scheduler:
+                scheduler.map_plan("generator", heads[rendered])
+
+            ConcatManifest.write(ConcatManifest.resolve_path(generator_params.output_path),
+                                 [self._frame_name(int(frame_num), cache.max_digits)
+                                  for frame_num in heads['frame'][rendered]],
+                                 lengths[rendered].tolist(), ugc_params.framerate)
+            return
+
+        writer = self._video_writer(generator_params, ugc_params, verbose)
+
+        with writer, scheduler:
+            for chunk, frames in self._stream_chunks(scheduler, writer, heads):
+                for head, length, frame in zip(heads[chunk], lengths[chunk], frames):
+                    writer.write(int(head['frame']), frame, int(length))
+
+    @staticmethod
+    def _discard_manifest(generator_params: FrameGeneratorParams) -> None:
+        # манифест прошлого запуска с --dedupe иначе достался бы кадрам этого запуска (см. build_mp4.py)
+        ConcatManifest.remove(ConcatManifest.resolve_path(generator_params.output_path))
+
+    def _scheduler(self, cache: ProcessingCache, generator_params: FrameGeneratorParams, verbose: bool):
+        return ChunkScheduler(self, cache, generator_params.jobs, generator_params.chunk_size, verbose)
+
+    @staticmethod
+    def _stream_chunks(scheduler: ChunkScheduler, writer: VideoStreamWriter,
+                       plan: np.ndarray) -> Iterator[Tuple[slice, List[Optional[bytes]]]]:
+        # чанки уходят в энкодер по мере готовности, а буфер переупорядочивания ставит их кадры по местам;
+        # вперед самого старого незавершенного чанка уходит не больше кадров, чем помещается в буфер
+        chunk_size = scheduler.chunk_size or max(1, writer.buffer_size // (2 * scheduler.workers))
+        ahead = writer.buffer_size // chunk_size + 1
+
+        return scheduler.imap_plan("stream_generator", plan, chunk_size, ahead)
+
+    @staticmethod
+    def _video_writer(generator_params: FrameGeneratorParams, ugc_params: UGCParams, verbose: bool):
+        return VideoStreamWriter(generator_params.output_path, ugc_params.width, ugc_params.height,
+                                 ugc_params.framerate, generator_params.audio_path,
+                                 threads=generator_params.encoder_threads, verbose=verbose)
+
 
 class FrameGeneratorLegacy(BaseFrameGenerator):
     def __init__(self,
@@ -86,17 +212,22 @@ class FrameGeneratorLegacy(BaseFrameGenerator):
         return avatar
 
     def create_frame(self, intensity: float, avatar: Image, background: Image) -> Image:
-        return self.__create_save_frame_img_proto(intensity, avatar, background)
+        return self.__create_save_frame_img_proto(intensity, self.__static_layers(avatar), self.__zoom(background))
 
-    def __create_save_frame_img_proto(self,
-                                      intensity: float, avatar: Image, background: Image) -> Image:
+    def __static_layers(self, avatar: Image) -> LayerCompositor:
+        return LayerCompositor(self.__ugc_params.width, self.__ugc_params.height,
+                               [Layer(self.__shade), Layer(avatar, (160, 246))])
 
-        reds = np.zeros([self.__ugc_params.height, self.__ugc_params.width, 4], dtype=np.float32)
+    def __zoom(self, background: Image) -> ZoomLayer:
+        return ZoomLayer(background, self.__ugc_params.width, self.__ugc_params.height,
+                         self.__generator_params.background_reduce)
 
-        frame = Image.fromarray((reds * 255).astype(np.uint8), "RGBA")
+    def __create_save_frame_img_proto(self,
+                                      intensity: float, layers: LayerCompositor, zoom: ZoomLayer) -> Image:
 
+        # меняется только увеличенный фон, тень и аватар уже слиты в статический слой
         def new_size():
-            return int(self.__ugc_params.height * (intensity + 1.))
+            return self.__zoom_size(intensity)
 
         def new_offset():
             x_offset = int((self.__ugc_params.width - new_size()) / 2.0)
@@ -104,36 +235,120 @@ class FrameGeneratorLegacy(BaseFrameGenerator):
 
             return x_offset, y_offset
 
-        blurred_resized = background.resize((new_size(), new_size()))
+        # пересэмплируется только видимое окно фона
+        visible = zoom.render((new_size(), new_size()), new_offset())
 
-        frame.paste(blurred_resized, new_offset())
+        return layers.render(visible, (0, 0))
 
-        frame = Image.alpha_composite(frame, self.__shade)
+    def __zoom_size(self, intensity: float) -> int:
+        return int(self.__ugc_params.height * (intensity + 1.))
 
-        frame.paste(avatar, (160, 246), avatar)
+    def __quantize(self, intensities: np.ndarray) -> np.ndarray:
+        levels = self.__generator_params.intensity_levels
+        max_intensity = self.__ugc_params.waveform_generator_params.widening_factor
 
-        return frame
+        if levels < 2 or max_intensity <= 0:
+            return np.zeros_like(intensities)
+
+        step = max_intensity / (levels - 1)
+        return np.round(intensities / step) * step
+
+    def __frame_path(self, frame_num: int, max_digits: int) -> str:
+        return os.path.join(self.__generator_params.output_path, self._frame_name(frame_num, max_digits))
+
+    def frame_keys(self, plan: np.ndarray) -> np.ndarray:
+        # кадр классического режима зависит только от размера увеличенного фона
+        return (self.__ugc_params.height * (plan['intensity'] + 1.)).astype(np.int64)
+
+    def render(self, cache: ProcessingCache, frame: np.void) -> Optional[Image.Image]:
+        if frame['skip']:
+            return None
+
+        self.__logger("generator: F {} I {}".format(frame['frame'], frame['intensity']))
+
+        return self.__create_save_frame_img_proto(float(frame['intensity']), cache.layers, cache.zoom)
 
-    def __create_save_frame_img(self,
-                                frame_num: int, max_digits: int, intensity: float, avatar: Image, background: Image):
+    def generator(self, cache: ProcessingCache, frames: np.ndarray):
+        for frame in frames:
+            image = self.render(cache, frame)
 
-        new_img = self.__create_save_frame_img_proto(intensity, avatar, background)
-        new_img.save('{}/img{}.png'
-                     .format(self.__generator_params.output_path, str(frame_num).zfill(max_digits)))
+            if image is not None:
+                image.save(self.__frame_path(int(frame['frame']), cache.max_digits))
 
-    def generator(self, cache: ProcessingCache, frame_num: int):
+    def level_generator(self, cache: ProcessingCache, intensity: float, frame_nums: List[int]):
+        # один уровень рендерится один раз, остальные кадры уровня -- жесткие ссылки на первый
 
-        frame_to_time = float(frame_num) / float(self.__ugc_params.framerate)
-        audio_time_sample = int(frame_to_time * self.__generator_params.waveform_generator.sample_rate())
+        first_path = self.__frame_path(frame_nums[0], cache.max_digits)
+        self.__create_save_frame_img_proto(intensity, cache.layers, cache.zoom).save(first_path)
 
-        if audio_time_sample < len(cache.intensities):
-            intensity = cache.intensities[audio_time_sample]
+        for frame_num in frame_nums[1:]:
+            path = self.__frame_path(frame_num, cache.max_digits)
+            try:
+                os.link(first_path, path)
+            except OSError:
+                shutil.copyfile(first_path, path)
 
-            self.__logger("generator: FTT {} ATS {} I {}".format(frame_to_time, audio_time_sample, intensity))
+    def level_stream_generator(self, cache: ProcessingCache, intensity: float) -> bytes:
+        return self.__create_save_frame_img_proto(intensity, cache.layers, cache.zoom).convert("RGB").tobytes()
 
-            self.__create_save_frame_img(
-                frame_num, cache.max_digits, intensity,
-                cache.avatar, cache.background)
+    def levels_generator(self, cache: ProcessingCache, levels: List[Tuple[float, List[int]]]):
+        for intensity, frame_nums in levels:
+            self.level_generator(cache, intensity, frame_nums)
+
+    def levels_stream_generator(self, cache: ProcessingCache, intensities: List[float]) -> List[bytes]:
+        return [self.level_stream_generator(cache, intensity) for intensity in intensities]
+
+    def __dispatch_quantized(self, cache: ProcessingCache, plan: np.ndarray):
+        # кадр классического режима зависит только от размера фона, поэтому он и служит ключом уровня
+
+        total_frames_count = len(plan)
+        quantized = self.__quantize(plan['intensity'])
+        keys = (self.__ugc_params.height * (quantized + 1.)).astype(np.int64)
+        keys[plan['skip']] = -1
+        frame_keys: List[Optional[int]] = [None if key < 0 else key for key in keys.tolist()]
+
+        unique_keys, first_frames = np.unique(keys, return_index=True)
+        levels: Dict[int, float] = {int(key): float(quantized[i]) for key, i in zip(unique_keys, first_frames)
+                                    if key >= 0}
+
+        self.__logger(f"{len(levels)} distinct levels for {total_frames_count} frames")
+
+        scheduler = self._scheduler(cache, self.__generator_params, self.__verbose)
+
+        if self.__generator_params.output_type != "video":
+            self._discard_manifest(self.__generator_params)
+            work = [(intensity, plan['frame'][keys == key].tolist()) for key, intensity in levels.items()]
+
+            with scheduler:
+                scheduler.map("levels_generator", [(work[chunk],) for chunk in scheduler.split(len(work))])
+            return
+
+        rendered_levels = LRUCache(self.__generator_params.frame_cache_size)
+        writer = self._video_writer(self.__generator_params, self.__ugc_params, self.__verbose)
+
+        with writer, scheduler:
+            for window_start in range(0, total_frames_count, writer.buffer_size):
+                window = range(window_start, min(window_start + writer.buffer_size, total_frames_count))
+
+                window_keys = dict.fromkeys(frame_keys[i] for i in window if frame_keys[i] is not None)
+
+                # уровни окна забираются из кэша до вставки новых: вставка может вытеснить нужный окну уровень
+                frames = {key: rendered_levels.get(key) for key in window_keys if key in rendered_levels}
+                missing = [key for key in window_keys if key not in frames]
+
+                if missing:
+                    chunk_size = scheduler.chunk_size or math.ceil(len(missing) / scheduler.workers)
+                    intensities = [levels[key] for key in missing]
+                    frames.update(zip(missing, scheduler.flatten(scheduler.map(
+                        "levels_stream_generator",
+                        [(intensities[chunk],) for chunk in scheduler.split(len(missing), chunk_size)]))))
+
+                for key, frame in frames.items():
+                    rendered_levels.put(key, frame)
+
+                for frame_num in window:
+                    key = frame_keys[frame_num]
+                    writer.write(frame_num, None if key is None else frames[key])
 
     def process(self):
         cache = ProcessingCache()
@@ -149,21 +364,25 @@ class FrameGeneratorLegacy(BaseFrameGenerator):
 
         self.__logger("opening background")
 
-        cache.background = Image.open(self.__ugc_params.avatar_path)
-        cache.background = cache.background.convert("RGBA")
-        cache.background.putalpha(255)
+        background = Image.open(self.__ugc_params.avatar_path)
+        background = background.convert("RGBA")
+        background.putalpha(255)
 
         self.__logger("resizing background")
 
-        cache.background = cache.background.resize((self.__ugc_params.height, self.__ugc_params.height))
+        background = background.resize((self.__ugc_params.height, self.__ugc_params.height))
 
         self.__logger("filtering background")
 
-        cache.background = cache.background.filter(ImageFilter.GaussianBlur(self.__ugc_params.blur_radius))
+        background = background.filter(ImageFilter.GaussianBlur(self.__ugc_params.blur_radius))
+
+        # воркерам передается только слой увеличения, а не исходный фон
+        cache.zoom = self.__zoom(background)
 
         self.__logger("make corners")
 
         cache.avatar = self.__make_corners(avatar, 40)
+        cache.layers = self.__static_layers(cache.avatar)
 
         self.__logger("forming duration")
 
@@ -172,11 +391,29 @@ class FrameGeneratorLegacy(BaseFrameGenerator):
         total_frames_count = duration * self.__ugc_params.framerate
 
         cache.max_digits = int(math.log10(total_frames_count)) + 1
-        cache.intensities = \
+        intensities = \
             self.__generator_params.waveform_generator.process(self.__ugc_params.waveform_generator_params)
 
-        Parallel(n_jobs=self.__generator_params.jobs, verbose=0 if not self.__verbose else total_frames_count)(
-            delayed(self.generator)(cache, i) for i in range(total_frames_count))
+        self.__logger("planning frames")
+
+        plan = RenderPlanner.legacy(intensities,
+                                    self.__generator_params.waveform_generator.output_rate(
+                                        self.__ugc_params.waveform_generator_params),
+                                    self.__ugc_params.framerate,
+                                    total_frames_count)
+
+        if self.__generator_params.plan_path:
+            RenderPlanner.save(plan, self.__generator_params.plan_path)
+
+        if self.__generator_params.intensity_levels and self.__generator_params.dedupe:
+            # серии считаются по квантованной интенсивности
+            plan = plan.copy()
+            plan['intensity'] = self.__quantize(plan['intensity'])
+        elif self.__generator_params.intensity_levels:
+            self.__dispatch_quantized(cache, plan)
+            return
+
+        self._dispatch(cache, plan, self.__generator_params, self.__ugc_params, self.__verbose)
 
 
 class FrameGenerator(BaseFrameGenerator):
@@ -193,18 +430,6 @@ class FrameGenerator(BaseFrameGenerator):
         if self.__verbose:
             print(msg)
 
-    @staticmethod
-    def img_to_np(image: Image.Image):
-        np_arr = np.array(image)
-        np_float = np_arr.astype(float)
-        return np_float
-
-    @staticmethod
-    def np_to_img(np_float):
-        img_decode = np.uint8(np_float)
-        image = Image.fromarray(img_decode)
-        return image
-
     def create_frame(self, intensity: float, avatar: Image.Image, background: Image.Image) -> Image.Image:
         raise NotImplemented
 
@@ -222,67 +447,46 @@ class FrameGenerator(BaseFrameGenerator):
         if not overlay_frame:
             return frame
 
-        frame = self.np_to_img(blend_modes.overlay(self.img_to_np(frame), self.img_to_np(overlay_frame),
-                                                   self.__ugc_params.overlay_opacity))
+        # смешивание на месте в uint8, без промежуточных float64 копий кадра
+        pixels = np.array(frame)
+        OverlayBlender(self.__ugc_params.overlay_opacity).blend(pixels, np.asarray(overlay_frame), out=pixels)
+        frame = Image.fromarray(pixels)
         # можно использовать intensity для динамического изменения прозрачности оверлея
         return frame
 
-    def __create_save_frame_img(self,
-                                frame_num: int,
-                                max_digits: int,
-                                intensity: float,
-                                scene_sequence_frame: Image.Image,
-                                user_info_frame: Image.Image,
-                                overlay_frame: Image.Image
-                                ):
-
-        new_img = self.__create_save_frame_img_proto(intensity, scene_sequence_frame, user_info_frame, overlay_frame)
-        new_img.save('{}/img{}.png'
-                     .format(self.__generator_params.output_path, str(frame_num).zfill(max_digits)))
-
-    def generator(self, cache: ProcessingCache, frame_num: int):
-
-        def get_user_info_frame(_frame_num, _cache):
-            if _frame_num < len(_cache.user_info_sequence):
-                return Image.open(_cache.user_info_sequence[_frame_num])
-            else:
-                return Image.open(_cache.user_info_sequence[-1])
-
-        def get_overlay_frame(_frame_num, _cache):
-            if _cache.overlay_sequence:
-                return Image.open(_cache.overlay_sequence[_frame_num % len(_cache.overlay_sequence)])
-            else:
-                return None
-
-        def get_main_scene_frames(_intensity, _cache):
-            if frame_num >= len(
-                    _cache.scene_sequence) and not self.__ugc_params.graphics_generator_params.disable_intro:
-                return Image.open(_cache.scene_sequence[round(_intensity * (len(cache.scene_sequence) - 1))])
-            else:
-                return Image.open(_cache.scene_sequence[-frame_num - 1])
-
-        frame_to_time = float(frame_num) / float(self.__ugc_params.framerate)
-        audio_time_sample = int(frame_to_time * self.__generator_params.waveform_generator.sample_rate())
-
-        if audio_time_sample < len(cache.intensities):
-            intensity = cache.frames_intensity[frame_num]
-
-            self.__logger("generator: FTT {} ATS {} I {}".format(frame_to_time, audio_time_sample, intensity))
-
-            scene_sequence_frame = get_main_scene_frames(intensity, cache)
-            user_info_frame = get_user_info_frame(frame_num, cache)
-            overlay_frame = get_overlay_frame(frame_num, cache)
-
-            self.__logger(f'all graphics prepared for {frame_num} frame')
-
-            self.__create_save_frame_img(
-                frame_num=frame_num,
-                max_digits=cache.max_digits,
-                intensity=intensity,
-                scene_sequence_frame=scene_sequence_frame,
-                overlay_frame=overlay_frame,
-                user_info_frame=user_info_frame
-            )
+    def render(self, cache: ProcessingCache, frame: np.void) -> Optional[Image.Image]:
+        if frame['skip']:
+            return None
+
+        frame_num = int(frame['frame'])
+        intensity = float(frame['intensity'])
+
+        self.__logger("generator: F {} I {}".format(frame_num, intensity))
+
+        # кадры шаблонов уже декодированы в общую память, воркер только подключается к ней
+        scene_sequence_frame = SequenceStore.image(cache.scene_frames, frame['scene'])
+        user_info_frame = SequenceStore.image(cache.user_info_frames, frame['user_info'])
+        overlay_frame = SequenceStore.image(cache.overlay_frames, frame['overlay']) if frame['overlay'] >= 0 else None
+
+        self.__logger(f'all graphics prepared for {frame_num} frame')
+
+        return self.__create_save_frame_img_proto(
+            intensity=intensity,
+            scene_sequence_frame=scene_sequence_frame,
+            user_info_frame=user_info_frame,
+            overlay_frame=overlay_frame
+        )
+
+    def frame_keys(self, plan: np.ndarray) -> np.ndarray:
+        return np.stack([plan['scene'], plan['user_info'], plan['overlay']], axis=1)
+
+    def generator(self, cache: ProcessingCache, frames: np.ndarray):
+        for frame in frames:
+            image = self.render(cache, frame)
+
+            if image is not None:
+                image.save(os.path.join(self.__generator_params.output_path,
+                                        self._frame_name(int(frame['frame']), cache.max_digits)))
 
     def process(self):
         cache = ProcessingCache()
@@ -295,40 +499,52 @@ class FrameGenerator(BaseFrameGenerator):
         cache.total_frames_count = total_frames_count
 
         cache.max_digits = int(math.log10(total_frames_count)) + 1
-        cache.intensities = \
-            self.__generator_params.waveform_generator.process(self.__ugc_params.waveform_generator_params)
 
         self.__generator_params.graphics_generator.save_user_info_png(self.__ugc_params.username,
                                                                       self.__ugc_params.track_name)
 
         self.__generator_params.graphics_generator.save_avatar(self.__ugc_params.avatar_path)
 
-        cache.scene_sequence = self.__generator_params.graphics_generator.process_scene_frames(
-            self.__ugc_params.graphics_generator_params.scene_template_id,
-            self.__ugc_params.width,
-            self.__ugc_params.height
-        )
-
-        cache.user_info_sequence = self.__generator_params.graphics_generator.process_user_info_frames(
-            self.__ugc_params.graphics_generator_params.user_info_template_id,
-            self.__ugc_params.width,
-            self.__ugc_params.height
-        )
-
-        if self.__ugc_params.graphics_generator_params.overlay_template_id:
-            cache.overlay_sequence = self.__generator_params.graphics_generator.process_overlay_frames(
-                self.__ugc_params.graphics_generator_params.overlay_template_id,
-                self.__ugc_params.width,
-                self.__ugc_params.height
-            )
-        else:
-            cache.overlay_sequence = None
-
-        chunks = np.array_split(cache.intensities, cache.total_frames_count)
-        cache.frames_intensity = [np.mean(i) for i in chunks]
-
-        Parallel(n_jobs=self.__generator_params.jobs, verbose=0 if not self.__verbose else total_frames_count)(
-            delayed(self.generator)(cache, i) for i in range(total_frames_count))
+        # сцена, user info и оверлей независимы и рендерятся одновременно, а blender работает,
+        # пока анализируется трек: текстуры для шаблонов уже сохранены
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            layers = executor.submit(self.__generator_params.graphics_generator.process_layers,
+                                     self.__ugc_params.graphics_generator_params.scene_template_id,
+                                     self.__ugc_params.graphics_generator_params.user_info_template_id,
+                                     self.__ugc_params.graphics_generator_params.overlay_template_id,
+                                     self.__ugc_params.width,
+                                     self.__ugc_params.height)
+
+            intensities = \
+                self.__generator_params.waveform_generator.process(self.__ugc_params.waveform_generator_params)
+
+            cache.scene_sequence, cache.user_info_sequence, cache.overlay_sequence = layers.result()
+
+        self.__logger("planning frames")
+
+        plan = RenderPlanner.blender(intensities,
+                                     self.__generator_params.waveform_generator.output_rate(
+                                        self.__ugc_params.waveform_generator_params),
+                                     self.__ugc_params.framerate,
+                                     total_frames_count,
+                                     len(cache.scene_sequence),
+                                     len(cache.user_info_sequence),
+                                     len(cache.overlay_sequence) if cache.overlay_sequence else 0,
+                                     self.__ugc_params.graphics_generator_params.disable_intro)
+
+        if self.__generator_params.plan_path:
+            RenderPlanner.save(plan, self.__generator_params.plan_path)
+
+        self.__logger("decoding templates")
+
+        with SequenceStore(self.__generator_params.sequence_store_dir, self.__generator_params.jobs,
+                           self.__verbose) as store:
+            cache.scene_frames = store.put("scene", cache.scene_sequence, plan['scene'])
+            cache.user_info_frames = store.put("user_info", cache.user_info_sequence, plan['user_info'])
+            if cache.overlay_sequence:
+                cache.overlay_frames = store.put("overlay", cache.overlay_sequence, plan['overlay'])
+
+            self._dispatch(cache, plan, self.__generator_params, self.__ugc_params, self.__verbose)
 
 
 class FrameGeneratorLoader:
@@ -1,17 +1,22 @@
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
-from natsort import natsorted
+from typing import Callable, Dict, List, Optional, Tuple
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
 
 here = os.path.dirname(__file__)
 sys.path.append(os.path.join(here, '..'))
 
 from .engine.blender import BlenderEngine
+from .engine.worker import BlenderWorkerEngine
+from .engine.enums import DEFAULT_ENGINE, DEFAULT_DEVICE
+from .render_cache import RenderCache, DEFAULT_MAX_BYTES
 from settings import BLENDER_PATH, SCENE_SOURCE, PROJECT_FILE, SCENE_OUTPUT, USER_SOURCE, USER_OUTPUT, OVERLAY_SOURCE, \
-    OVERLAY_OUTPUT, AVATAR_STORE, AVATAR_BLUR, USER_INFO_IMG, USER_INFO_FONT
+    OVERLAY_OUTPUT, AVATAR_STORE, AVATAR_BLUR, USER_INFO_IMG, USER_INFO_FONT, SCENE_TEXTURES, USER_TEXTURES, \
+    OVERLAY_TEXTURES, GENERATED_TEXTURES
 
 
 @dataclass
@@ -30,55 +35,221 @@ class GraphicsGeneratorInterface:
         pass
 
 
-class GraphicsGenerator:
+class RenderProgress:
+    """
+    Combined progress of concurrently rendered sequences, printed as one line per update.
+    """
+
     def __init__(self, verbose: bool):
+        self.__verbose = verbose
+        self.__lock = threading.Lock()
+        self.__state: Dict[str, Tuple[int, int]] = {}
+
+    def track(self, name: str) -> Callable[[int, int], None]:
+        def update(rendered: int, total: int):
+            with self.__lock:
+                self.__state[name] = (rendered, total)
+                if self.__verbose:
+                    print("rendered " + " ".join(f"{key} {done}/{count}"
+                                                 for key, (done, count) in self.__state.items()))
+
+        return update
+
+
+class GraphicsGenerator:
+    def __init__(self, verbose: bool, render_cache: Optional[RenderCache] = None,
+                 blender_path: str = BLENDER_PATH, render_device: str = DEFAULT_DEVICE,
+                 shards: int = 1, threads: Optional[int] = None, persistent: bool = False,
+                 render_timeout: Optional[float] = None):
         self.verbose = verbose
-        self.blender = BlenderEngine(BLENDER_PATH)
+        # постоянные процессы blender держат шаблоны загруженными между рендерами
+        self.blender = BlenderWorkerEngine(blender_path) if persistent else BlenderEngine(blender_path)
+        self.render_cache = render_cache
+        self.render_device = render_device
+        self.shards = shards
+        self.threads = threads
+        self.render_timeout = render_timeout
+        self.__progress: Optional[RenderProgress] = None
+        self.__concurrency = 1
 
     def __logger(self, msg):
         if self.verbose:
             print(msg)
 
+    @staticmethod
+    def png_sequence(directory: str) -> List[Path]:
+        from natsort import natsorted
+
+        natsort_files = natsorted(os.listdir(directory))
+        return [Path(f'{directory}/{file}') for file in natsort_files if file.endswith(".png")]
+
+    def close(self):
+        if isinstance(self.blender, BlenderWorkerEngine):
+            self.blender.close()
+
+    def render_threads(self) -> Optional[int]:
+        if self.threads or self.shards <= 1:
+            return self.threads
+
+        # без явного числа потоков ядра делятся поровну между всеми одновременно запущенными blender
+        return max(1, (os.cpu_count() or 1) // (self.shards * self.__concurrency))
+
+    def blender_render(self, project_file: str, output: str, frames: range, width, height):
+        name = Path(output).name
+        progress = self.__progress.track(name) if self.__progress else RenderProgress(self.verbose).track(name)
+
+        stats = self.blender.render(project_file, output, frames, width, height, render_device=self.render_device,
+                                    shards=self.shards, threads=self.render_threads(), progress=progress,
+                                    timeout=self.render_timeout)
+
+        self.__logger(f"{name}: {stats.frames} frames in {stats.seconds:.1f} s "
+                      f"({stats.mean_frame_seconds:.2f} s per frame)")
+
+    def render_sequence(self, project_file: str, output: str, frames: range, width, height,
+                        textures: List[str]) -> List[Path]:
+        # старые кадры удаляются, а не перезаписываются: они могут быть жесткими ссылками на кэш
+        os.makedirs(output, exist_ok=True)
+        for file in os.listdir(output):
+            if file.endswith(".png"):
+                os.remove(os.path.join(output, file))
+
+        if self.render_cache is None:
+            self.blender_render(project_file, output, frames, width, height)
+            return self.png_sequence(output)
+
+        key = self.__cache_key(project_file, frames, width, height, textures)
+
+        if not self.render_cache.restore(key, output):
+            self.__logger(f"rendering {project_file}")
+            self.blender_render(project_file, output, frames, width, height)
+            self.render_cache.put(key, output)
+
+        return self.png_sequence(output)
+
+    @staticmethod
+    def referenced_textures(project_file: str) -> Optional[List[str]]:
+        """
+        Generated textures the .blend file refers to: paths of images are stored in it as plain strings.
+        None when the file is compressed and can not be checked.
+        """
+
+        with open(project_file, 'rb') as file:
+            content = file.read()
+
+        if not content.startswith(b'BLENDER'):
+            return None
+
+        return [texture for texture in GENERATED_TEXTURES if os.path.basename(texture).encode() in content]
+
+    def __cache_key(self, project_file: str, frames: range, width, height, textures: List[str]) -> str:
+        # рендер, читающий не учтенную в ключе текстуру пользователя, отдавался бы из кэша другим пользователям
+        referenced = self.referenced_textures(project_file)
+
+        if referenced is None:
+            self.__logger(f"{project_file} is compressed, its textures are not checked")
+        elif set(referenced) - set(textures):
+            raise ValueError(f"{project_file} reads {', '.join(sorted(set(referenced) - set(textures)))}, "
+                             f"add them to the template textures in settings.py")
+
+        # файлы рядом с .blend (текстуры шаблона) тоже входят в ключ
+        template_dir = os.path.dirname(project_file)
+        template_files = [os.path.join(template_dir, file) for file in os.listdir(template_dir)]
+
+        return self.render_cache.key(project_file, template_files + list(textures),
+                                     engine=self.blender.engine_path, width=width, height=height,
+                                     render_engine=DEFAULT_ENGINE, render_device=self.render_device,
+                                     frames=[frames.start, frames.stop])
+
+    def cached_sequence(self, project_file: str, output: str, frames: range, width, height,
+                        textures: List[str]) -> Optional[List[Path]]:
+        """
+        Frames of a template without rendering it: the render cache entry when there is one,
+        otherwise the last render left in output (may be another template). None when neither exists.
+        """
+
+        if self.render_cache is not None:
+            entry = self.render_cache.get(self.__cache_key(project_file, frames, width, height, textures))
+            if entry is not None:
+                return self.png_sequence(str(entry))
+
+        if os.path.isdir(output) and self.png_sequence(output):
+            self.__logger(f"no cached render of {project_file}, using last render in {output}")
+            return self.png_sequence(output)
+
+        return None
+
+    def preview_layers(self, scene_template_id, overlay_template_id, width, height) \
+            -> Tuple[Optional[List[Path]], Optional[List[Path]]]:
+        """
+        Scene and overlay sequences for a preview, blender is never started.
+        User info is not looked up: its renders depend on the avatar and names of the user.
+        """
+
+        def sequence(source, output, template_id, frames, textures):
+            if not os.path.exists(f"{source}/{template_id}/{PROJECT_FILE}"):
+                return self.png_sequence(source) or None
+
+            return self.cached_sequence(f"{source}/{template_id}/{PROJECT_FILE}", output, frames, width, height,
+                                        textures)
+
+        scene = sequence(SCENE_SOURCE, SCENE_OUTPUT, scene_template_id, range(0, 90), SCENE_TEXTURES)
+        overlay = sequence(OVERLAY_SOURCE, OVERLAY_OUTPUT, overlay_template_id, range(0, 30), OVERLAY_TEXTURES) \
+            if overlay_template_id else None
+
+        return scene, overlay
+
     def process_scene_frames(self, scene_template_id, width, height) -> List[Path]:
 
         if not os.path.exists(f"{SCENE_SOURCE}/{scene_template_id}/{PROJECT_FILE}"):
-            natsort_files = natsorted(os.listdir(SCENE_SOURCE))
-            return [Path(f'{SCENE_SOURCE}/{file}') for file in natsort_files if file.endswith(".png")]
+            return self.png_sequence(SCENE_SOURCE)
 
         # если не находит .blend файл в папке темлейта, то импортирует как png sequence
 
-        self.blender.render(f"{SCENE_SOURCE}/{scene_template_id}/{PROJECT_FILE}",
-                            SCENE_OUTPUT, range(0, 90), width, height)
-
-        natsort_files = natsorted(os.listdir(SCENE_OUTPUT))
-        return [Path(f'{SCENE_OUTPUT}/{file}') for file in natsort_files if file.endswith(".png")]
+        return self.render_sequence(f"{SCENE_SOURCE}/{scene_template_id}/{PROJECT_FILE}",
+                                    SCENE_OUTPUT, range(0, 90), width, height, SCENE_TEXTURES)
 
     def process_user_info_frames(self, user_info_template_id, width, height) -> List[Path]:
 
         if not os.path.exists(f"{USER_SOURCE}/{user_info_template_id}/{PROJECT_FILE}"):
-            natsort_files = natsorted(os.listdir(USER_SOURCE))
-            return [Path(f'{USER_SOURCE}/{file}') for file in natsort_files if file.endswith(".png")]
+            return self.png_sequence(USER_SOURCE)
 
         # если не находит .blend файл в папке темлейта, то импортирует как png sequence
 
-        self.blender.render(f"{USER_SOURCE}/{user_info_template_id}/{PROJECT_FILE}",
-                            USER_OUTPUT, range(0, 105), width, height)
-
-        natsort_files = natsorted(os.listdir(USER_OUTPUT))
-        return [Path(f'{USER_OUTPUT}/{file}') for file in natsort_files if file.endswith(".png")]
+        return self.render_sequence(f"{USER_SOURCE}/{user_info_template_id}/{PROJECT_FILE}",
+                                    USER_OUTPUT, range(0, 105), width, height, USER_TEXTURES)
 
     def process_overlay_frames(self, overlay_template_id, width, height) -> List[Path]:
 
         if not os.path.exists(f"{OVERLAY_SOURCE}/{overlay_template_id}/{PROJECT_FILE}"):
-            natsort_files = natsorted(os.listdir(OVERLAY_SOURCE))
-            return [Path(f'{OVERLAY_SOURCE}/{file}') for file in natsort_files if file.endswith(".png")]
+            return self.png_sequence(OVERLAY_SOURCE)
 
         # если не находит .blend файл в папке темлейта, то импортирует как png sequence
 
-        self.blender.render(f"{OVERLAY_SOURCE}/{overlay_template_id}/{PROJECT_FILE}",
-                            OVERLAY_OUTPUT, range(0, 30), width, height)
-        natsort_files = natsorted(os.listdir(OVERLAY_OUTPUT))
-        return [Path(f'{OVERLAY_OUTPUT}/{file}') for file in natsort_files if file.endswith(".png")]
+        return self.render_sequence(f"{OVERLAY_SOURCE}/{overlay_template_id}/{PROJECT_FILE}",
+                                    OVERLAY_OUTPUT, range(0, 30), width, height, OVERLAY_TEXTURES)
+
+    def process_layers(self, scene_template_id, user_info_template_id, overlay_template_id, width, height) \
+            -> Tuple[List[Path], List[Path], Optional[List[Path]]]:
+        """
+        Renders scene, user info and overlay (when overlay_template_id is set) sequences concurrently.
+        """
+
+        jobs = [(self.process_scene_frames, scene_template_id), (self.process_user_info_frames, user_info_template_id)]
+        if overlay_template_id:
+            jobs.append((self.process_overlay_frames, overlay_template_id))
+
+        self.__progress = RenderProgress(self.verbose)
+        self.__concurrency = len(jobs)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+                futures = [executor.submit(job, template_id, width, height) for job, template_id in jobs]
+                sequences = [future.result() for future in futures]
+        finally:
+            self.__progress = None
+            self.__concurrency = 1
+
+        return sequences[0], sequences[1], sequences[2] if overlay_template_id else None
 
     def save_avatar(self, avatar_path):
         img = Image.open(avatar_path)
@@ -114,5 +285,10 @@ class GraphicsGenerator:
 
 class GraphicsGeneratorLoader:
     @staticmethod
-    def load(verbose: bool):
-        return GraphicsGenerator(verbose)
+    def load(verbose: bool, render_cache_dir: Optional[str] = None, render_cache_size: int = DEFAULT_MAX_BYTES,
+             blender_path: str = BLENDER_PATH, use_cpu: bool = False, shards: int = 1,
+             threads: Optional[int] = None, persistent: bool = False, render_timeout: Optional[float] = None):
+        render_cache = None if render_cache_dir is None else RenderCache(render_cache_dir, render_cache_size, verbose)
+
+        return GraphicsGenerator(verbose, render_cache, blender_path, 'CPU' if use_cpu else DEFAULT_DEVICE,
+                                 shards, threads, persistent, render_timeout)
@@ -0,0 +1,120 @@
+# модуль импортирует и сервис (app/cli_path.py), поэтому из CLI он берет только settings и services
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+@dataclass
+class Layer:
+    image: Image.Image
+    position: Tuple[int, int] = (0, 0)
+
+
+class ZoomLayer:
+    """
+    Zoomed and centered source image as seen through the frame viewport.
+    Only the part of the source that ends up visible is resampled, so the cost does not depend on the zoom.
+    The source can be stored reduced, which is enough for heavily blurred backgrounds.
+    """
+
+    def __init__(self, source: Image.Image, width: int, height: int, reduce: int = 1) -> None:
+        self.width = width
+        self.height = height
+
+        source = source.convert("RGB")
+        self.__source = source.reduce(reduce) if reduce > 1 else source
+
+    def render(self, size: Tuple[int, int], position: Tuple[int, int]) -> Image.Image:
+        x, y = position
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + size[0], self.width), min(y + size[1], self.height)
+
+        # координаты видимого окна в пикселях хранимого (возможно уменьшенного) источника
+        scale_x = self.__source.width / size[0]
+        scale_y = self.__source.height / size[1]
+        box = ((left - x) * scale_x, (top - y) * scale_y, (right - x) * scale_x, (bottom - y) * scale_y)
+
+        if right <= left or bottom <= top:
+            return Image.new("RGB", (self.width, self.height))
+
+        visible = self.__source.resize((right - left, bottom - top), Image.Resampling.BICUBIC, box)
+
+        if (left, top, right, bottom) == (0, 0, self.width, self.height):
+            return visible
+
+        frame = Image.new("RGB", (self.width, self.height))
+        frame.paste(visible, (left, top))
+        return frame
+
+
+class LayerCompositor:
+    """
+    Composites frames from one opaque dynamic layer under a stack of static layers.
+    Static layers are merged once into a premultiplied overlay, so every frame is a single "over" pass
+    into a reused buffer. Frames are opaque RGB.
+    """
+
+    def __init__(self, width: int, height: int, static_layers: List[Layer]) -> None:
+        self.width = width
+        self.height = height
+
+        premultiplied, alpha = self.merge(width, height, static_layers)
+
+        # 8 бит дробной части: фон * (1 - alpha) + premultiplied + 0.5 укладывается в uint16,
+        # слой ограничен так, чтобы сумма с белым фоном не переполнилась
+        inverse = np.repeat(np.rint((1.0 - alpha) * 256.0)[..., None], 3, axis=2)
+        overlay = np.minimum(np.rint(premultiplied * 256.0) + 128, 65535 - 255 * inverse)
+
+        self.__inverse = inverse.astype(np.uint16)
+        self.__overlay = overlay.astype(np.uint16)
+        self.__buffer: Optional[np.ndarray] = None
+
+    def __getstate__(self):
+        # рабочий буфер создается в каждом процессе заново
+        state = self.__dict__.copy()
+        state['_LayerCompositor__buffer'] = None
+        return state
+
+    @staticmethod
+    def merge(width: int, height: int, layers: List[Layer]) -> Tuple[np.ndarray, np.ndarray]:
+        premultiplied = np.zeros((height, width, 3), dtype=np.float32)
+        alpha = np.zeros((height, width), dtype=np.float32)
+
+        for layer in layers:
+            canvas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+            canvas.paste(layer.image.convert("RGBA"), layer.position)
+            pixels = np.asarray(canvas, dtype=np.float32)
+
+            layer_alpha = pixels[..., 3] / 255.0
+            premultiplied = pixels[..., :3] * layer_alpha[..., None] + premultiplied * (1.0 - layer_alpha[..., None])
+            alpha = layer_alpha + alpha * (1.0 - layer_alpha)
+
+        return premultiplied, alpha
+
+    def visible(self, image: Image.Image, position: Tuple[int, int]) -> np.ndarray:
+        x, y = position
+
+        if x <= 0 and y <= 0 and x + image.width >= self.width and y + image.height >= self.height:
+            viewport = image.crop((-x, -y, self.width - x, self.height - y))
+        else:
+            # слой не закрывает кадр целиком, непокрытая часть -- черный фон
+            viewport = Image.new("RGB", (self.width, self.height))
+            viewport.paste(image, position)
+
+        if viewport.mode != "RGB":
+            viewport = viewport.convert("RGB")
+
+        return np.asarray(viewport)
+
+    def render(self, image: Image.Image, position: Tuple[int, int]) -> Image.Image:
+        if self.__buffer is None:
+            self.__buffer = np.empty((self.height, self.width, 3), dtype=np.uint16)
+
+        buffer = self.__buffer
+        np.multiply(self.visible(image, position), self.__inverse, out=buffer)
+        np.add(buffer, self.__overlay, out=buffer)
+        np.right_shift(buffer, 8, out=buffer)
+
+        return Image.fromarray(buffer.astype(np.uint8), "RGB")
@@ -0,0 +1,105 @@
+import numpy as np
+
+PLAN_DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('intensity', np.float64),
+    ('scene', np.int32),
+    ('user_info', np.int32),
+    ('overlay', np.int32),
+    ('skip', np.bool_),
+])
+
+
+class RenderPlanner:
+    """
+    Builds render plan -- structured array with one row per output frame.
+    Template indices are -1 when layer is not used, skipped frames lie past the end of the track.
+    """
+
+    @staticmethod
+    def frame_samples(total_frames_count: int, framerate: int, sample_rate: int) -> np.ndarray:
+        # целочисленно, чтобы при sample_rate == framerate кадр не съезжал на соседний из-за округления
+        return np.arange(total_frames_count, dtype=np.int64) * sample_rate // framerate
+
+    @staticmethod
+    def chunk_means(intensities: np.ndarray, count: int) -> np.ndarray:
+        # те же границы чанков, что и у np.array_split
+        size, extra = divmod(len(intensities), count)
+        sizes = np.full(count, size, dtype=np.int64)
+        sizes[:extra] += 1
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+        means = np.full(count, np.nan)
+        non_empty = sizes > 0
+        if np.any(non_empty):
+            means[non_empty] = np.add.reduceat(intensities, starts[non_empty], dtype=np.float64) / sizes[non_empty]
+
+        return means
+
+    @staticmethod
+    def __empty(total_frames_count: int) -> np.ndarray:
+        plan = np.zeros(total_frames_count, dtype=PLAN_DTYPE)
+        plan['frame'] = np.arange(total_frames_count)
+        plan['scene'] = -1
+        plan['user_info'] = -1
+        plan['overlay'] = -1
+        return plan
+
+    @staticmethod
+    def legacy(intensities: np.ndarray, sample_rate: int, framerate: int, total_frames_count: int) -> np.ndarray:
+        plan = RenderPlanner.__empty(total_frames_count)
+        samples = RenderPlanner.frame_samples(total_frames_count, framerate, sample_rate)
+
+        plan['skip'] = samples >= len(intensities)
+        plan['intensity'][~plan['skip']] = intensities[samples[~plan['skip']]]
+
+        return plan
+
+    @staticmethod
+    def blender(intensities: np.ndarray,
+                sample_rate: int,
+                framerate: int,
+                total_frames_count: int,
+                scene_count: int,
+                user_info_count: int,
+                overlay_count: int,
+                disable_intro: bool) -> np.ndarray:
+
+        plan = RenderPlanner.__empty(total_frames_count)
+        samples = RenderPlanner.frame_samples(total_frames_count, framerate, sample_rate)
+        frames = plan['frame'].astype(np.int64)
+        skip = samples >= len(intensities)
+
+        intensity = np.nan_to_num(RenderPlanner.chunk_means(intensities, total_frames_count))
+
+        # первые кадры -- интро (сцена в обратном порядке), дальше кадр сцены выбирается по интенсивности
+        intro = (frames < scene_count) | disable_intro
+        scene = np.where(intro, scene_count - frames - 1, np.rint(intensity * (scene_count - 1)))
+
+        plan['skip'] = skip
+        plan['intensity'] = intensity
+        plan['scene'] = np.where(skip, -1, np.maximum(scene, 0))
+        plan['user_info'] = np.where(skip, -1, np.minimum(frames, user_info_count - 1))
+        if overlay_count:
+            plan['overlay'] = np.where(skip, -1, frames % overlay_count)
+
+        return plan
+
+    @staticmethod
+    def runs(keys: np.ndarray, skip: np.ndarray):
+        # серии подряд идущих кадров с одинаковыми входами: индексы первых кадров и длины
+        keys = keys.reshape(len(keys), -1)
+        changed = np.ones(len(keys), dtype=np.bool_)
+        changed[1:] = np.any(keys[1:] != keys[:-1], axis=1) | (skip[1:] != skip[:-1])
+
+        starts = np.flatnonzero(changed)
+        lengths = np.diff(np.append(starts, len(keys)))
+        return starts, lengths
+
+    @staticmethod
+    def save(plan: np.ndarray, path: str) -> None:
+        np.save(path, plan, allow_pickle=False)
+
+    @staticmethod
+    def load(path: str) -> np.ndarray:
+        return np.load(path, allow_pickle=False)
@@ -0,0 +1,312 @@
+import math
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from .blending import OverlayBlender
+from .frames import FrameGeneratorParams, UGCParams
+from .layers import Layer, LayerCompositor, ZoomLayer
+from .plan import RenderPlanner
+from .video import VideoStreamWriter
+from settings import USER_INFO_FONT
+
+DEFAULT_CLIP_NAME = "preview.mp4"
+DEFAULT_SHEET_NAME = "preview.png"
+
+# фон размывается на копии, уменьшенной так, чтобы радиус размытия на ней был в несколько пикселей
+BLUR_REDUCED_RADIUS = 4
+
+
+@dataclass
+class PreviewParams:
+    preview_type: str = "clip"
+    scale: float = 0.25
+    framerate: int = 10
+    duration: float = 10.0
+    sheet_frames: int = 12
+    sheet_columns: int = 4
+
+
+class PreviewGenerator:
+    """
+    Draft of the video in a few seconds: a downscaled low-framerate clip of the loudest part of the beat
+    or a contact sheet of frames at intensity peaks. Frames are taken from the same render plan as the full
+    render, but templates are never rendered: blender mode uses cached renders of the scene and overlay
+    and draws a static user info card instead of the user info template.
+    """
+
+    def __init__(self,
+                 generator_params: FrameGeneratorParams,
+                 ugc_params: UGCParams,
+                 preview_params: PreviewParams,
+                 verbose: bool,
+                 mode: str) -> None:
+        self.__generator_params = generator_params
+        self.__ugc_params = ugc_params
+        self.__preview_params = preview_params
+        self.__verbose = verbose
+        self.__mode = mode.lower()
+        self.__templates: Dict[str, Image.Image] = {}
+
+        # yuv420p требует четных размеров кадра
+        self.width = self.__even(ugc_params.width * preview_params.scale)
+        self.height = self.__even(ugc_params.height * preview_params.scale)
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    @staticmethod
+    def __even(size: float) -> int:
+        return max(2, int(round(size / 2.0)) * 2)
+
+    def __scaled(self, image: Image.Image) -> Image.Image:
+        size = (max(1, round(image.width * self.__preview_params.scale)),
+                max(1, round(image.height * self.__preview_params.scale)))
+        return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    def process(self) -> str:
+        started = time.perf_counter()
+
+        self.__logger("forming duration")
+
+        duration = math.ceil(self.__generator_params.waveform_generator.duration())
+        total_frames_count = duration * self.__ugc_params.framerate
+
+        intensities = \
+            self.__generator_params.waveform_generator.process(self.__ugc_params.waveform_generator_params)
+        sample_rate = self.__generator_params.waveform_generator.output_rate(
+            self.__ugc_params.waveform_generator_params)
+
+        self.__logger("planning frames")
+
+        if self.__mode == "classic":
+            plan = RenderPlanner.legacy(intensities, sample_rate, self.__ugc_params.framerate, total_frames_count)
+            render = self.__classic_renderer()
+        elif self.__mode == "blender":
+            plan, render = self.__blender_renderer(intensities, sample_rate, total_frames_count)
+        else:
+            raise ValueError(f"unsupported mode {self.__mode}")
+
+        if self.__preview_params.preview_type == "sheet":
+            path = self.__sheet(plan, render)
+        else:
+            path = self.__clip(plan, render)
+
+        self.__logger(f"preview saved to {path} in {time.perf_counter() - started:.1f} s")
+        return path
+
+    def __classic_renderer(self) -> Callable[[np.void], Image.Image]:
+        scale = self.__preview_params.scale
+
+        avatar = Image.open(self.__ugc_params.avatar_path).convert("RGBA")
+
+        zoom = ZoomLayer(self.__cheap_blur(avatar, self.height, self.__ugc_params.blur_radius * scale),
+                         self.width, self.height)
+
+        avatar_size = max(1, round(self.__ugc_params.avatar_size * scale))
+        avatar = avatar.resize((avatar_size, avatar_size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        avatar.putalpha(255)
+        avatar = self.__round_corners(avatar, round(40 * scale))
+
+        # те же слои, что и у классического режима, в масштабе превью
+        layers = LayerCompositor(self.width, self.height,
+                                 [Layer(self.__scaled(Image.open(self.__generator_params.shade_path))),
+                                  Layer(avatar, (round(160 * scale), round(246 * scale)))])
+
+        def render(frame: np.void) -> Image.Image:
+            size = int(self.height * (float(frame['intensity']) + 1.))
+            offset = (int((self.width - size) / 2.0), int((self.height - size) / 2.0))
+            return layers.render(zoom.render((size, size), offset), (0, 0))
+
+        return render
+
+    def __blender_renderer(self, intensities: np.ndarray, sample_rate: int, total_frames_count: int):
+        graphics_params = self.__ugc_params.graphics_generator_params
+
+        scene_sequence, overlay_sequence = self.__generator_params.graphics_generator.preview_layers(
+            graphics_params.scene_template_id, graphics_params.overlay_template_id,
+            self.__ugc_params.width, self.__ugc_params.height)
+
+        if scene_sequence is None:
+            self.__logger("no rendered scene frames, using blurred avatar as the scene")
+
+        plan = RenderPlanner.blender(intensities,
+                                     sample_rate,
+                                     self.__ugc_params.framerate,
+                                     total_frames_count,
+                                     len(scene_sequence) if scene_sequence else 1,
+                                     1,
+                                     len(overlay_sequence) if overlay_sequence else 0,
+                                     graphics_params.disable_intro)
+
+        user_info = self.__user_info_card()
+        background = None if scene_sequence else self.__blurred_background()
+        blender = OverlayBlender(self.__ugc_params.overlay_opacity)
+
+        def render(frame: np.void) -> Image.Image:
+            scene = self.__template(scene_sequence, int(frame['scene'])) if scene_sequence else background
+            image = scene.copy()
+            image.paste(user_info, None, user_info)
+
+            if frame['overlay'] < 0:
+                return image
+
+            pixels = np.array(image)
+            blender.blend(pixels, np.asarray(self.__template(overlay_sequence, int(frame['overlay']))), out=pixels)
+            return Image.fromarray(pixels)
+
+        return plan, render
+
+    def __template(self, sequence: List[Path], index: int) -> Image.Image:
+        # каждый используемый кадр шаблона декодируется и уменьшается один раз
+        path = str(sequence[index])
+
+        if path not in self.__templates:
+            image = Image.open(path).convert("RGBA")
+            self.__templates[path] = image.resize((self.width, self.height), Image.Resampling.BILINEAR,
+                                                  reducing_gap=2.0)
+
+        return self.__templates[path]
+
+    def __blurred_background(self) -> Image.Image:
+        avatar = Image.open(self.__ugc_params.avatar_path)
+        background = self.__cheap_blur(avatar, self.height, self.__ugc_params.blur_radius * self.__preview_params.scale)
+        background = background.resize((self.height, self.height), Image.Resampling.BILINEAR)
+
+        left = (self.height - self.width) // 2
+        return background.crop((left, 0, left + self.width, self.height)).convert("RGBA")
+
+    def __user_info_card(self) -> Image.Image:
+        # заглушка шаблона user info: аватар и подписи без анимации
+        card = Image.new("RGBA", (self.width, self.height), (0, 0, 0, 0))
+
+        avatar_size = self.width // 2
+        avatar = Image.open(self.__ugc_params.avatar_path).convert("RGBA")
+        avatar = avatar.resize((avatar_size, avatar_size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        avatar.putalpha(255)
+        avatar = self.__round_corners(avatar, avatar_size // 10)
+
+        top = (self.height - avatar_size) // 2
+        card.paste(avatar, ((self.width - avatar_size) // 2, top), avatar)
+
+        draw = ImageDraw.Draw(card)
+        y = top + avatar_size + self.height // 40
+
+        for text, size in ((self.__ugc_params.username, 0.07), (self.__ugc_params.track_name, 0.045)):
+            text = text or ""
+            text = text if len(text) < 20 else text[:16] + "..."
+            font = self.__font(max(1, round(self.width * size)))
+
+            _, _, w, h = draw.textbbox((0, 0), text, font=font)
+            draw.text(((self.width - w) / 2, y), text, font=font, fill=(255, 255, 255, 255))
+            y += h + self.height // 80
+
+        return card
+
+    @staticmethod
+    def __font(size: int) -> ImageFont.ImageFont:
+        try:
+            return ImageFont.truetype(USER_INFO_FONT, size)
+        except OSError:
+            return ImageFont.load_default()
+
+    @staticmethod
+    def __round_corners(image: Image.Image, radius: int) -> Image.Image:
+        alpha = Image.new("L", image.size, 0)
+        ImageDraw.Draw(alpha).rounded_rectangle((0, 0, image.width - 1, image.height - 1), radius, fill=255)
+        image.putalpha(alpha)
+        return image
+
+    @staticmethod
+    def __cheap_blur(image: Image.Image, size: int, radius: float) -> Image.Image:
+        # вместо гауссова размытия полноразмерного фона -- два прохода box blur по уменьшенной копии
+        # (два box blur радиуса r*sqrt(3/2) дают ту же дисперсию, что и гаусс с sigma r);
+        # увеличивается копия уже при ресэмплинге видимого окна в ZoomLayer
+        reduce = max(1, int(radius / BLUR_REDUCED_RADIUS))
+        reduced_size = max(1, size // reduce)
+        box_radius = radius / reduce * math.sqrt(1.5)
+
+        image = image.convert("RGB").resize((reduced_size, reduced_size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return image.filter(ImageFilter.BoxBlur(box_radius)).filter(ImageFilter.BoxBlur(box_radius))
+
+    @staticmethod
+    def __output_path(output_path: str, name: str) -> str:
+        if os.path.isdir(output_path):
+            return os.path.join(output_path, name)
+        return output_path
+
+    def __clip(self, plan: np.ndarray, render: Callable[[np.void], Image.Image]) -> str:
+        framerate = self.__ugc_params.framerate
+        rendered = np.flatnonzero(~plan['skip'])
+        length = max(1, min(len(rendered), int(self.__preview_params.duration * framerate)))
+
+        # окно с наибольшей суммарной интенсивностью -- самая громкая часть трека
+        cumsum = np.concatenate(([0.], np.cumsum(plan['intensity'][rendered])))
+        start = int(np.argmax(cumsum[length:] - cumsum[:-length]))
+
+        preview_framerate = min(self.__preview_params.framerate, framerate)
+        frames = rendered[start + (np.arange(0, length, framerate / preview_framerate)).astype(np.int64)]
+
+        self.__logger(f"preview clip: {len(frames)} frames from {start / framerate:.1f} s")
+
+        path = self.__output_path(self.__generator_params.output_path, DEFAULT_CLIP_NAME)
+        writer = VideoStreamWriter(path, self.width, self.height, preview_framerate,
+                                   self.__generator_params.audio_path,
+                                   threads=self.__generator_params.encoder_threads,
+                                   audio_offset=start / framerate,
+                                   verbose=self.__verbose)
+
+        with writer:
+            for frame_num, index in enumerate(frames):
+                writer.write(frame_num, render(plan[index]).convert("RGB").tobytes())
+
+        return writer.output_path
+
+    def __peak_frames(self, plan: np.ndarray) -> np.ndarray:
+        from scipy.signal import find_peaks
+
+        count = self.__preview_params.sheet_frames
+        rendered = np.flatnonzero(~plan['skip'])
+        intensity = plan['intensity'][rendered]
+
+        # самые сильные пики, не ближе половины равномерного шага друг к другу
+        peaks, _ = find_peaks(intensity, distance=max(1, len(rendered) // (count * 2)))
+        peaks = peaks[np.argsort(intensity[peaks], kind='stable')[::-1][:count]]
+
+        if len(peaks) < count:
+            # у ровного трека пиков мало, недостающие кадры берутся равномерно
+            peaks = np.union1d(peaks, np.linspace(0, len(rendered) - 1, count - len(peaks)).astype(np.int64))
+
+        return rendered[np.sort(peaks)]
+
+    def __sheet(self, plan: np.ndarray, render: Callable[[np.void], Image.Image]) -> str:
+        frames = self.__peak_frames(plan)
+
+        columns = max(1, min(self.__preview_params.sheet_columns, len(frames)))
+        rows = math.ceil(len(frames) / columns)
+
+        self.__logger(f"preview sheet: {len(frames)} frames at intensity peaks")
+
+        sheet = Image.new("RGB", (columns * self.width, rows * self.height))
+        draw = ImageDraw.Draw(sheet)
+        font = ImageFont.load_default()
+
+        for i, index in enumerate(frames):
+            x, y = (i % columns) * self.width, (i // columns) * self.height
+            sheet.paste(render(plan[index]).convert("RGB"), (x, y))
+
+            seconds = int(index) // self.__ugc_params.framerate
+            label = f"{seconds // 60}:{seconds % 60:02d}"
+            _, _, w, h = draw.textbbox((0, 0), label, font=font)
+            draw.rectangle((x, y, x + w + 6, y + h + 6), fill=(0, 0, 0))
+            draw.text((x + 3, y + 3), label, font=font, fill=(255, 255, 255))
+
+        path = self.__output_path(self.__generator_params.output_path, DEFAULT_SHEET_NAME)
+        sheet.save(path)
+        return path
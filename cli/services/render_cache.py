@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .analysis_cache import AnalysisCache
+
+RENDER_CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+class RenderCache:
+    """
+    Content-addressed store of rendered template sequences.
+    Key covers the project file, textures it reads, resolution, render engine/device and frame range,
+    each entry is a directory of PNG frames, least recently used entries are evicted above max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES, verbose: bool = False) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.__verbose = verbose
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    @staticmethod
+    def key(project_file: str, textures: Iterable[str], **params) -> str:
+        # текстуры, которых нет на диске, тоже входят в ключ -- как отсутствующие
+        digests = {str(texture): AnalysisCache.file_digest(texture) if os.path.isfile(texture) else None
+                   for texture in sorted(set(map(str, textures)))}
+
+        payload = json.dumps({"project": AnalysisCache.file_digest(project_file), "textures": digests,
+                              "params": params, "version": RENDER_CACHE_VERSION}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def __entry_path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def get(self, key: str) -> Optional[Path]:
+        path = self.__entry_path(key)
+
+        if not path.is_dir():
+            self.__logger(f"render cache miss {key[:12]}")
+            return None
+
+        # время модификации каталога служит меткой последнего использования для вытеснения
+        os.utime(path)
+        self.__logger(f"render cache hit {key[:12]}")
+        return path
+
+    def put(self, key: str, sequence_dir: str) -> Path:
+        temp_path = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-'))
+
+        try:
+            for file in os.listdir(sequence_dir):
+                if file.endswith(".png"):
+                    self.link(Path(sequence_dir) / file, temp_path / file)
+
+            # каталог появляется целиком или не появляется: параллельный запуск мог успеть раньше
+            os.rename(temp_path, self.__entry_path(key))
+        except OSError:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            if not self.__entry_path(key).is_dir():
+                raise
+
+        self.evict()
+        return self.__entry_path(key)
+
+    @staticmethod
+    def link(source: Path, destination: Path) -> None:
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+    def restore(self, key: str, output_dir: str) -> bool:
+        """
+        Puts cached frames into output_dir (hard links when possible). Returns False on cache miss.
+        """
+
+        path = self.get(key)
+        if path is None:
+            return False
+
+        os.makedirs(output_dir, exist_ok=True)
+        for file in os.listdir(output_dir):
+            if file.endswith(".png"):
+                os.remove(os.path.join(output_dir, file))
+
+        for file in os.listdir(path):
+            self.link(path / file, Path(output_dir) / file)
+
+        return True
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if not path.is_dir() or path.name.startswith('.tmp-'):
+                continue
+            try:
+                size = sum(file.stat().st_size for file in path.iterdir())
+                entries.append((path.stat().st_mtime, size, path))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            self.__logger(f"render cache evicting {path.name}")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,142 @@
+import math
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import joblib
+from joblib import Parallel, delayed
+from joblib.externals.loky import get_reusable_executor
+
+from .sequences import SHARED_MEMORY_DIR
+
+CHUNKS_PER_WORKER = 4
+
+# состояние, загруженное этим процессом: путь к файлу и распакованный объект
+_state: Dict[str, Any] = {}
+
+
+def _load_state(path: str) -> Any:
+    if _state.get("path") != path:
+        _state["path"] = path
+        _state["value"] = joblib.load(path, mmap_mode='r')
+    return _state["value"]
+
+
+def _run_chunk(path: str, method: str, args: tuple) -> Any:
+    generator, cache = _load_state(path)
+    return getattr(generator, method)(cache, *args)
+
+
+class ChunkScheduler:
+    """
+    Runs generator methods over contiguous chunks of work in joblib workers.
+    The generator and its processing cache are dumped to a file once and loaded by every worker process
+    on its first chunk, so tasks only carry the chunk itself.
+    """
+
+    def __init__(self, generator: Any, cache: Any, jobs: int, chunk_size: Optional[int] = None,
+                 verbose: bool = False) -> None:
+        self.__generator = generator
+        self.__cache = cache
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.__verbose = verbose
+        self.__path: Optional[str] = None
+        self.__parallel: Optional[Parallel] = None
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    @property
+    def workers(self) -> int:
+        return joblib.effective_n_jobs(self.jobs)
+
+    def split(self, total: int, chunk_size: Optional[int] = None) -> List[slice]:
+        size = chunk_size or self.chunk_size or max(1, math.ceil(total / (self.workers * CHUNKS_PER_WORKER)))
+        return [slice(start, min(start + size, total)) for start in range(0, total, size)]
+
+    def open(self) -> None:
+        directory = SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None
+        fd, self.__path = tempfile.mkstemp(prefix="ugc-state-", suffix=".pkl", dir=directory)
+        os.close(fd)
+
+        joblib.dump((self.__generator, self.__cache), self.__path)
+        self.__logger(f"worker state saved to {self.__path} ({os.path.getsize(self.__path)} bytes)")
+
+    def close(self) -> None:
+        if self.__parallel is not None:
+            self.__parallel.__exit__(None, None, None)
+            self.__parallel = None
+
+        if self.__path is not None:
+            os.remove(self.__path)
+            self.__path = None
+
+    def __enter__(self) -> "ChunkScheduler":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def map(self, method: str, chunks: Sequence[tuple]) -> List[Any]:
+        # пул joblib поднимается при первом упорядоченном запуске, потоковому режиму он не нужен
+        if self.__parallel is None:
+            self.__parallel = Parallel(n_jobs=self.jobs, verbose=0)
+            self.__parallel.__enter__()
+
+        # прогресс отмечается по завершении каждого чанка
+        self.__parallel.verbose = 0 if not self.__verbose else len(chunks)
+        return self.__parallel(delayed(_run_chunk)(self.__path, method, args) for args in chunks)
+
+    def map_plan(self, method: str, plan, chunk_size: Optional[int] = None) -> List[Any]:
+        return self.map(method, [(plan[chunk],) for chunk in self.split(len(plan), chunk_size)])
+
+    def imap_unordered(self, method: str, chunks: Sequence[tuple], ahead: int) -> Iterator[Tuple[int, Any]]:
+        """
+        Yields (chunk index, result) as soon as chunks complete. A chunk is submitted only while it is
+        less than `ahead` chunks past the oldest unfinished one, so finished results never pile up
+        further than that behind a slow chunk.
+        """
+
+        if self.workers == 1:
+            for index, args in enumerate(chunks):
+                yield index, _run_chunk(self.__path, method, args)
+            return
+
+        executor = get_reusable_executor(max_workers=self.workers)
+        running = {}
+        unfinished = set()
+        submitted = 0
+
+        try:
+            while submitted < len(chunks) or running:
+                oldest = min(unfinished) if unfinished else submitted
+
+                while submitted < len(chunks) and submitted < oldest + max(1, ahead):
+                    running[executor.submit(_run_chunk, self.__path, method, chunks[submitted])] = submitted
+                    unfinished.add(submitted)
+                    submitted += 1
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index = running.pop(future)
+                    unfinished.discard(index)
+                    yield index, future.result()
+        finally:
+            # при ошибке или остановке потребителя еще не начатые чанки не выполняются
+            for future in running:
+                future.cancel()
+
+    def imap_plan(self, method: str, plan, chunk_size: int, ahead: int) -> Iterator[Tuple[slice, Any]]:
+        chunks = self.split(len(plan), chunk_size)
+
+        for index, result in self.imap_unordered(method, [(plan[chunk],) for chunk in chunks], ahead):
+            yield chunks[index], result
+
+    @staticmethod
+    def flatten(results: Iterable[List[Any]]) -> List[Any]:
+        return [item for chunk in results for item in chunk]
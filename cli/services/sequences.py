@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+from joblib import Parallel, delayed
+
+SHARED_MEMORY_DIR = "/dev/shm"
+
+# отображения, уже открытые в этом процессе (воркеры joblib подключаются к файлу один раз)
+_attached: Dict[str, np.ndarray] = {}
+
+
+@dataclass
+class SequenceHandle:
+    path: str
+    mode: str
+    slots: Dict[int, int]
+
+
+class SequenceStore:
+    """
+    Decodes template PNG sequences once into contiguous uint8 arrays backed by a memory-mapped file
+    (in /dev/shm when it has room), so parallel workers attach to the same pages instead of decoding PNGs.
+    Only frames referenced by the render plan are decoded.
+    """
+
+    def __init__(self, directory: Optional[str] = None, jobs: int = 1, verbose: bool = False) -> None:
+        self.__directory = directory
+        self.__jobs = jobs
+        self.__verbose = verbose
+        self.__path: Optional[Path] = None
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    def __store_dir(self, required_bytes: int) -> Path:
+        if self.__path is None:
+            base = self.__directory
+            if base is None and os.path.isdir(SHARED_MEMORY_DIR) \
+                    and shutil.disk_usage(SHARED_MEMORY_DIR).free > required_bytes * 2:
+                base = SHARED_MEMORY_DIR
+            self.__path = Path(tempfile.mkdtemp(prefix="ugc-sequences-", dir=base))
+            self.__logger(f"sequence store at {self.__path}")
+
+        return self.__path
+
+    def put(self, name: str, sequence: List[Path], indices: np.ndarray) -> Optional[SequenceHandle]:
+        indices = [int(i) for i in np.unique(indices) if i >= 0]
+
+        if not indices:
+            return None
+
+        with Image.open(sequence[indices[0]]) as first:
+            mode = first.mode if first.mode in ("RGB", "RGBA", "L") else "RGBA"
+            shape = np.asarray(first.convert(mode)).shape
+
+        path = self.__store_dir(len(indices) * int(np.prod(shape))) / f"{name}.npy"
+        frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(len(indices),) + shape)
+
+        def decode(slot, index):
+            with Image.open(sequence[index]) as image:
+                frames[slot] = np.asarray(image.convert(mode))
+
+        self.__logger(f"decoding {len(indices)} of {len(sequence)} {name} frames")
+
+        # PIL отпускает GIL при декодировании PNG, поэтому хватает потоков
+        Parallel(n_jobs=self.__jobs, prefer="threads")(
+            delayed(decode)(slot, index) for slot, index in enumerate(indices))
+
+        frames.flush()
+        del frames
+
+        return SequenceHandle(str(path), mode, {index: slot for slot, index in enumerate(indices)})
+
+    def close(self) -> None:
+        if self.__path is not None:
+            shutil.rmtree(self.__path, ignore_errors=True)
+            self.__path = None
+
+    def __enter__(self) -> "SequenceStore":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @staticmethod
+    def attach(handle: SequenceHandle) -> np.ndarray:
+        if handle.path not in _attached:
+            _attached[handle.path] = np.load(handle.path, mmap_mode='r')
+        return _attached[handle.path]
+
+    @staticmethod
+    def image(handle: SequenceHandle, index: int) -> Image.Image:
+        return Image.fromarray(SequenceStore.attach(handle)[handle.slots[int(index)]], handle.mode)
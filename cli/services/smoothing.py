@@ -0,0 +1,90 @@
+import numpy as np
+
+from .enums import SMOOTHING_ENGINES
+
+
+class SmootherInterface:
+    def smooth(self, signal: np.ndarray, kernel_size: int) -> np.ndarray:
+        pass
+
+    @staticmethod
+    def pad(signal: np.ndarray, kernel_size: int) -> np.ndarray:
+        # отражение краев ровно как в исходной свертке, длина результата после 'valid' не меняется
+        kernel_offset = int(kernel_size / 2)
+        return np.concatenate((signal[0:kernel_offset], signal, signal[len(signal) - kernel_offset:-1]))
+
+
+class ConvolveSmoother(SmootherInterface):
+    """
+    Direct box kernel convolution, O(N*K). Reference implementation.
+    """
+
+    def smooth(self, signal: np.ndarray, kernel_size: int) -> np.ndarray:
+        kernel = np.ones(kernel_size) / kernel_size
+        return np.convolve(self.pad(signal, kernel_size), kernel, mode='valid')
+
+
+class CumsumSmoother(SmootherInterface):
+    """
+    Box kernel moving average via cumulative sum, O(N). Same output as ConvolveSmoother.
+    """
+
+    def smooth(self, signal: np.ndarray, kernel_size: int) -> np.ndarray:
+        padded = self.pad(signal, kernel_size)
+
+        if kernel_size > len(padded):
+            # как np.convolve в режиме 'valid': ядро длиннее сигнала целиком накрывает его в каждой позиции
+            return np.full(kernel_size - len(padded) + 1, np.sum(padded, dtype=np.float64) / kernel_size)
+
+        cumsum = np.empty(len(padded) + 1, dtype=np.float64)
+        cumsum[0] = 0.0
+        np.cumsum(padded, dtype=np.float64, out=cumsum[1:])
+        return (cumsum[kernel_size:] - cumsum[:-kernel_size]) / kernel_size
+
+
+class KernelSmoother(SmootherInterface):
+    """
+    FFT convolution with arbitrary normalized kernel, O(N*log(N)).
+    """
+
+    def kernel(self, kernel_size: int) -> np.ndarray:
+        return np.ones(kernel_size) / kernel_size
+
+    def smooth(self, signal: np.ndarray, kernel_size: int) -> np.ndarray:
+        from scipy.signal import fftconvolve
+
+        kernel = self.kernel(kernel_size)
+        return fftconvolve(self.pad(signal, kernel_size).astype(np.float64), kernel / np.sum(kernel), mode='valid')
+
+
+class GaussianSmoother(KernelSmoother):
+    def kernel(self, kernel_size: int) -> np.ndarray:
+        sigma = max(kernel_size / 6.0, 1e-6)
+        t = np.arange(kernel_size) - (kernel_size - 1) / 2.0
+        return np.exp(-0.5 * (t / sigma) ** 2)
+
+
+class ExponentialSmoother(KernelSmoother):
+    def kernel(self, kernel_size: int) -> np.ndarray:
+        tau = max(kernel_size / 6.0, 1e-6)
+        t = np.arange(kernel_size) - (kernel_size - 1) / 2.0
+        return np.exp(-np.abs(t) / tau)
+
+
+class SmootherLoader:
+    @staticmethod
+    def load(engine: str) -> SmootherInterface:
+        engine = engine.lower()
+
+        if engine == "cumsum":
+            return CumsumSmoother()
+        elif engine == "convolve":
+            return ConvolveSmoother()
+        elif engine == "fft":
+            return KernelSmoother()
+        elif engine == "gaussian":
+            return GaussianSmoother()
+        elif engine == "exponential":
+            return ExponentialSmoother()
+        else:
+            raise ValueError(f'unknown smoothing engine "{engine}", available: {", ".join(SMOOTHING_ENGINES)}')
@@ -0,0 +1,191 @@
+import os
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from settings import FFMPEG_PATH
+
+DEFAULT_VIDEO_NAME = "output.mp4"
+DEFAULT_MANIFEST_NAME = "frames.ffconcat"
+DEFAULT_BUFFER_SIZE = 64
+
+
+class VideoStreamWriter:
+    """
+    Pipes raw RGB frames into a single ffmpeg process and muxes the beat audio in the same pass.
+    Frames may arrive out of order, they wait in a bounded reorder buffer until it is their turn.
+    """
+
+    def __init__(self,
+                 output_path: str,
+                 width: int,
+                 height: int,
+                 framerate: int,
+                 audio_path: Optional[str] = None,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 threads: Optional[int] = None,
+                 audio_offset: float = 0.0,
+                 verbose: bool = False) -> None:
+        self.output_path = self.resolve_output_path(output_path)
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.audio_path = audio_path
+        self.buffer_size = buffer_size
+        self.threads = threads
+        self.audio_offset = audio_offset
+        self.__verbose = verbose
+        self.__frame_size = width * height * 3
+        self.__pending: Dict[int, Tuple[Optional[bytes], int]] = {}
+        self.__next_frame = 0
+        self.__process: Optional[subprocess.Popen] = None
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    @staticmethod
+    def resolve_output_path(output_path: str) -> str:
+        if os.path.isdir(output_path):
+            return os.path.join(output_path, DEFAULT_VIDEO_NAME)
+        return output_path
+
+    def command(self) -> List[str]:
+        cmd = [FFMPEG_PATH, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', f'{self.width}x{self.height}', '-framerate', str(self.framerate),
+               '-i', '-']
+
+        if self.audio_path:
+            # звук клипа, начинающегося не с начала трека, берется с того же места
+            offset = ['-ss', f'{self.audio_offset:.3f}'] if self.audio_offset else []
+            cmd += offset + ['-i', self.audio_path, '-map', '0:v', '-map', '1:a', '-c:a', 'aac', '-shortest']
+
+        # число потоков кодировщика ограничивается, чтобы не отнимать ядра у воркеров кадров
+        threads = ['-threads', str(self.threads)] if self.threads else []
+
+        return cmd + ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-r', str(self.framerate)] + threads + \
+            [self.output_path]
+
+    def open(self) -> "VideoStreamWriter":
+        self.__logger(f"starting encoder: {' '.join(self.command())}")
+        self.__process = subprocess.Popen(self.command(), stdin=subprocess.PIPE,
+                                          stderr=None if self.__verbose else subprocess.DEVNULL)
+        return self
+
+    def write(self, frame_num: int, frame: Optional[bytes], repeat: int = 1) -> None:
+        """
+        Queue frame for encoding as frames frame_num .. frame_num + repeat - 1.
+        None marks frames as skipped (e.g. past the end of the track).
+        """
+
+        if frame_num < self.__next_frame or frame_num in self.__pending:
+            raise ValueError(f'frame {frame_num} was already written')
+
+        if repeat < 1:
+            raise ValueError(f'frame {frame_num} is repeated {repeat} times')
+
+        if frame is not None and len(frame) != self.__frame_size:
+            raise ValueError(f'frame {frame_num} has {len(frame)} bytes, '
+                             f'expected {self.__frame_size} ({self.width}x{self.height} rgb24)')
+
+        # серия одинаковых кадров занимает в буфере одно место
+        self.__pending[frame_num] = (frame, repeat)
+
+        while self.__next_frame in self.__pending:
+            data, count = self.__pending.pop(self.__next_frame)
+            if data is not None:
+                for _ in range(count):
+                    self.__process.stdin.write(data)
+            self.__next_frame += count
+
+        if len(self.__pending) > self.buffer_size:
+            raise BufferError(f'reorder buffer overflow: waiting for frame {self.__next_frame}, '
+                              f'{len(self.__pending)} frames pending')
+
+    def close(self) -> None:
+        if self.__process is None:
+            return
+
+        process, self.__process = self.__process, None
+        process.stdin.close()
+        return_code = process.wait()
+
+        if self.__pending:
+            raise RuntimeError(f'encoder closed with {len(self.__pending)} frames pending, '
+                               f'frame {self.__next_frame} never arrived')
+
+        if return_code != 0:
+            raise RuntimeError(f'ffmpeg exited with code {return_code}')
+
+        self.__logger(f"video saved to {self.output_path}")
+
+    def __enter__(self) -> "VideoStreamWriter":
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is not None and self.__process is not None:
+            self.__process.kill()
+            self.__process.wait()
+            self.__process = None
+            return
+
+        self.close()
+
+
+class ConcatManifest:
+    """
+    ffmpeg concat demuxer script for run-length frame output: every distinct frame image is listed once
+    with the time it stays on screen, encoding it at the original framerate restores every frame.
+    """
+
+    @staticmethod
+    def resolve_path(output_path: str) -> str:
+        return os.path.join(output_path, DEFAULT_MANIFEST_NAME)
+
+    @staticmethod
+    def write(path: str, files: List[str], frame_counts: List[int], framerate: int) -> None:
+        lines = ['ffconcat version 1.0']
+        elapsed_frames = 0
+
+        for file, frame_count in zip(files, frame_counts):
+            # длительности считаются от накопленного числа кадров, чтобы ошибка округления не накапливалась,
+            # framerate картинки задает шкалу времени кратной кадру (по умолчанию image2 округляет до 1/25 с)
+            start = round(elapsed_frames / framerate, 6)
+            elapsed_frames += frame_count
+            lines += [f"file '{file}'", f"option framerate {framerate}",
+                      f"duration {round(elapsed_frames / framerate, 6) - start:.6f}"]
+
+        # длительность последней записи demuxer учитывает только если файл указан еще раз
+        if files:
+            lines += [f"file '{files[-1]}'", f"option framerate {framerate}"]
+
+        with open(path, 'w') as manifest:
+            manifest.write('\n'.join(lines) + '\n')
+
+    @staticmethod
+    def remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def frames_count(path: str, framerate: int) -> int:
+        # число кадров видео -- сумма длительностей записей манифеста
+        with open(path, 'r') as manifest:
+            durations = [float(line.split()[1]) for line in manifest if line.startswith('duration ')]
+
+        return round(sum(durations) * framerate)
+
+    @staticmethod
+    def command(manifest_path: str, output_path: str, framerate: int, total_frames_count: int,
+                audio_path: Optional[str] = None, threads: Optional[int] = None) -> List[str]:
+        cmd = [FFMPEG_PATH, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', manifest_path]
+
+        if audio_path:
+            cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a', '-c:a', 'aac', '-shortest']
+
+        threads = ['-threads', str(threads)] if threads else []
+
+        return cmd + ['-vf', f'fps={framerate}', '-frames:v', str(total_frames_count),
+                      '-c:v', 'libx264', '-pix_fmt', 'yuv420p'] + threads + [output_path]
@@ -1,8 +1,19 @@
-from typing import List
-import librosa
+import math
+from typing import List, Optional
 import numpy as np
-from scipy.signal import hilbert
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+
+from .smoothing import SmootherLoader
+from .analysis_cache import AnalysisCache, DEFAULT_MAX_BYTES
+from .audio import AudioIngest
+from .enums import DEFAULT_SAMPLE_RATE
+
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# метаданные трека в кэше анализа: пространство имен CLI и поля, без которых запись считается промахом
+META_PIPELINE = "cli"
+META_FIELDS = ("duration",)
 
 
 @dataclass
@@ -13,6 +24,9 @@ class WaveformGeneratorParams:
     harmonic_influence: float
     percussive_margin: float
     harmonic_margin: float
+    smoothing: str = "cumsum"
+    analysis_mode: str = "waveform"
+    analysis_rate: Optional[int] = None
 
 
 class WaveformGeneratorInterface:
@@ -25,6 +39,14 @@ class WaveformGeneratorInterface:
     def sample_rate(self) -> int:
         pass
 
+    def output_rate(self, params: WaveformGeneratorParams) -> int:
+        """
+        Rate (values per second) of the array returned by process().
+        """
+        if params.analysis_mode in ("spectrogram", "envelope"):
+            return params.analysis_rate
+        return self.sample_rate()
+
 
 class WaveformGenerator(WaveformGeneratorInterface):
     def __init__(self, y: List[float], sr: int, verbose: bool = False) -> None:
@@ -37,6 +59,13 @@ class WaveformGenerator(WaveformGeneratorInterface):
             print(msg)
 
     def process(self, params: WaveformGeneratorParams) -> np.ndarray:
+        if params.analysis_mode == "spectrogram":
+            return self.__process_spectrogram(params)
+        if params.analysis_mode == "envelope":
+            return self.__process_envelope(params)
+
+        import librosa
+
         self.__logger("percussive extraction")
         harmonic, percussive = librosa.effects.hpss(self.__y, margin=(params.harmonic_margin, params.percussive_margin))
         percussive = percussive * params.percussive_influence + harmonic * params.harmonic_influence
@@ -46,13 +75,53 @@ class WaveformGenerator(WaveformGeneratorInterface):
 
         self.__logger("smoothing")
         kernel_size = int(float(self.__sr) / float(params.smooth_factor))
-        kernel = np.ones(kernel_size) / kernel_size
+        smoothed = SmootherLoader.load(params.smoothing).smooth(normalized, kernel_size)
+
+        return self.__normalize(smoothed, params)
+
+    def __process_spectrogram(self, params: WaveformGeneratorParams) -> np.ndarray:
+        # без обратных STFT: энергия считается прямо по маскированной спектрограмме и сразу приводится к fps
+        import librosa
 
-        kernel_offset = int(kernel_size / 2)
-        padded = np.concatenate((normalized[0:kernel_offset], normalized, normalized[-kernel_offset:-1]))
+        self.__logger("spectrogram")
+        magnitude = np.abs(librosa.stft(self.__y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+
+        self.__logger("percussive extraction")
+        harmonic, percussive = librosa.decompose.hpss(magnitude,
+                                                      margin=(params.harmonic_margin, params.percussive_margin))
 
-        smoothed = np.convolve(padded, kernel, mode='valid')
+        # обе части -- маски одной спектрограммы с общей фазой, поэтому смесь модулей равна модулю смеси
+        mixed = percussive * params.percussive_influence + harmonic * params.harmonic_influence
 
+        self.__logger("energy")
+        envelope = np.sqrt(np.mean(mixed ** 2, axis=0))
+
+        return self.__normalize(self.__resample(envelope, params), params)
+
+    def __process_envelope(self, params: WaveformGeneratorParams) -> np.ndarray:
+        # без HPSS смесь приближается RMS всего сигнала. ближе всего при равных долях и отступах 1.0:
+        # тогда мягкие маски гармоник и ударных в сумме дают исходный спектр и смесь пропорциональна сигналу.
+        # в остальных случаях расхождение больше, но для черновика его хватает
+        self.__logger("energy")
+        frames_count = len(self.__y) // HOP_LENGTH
+        frames = np.asarray(self.__y[:frames_count * HOP_LENGTH], dtype=np.float32).reshape(frames_count, HOP_LENGTH)
+        envelope = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+
+        return self.__normalize(self.__resample(envelope, params), params)
+
+    def __resample(self, envelope: np.ndarray, params: WaveformGeneratorParams) -> np.ndarray:
+        self.__logger("smoothing")
+        hop_rate = float(self.__sr) / HOP_LENGTH
+        kernel_size = max(1, int(hop_rate / float(params.smooth_factor)))
+        smoothed = SmootherLoader.load(params.smoothing).smooth(envelope, kernel_size)
+
+        self.__logger("resampling to {} fps".format(params.analysis_rate))
+        frames_count = math.ceil(self.duration() * params.analysis_rate)
+        frame_times = np.arange(frames_count) / float(params.analysis_rate)
+        hop_times = np.arange(len(smoothed)) / hop_rate
+        return np.interp(frame_times, hop_times, smoothed)
+
+    def __normalize(self, smoothed: np.ndarray, params: WaveformGeneratorParams) -> np.ndarray:
         self.__logger("normalization 2")
         normalized_again = params.widening_factor * (
                     (smoothed - np.min(smoothed)) / (np.max(smoothed) - np.min(smoothed)))
@@ -62,7 +131,7 @@ class WaveformGenerator(WaveformGeneratorInterface):
     def duration(self) -> float:
         self.__logger("get duration")
 
-        return librosa.get_duration(y=self.__y, sr=self.__sr)
+        return len(self.__y) / float(self.__sr)
 
     def sample_rate(self) -> int:
         return self.__sr
@@ -85,6 +154,9 @@ class DemoWaveformGenerator(WaveformGeneratorInterface):
     def sample_rate(self) -> int:
         return 2
 
+    def output_rate(self, params: WaveformGeneratorParams) -> int:
+        return self.sample_rate()
+
     class DemoWaveformGenerator(WaveformGeneratorInterface):
         def __init__(self, verbose: bool = False) -> None:
             self.__verbose = verbose
@@ -103,12 +175,79 @@ class DemoWaveformGenerator(WaveformGeneratorInterface):
             return 2
 
 
+class CachedWaveformGenerator(WaveformGeneratorInterface):
+    """
+    Serves analysis results from AnalysisCache, audio is decoded only on a cache miss.
+    """
+
+    def __init__(self,
+                 beat_path: str,
+                 cache: AnalysisCache,
+                 verbose: bool = False,
+                 sample_rate: int = DEFAULT_SAMPLE_RATE,
+                 pcm_dir: Optional[str] = None) -> None:
+        self.__beat_path = beat_path
+        self.__cache = cache
+        self.__verbose = verbose
+        self.__sample_rate = sample_rate
+        self.__pcm_dir = pcm_dir
+        self.__generator = None
+        self.__digest = cache.file_digest(beat_path)
+        self.__meta = cache.get_meta(self.__digest, META_PIPELINE, META_FIELDS)
+
+    def __logger(self, msg: str):
+        if self.__verbose:
+            print(msg)
+
+    def __load(self) -> WaveformGeneratorInterface:
+        if self.__generator is None:
+            self.__logger("decoding audio")
+            self.__generator = WaveformLoader.load(self.__beat_path, self.__verbose,
+                                                   self.__sample_rate, self.__pcm_dir)
+            self.__meta = {"duration": self.__generator.duration()}
+            self.__cache.put_meta(self.__digest, META_PIPELINE, self.__meta)
+
+        return self.__generator
+
+    def process(self, params: WaveformGeneratorParams) -> np.ndarray:
+        key = self.__cache.key(self.__digest, dict(asdict(params), sample_rate=self.__sample_rate))
+        intensities = self.__cache.get(key)
+
+        if intensities is None:
+            intensities = self.__cache.put(key, self.__load().process(params))
+
+        return intensities
+
+    def duration(self) -> float:
+        # длительность всегда берется из декодированного сигнала: оценка по заголовку (mp3) может отличаться,
+        # и число кадров на холодном и теплом запуске разошлось бы
+        if not self.__meta:
+            self.__load()
+        return self.__meta["duration"]
+
+    def sample_rate(self) -> int:
+        return self.__sample_rate
+
+
 class WaveformLoader:
 
     @staticmethod
-    def load(beat_path: str, verbose: bool) -> WaveformGeneratorInterface:
-        y, sr = librosa.load(beat_path)
-        return WaveformGenerator(y, int(sr), verbose)
+    def load(beat_path: str,
+             verbose: bool,
+             sample_rate: int = DEFAULT_SAMPLE_RATE,
+             pcm_dir: Optional[str] = None) -> WaveformGeneratorInterface:
+        y = AudioIngest(sample_rate, pcm_dir, verbose).load(beat_path)
+        return WaveformGenerator(y, sample_rate, verbose)
+
+    @staticmethod
+    def load_cached(beat_path: str,
+                    cache_dir: str,
+                    verbose: bool,
+                    max_bytes: int = DEFAULT_MAX_BYTES,
+                    sample_rate: int = DEFAULT_SAMPLE_RATE,
+                    pcm_dir: Optional[str] = None) -> WaveformGeneratorInterface:
+        return CachedWaveformGenerator(beat_path, AnalysisCache(cache_dir, max_bytes, verbose), verbose,
+                                       sample_rate, pcm_dir)
 
     @staticmethod
     def load_demo(verbose: bool) -> WaveformGeneratorInterface:
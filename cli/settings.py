@@ -16,4 +16,18 @@ AVATAR_BLUR = "sources/images/avatar-blur.png"
 USER_INFO_IMG = "sources/images/user-info.png"
 USER_INFO_FONT = "sources/fonts/Druk Text Wide Cyr Medium.otf"
 
-FINAL_RENDER = "output/final"
\ No newline at end of file
+# текстуры, которые генерируются заново для каждого пользователя
+GENERATED_TEXTURES = [AVATAR_STORE, AVATAR_BLUR, USER_INFO_IMG]
+
+# сгенерированные текстуры, которые читает каждый шаблон (входят в ключ кэша рендеров).
+# сцена и оверлей от пользователя не зависят, их рендеры общие для всех; если шаблон начнет читать
+# сгенерированную текстуру, не указанную здесь, GraphicsGenerator откажется кэшировать его рендеры
+SCENE_TEXTURES = []
+USER_TEXTURES = [AVATAR_STORE, AVATAR_BLUR, USER_INFO_IMG]
+OVERLAY_TEXTURES = []
+
+RENDER_CACHE = "output/cache/renders"
+
+FINAL_RENDER = "output/final"
+
+FFMPEG_PATH = "ffmpeg"
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the blender executable: understands the command line BlenderEngine builds
+(-b, -E, --python, -o with #, -t, -f or -s/-e/-a) and writes a flat PNG per frame,
+printing blender-like "Fra:" / "Saved:" lines.
+
+Frame color encodes the frame number, so shard boundaries can be checked.
+With --python services/engine/blender_worker.py ... -- --worker <socket> it runs the persistent worker
+protocol from that script with the same flat PNG renderer.
+FAKE_BLENDER_DELAY sets seconds spent per frame, FAKE_BLENDER_FAIL_FRAME makes that frame fail.
+
+    python cli.py ... --blender-path tests/fake_blender.py --use-cpu --render-shards 4
+"""
+import importlib.util
+import os
+import re
+import sys
+import time
+
+from PIL import Image
+
+
+def parse(argv):
+    args = {"start": 1, "end": 250, "frames": [], "threads": 0, "resolution": (1000, 1000)}
+    argv = argv[:argv.index('--')] if '--' in argv else argv
+    i = 0
+
+    while i < len(argv):
+        arg = argv[i]
+
+        if arg == '-b':
+            args["project"] = argv[i + 1]
+            i += 1
+        elif arg in ('-E', '-t', '-o', '-s', '-e', '-f', '--python'):
+            value = argv[i + 1]
+            i += 1
+
+            if arg == '-o':
+                args["output"] = value
+            elif arg == '-t':
+                args["threads"] = int(value)
+            elif arg == '-s':
+                args["start"] = int(value)
+            elif arg == '-e':
+                args["end"] = int(value)
+            elif arg == '-f':
+                args["frames"].append(int(value))
+            elif arg == '--python':
+                args["script"] = value
+                with open(value) as script:
+                    source = script.read()
+                width = re.search(r'resolution_x = (\d+)', source)
+                height = re.search(r'resolution_y = (\d+)', source)
+                if width and height:
+                    args["resolution"] = (int(width.group(1)), int(height.group(1)))
+        elif arg == '-a':
+            args["frames"] += list(range(args["start"], args["end"] + 1))
+
+        i += 1
+
+    return args
+
+
+def frame_path(output, frame):
+    hashes = output.count('#') or 4
+    pattern = output if '#' in output else output + '#' * hashes
+    return re.sub('#+', str(frame).zfill(hashes), pattern, count=1) + '.png'
+
+
+class FakeRenderer:
+    def __init__(self):
+        self.delay = float(os.environ.get("FAKE_BLENDER_DELAY", "0"))
+        self.fail_frame = os.environ.get("FAKE_BLENDER_FAIL_FRAME")
+        self.resolution = (1000, 1000)
+
+    def prepare(self, job: dict):
+        self.resolution = (job["width"], job["height"])
+
+    def render(self, frame: int, path: str):
+        print(f"Fra:{frame} Mem:0.00M | Time:00:00.00 | Rendering", flush=True)
+        time.sleep(self.delay)
+
+        if self.fail_frame is not None and frame == int(self.fail_frame):
+            raise RuntimeError(f"cannot render frame {frame}")
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        Image.new("RGBA", self.resolution, (frame % 256, frame // 256 % 256, 0, 255)).save(path)
+        print(f"Saved: '{path}'", flush=True)
+        print(f" Time: 00:{self.delay:05.2f} (Saving: 00:00.00)", flush=True)
+
+
+def serve_worker(args, argv):
+    spec = importlib.util.spec_from_file_location("blender_worker", args["script"])
+    worker = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(worker)
+
+    worker.serve(argv[argv.index(worker.WORKER_ARGUMENT) + 1], FakeRenderer())
+
+
+def main():
+    args = parse(sys.argv[1:])
+    extra = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    renderer = FakeRenderer()
+    renderer.resolution = args["resolution"]
+
+    print(f"Blender 3.5.0 (fake) threads {args['threads'] or os.cpu_count()}", flush=True)
+    print(f"Read blend: {args.get('project')}", flush=True)
+
+    if '--worker' in extra:
+        serve_worker(args, extra)
+        return
+
+    for frame in args["frames"]:
+        try:
+            renderer.render(frame, frame_path(args["output"], frame))
+        except RuntimeError as error:
+            print(f"Error: {error}", flush=True)
+            sys.exit(1)
+
+    print("Blender quit", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from services.analysis_cache import AnalysisCache
+
+DIGEST = "0" * 64
+
+
+class AnalysisCacheMetaTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.cache = AnalysisCache(self.dir)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_pipelines_do_not_share_meta(self):
+        # CLI и сервис пишут метаданные одного трека в общий каталог
+        self.cache.put_meta(DIGEST, "service", {"sample_rate": 22050, "samples": 100, "duration": 1.0})
+        self.cache.put_meta(DIGEST, "cli", {"duration": 1.5})
+
+        self.assertEqual({"sample_rate": 22050, "samples": 100, "duration": 1.0},
+                         self.cache.get_meta(DIGEST, "service", ("sample_rate", "samples", "duration")))
+        self.assertEqual({"duration": 1.5}, self.cache.get_meta(DIGEST, "cli", ("duration",)))
+
+    def test_incomplete_meta_is_a_miss(self):
+        self.cache.put_meta(DIGEST, "service", {"duration": 1.0})
+
+        self.assertIsNone(self.cache.get_meta(DIGEST, "service", ("sample_rate", "samples", "duration")))
+        self.assertEqual({"duration": 1.0}, self.cache.get_meta(DIGEST, "service"))
+
+    def test_missing_meta(self):
+        self.assertIsNone(self.cache.get_meta(DIGEST, "cli", ("duration",)))
+
+    def test_entries_round_trip(self):
+        key = self.cache.key(DIGEST, {"smooth": 8.0})
+        intensities = np.linspace(0, 1, 10)
+
+        self.assertIsNone(self.cache.get(key))
+        np.testing.assert_allclose(intensities, self.cache.put(key, intensities), rtol=1e-6)
+        np.testing.assert_allclose(intensities, self.cache.get(key), rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from services.blending import OverlayBlender
+
+OPACITIES = (0.0, 0.25, 0.5, 0.8, 1.0)
+TOLERANCE = 1
+
+
+def random_rgba(rng: np.random.Generator, shape) -> np.ndarray:
+    images = rng.integers(0, 256, shape, dtype=np.uint8)
+
+    # как в шаблонах: непрозрачные и полностью прозрачные области у обоих слоев
+    height = shape[-3]
+    images[..., :height // 4, :, 3] = 255
+    images[..., height // 4:height // 2, :, 3] = 0
+    return images
+
+
+class OverlayBlenderTest(unittest.TestCase):
+    def setUp(self) -> None:
+        import blend_modes
+
+        self.blend_modes = blend_modes
+        rng = np.random.default_rng(0)
+        self.images = random_rgba(rng, (3, 64, 48, 4))
+        self.layers = random_rgba(rng, (3, 64, 48, 4))
+        # прозрачный оверлей над непрозрачным изображением и наоборот
+        self.layers[:, 48:, :, 3] = 0
+        self.images[:, 56:, :, 3] = 255
+
+    def reference(self, image: np.ndarray, layer: np.ndarray, opacity: float) -> np.ndarray:
+        return np.uint8(self.blend_modes.overlay(image.astype(float), layer.astype(float), opacity))
+
+    def assert_close(self, expected: np.ndarray, actual: np.ndarray) -> None:
+        diff = np.abs(expected.astype(np.int16) - actual.astype(np.int16))
+        self.assertLessEqual(int(diff.max()), TOLERANCE)
+
+    def test_frame_matches_blend_modes(self):
+        for opacity in OPACITIES:
+            with self.subTest(opacity=opacity):
+                blender = OverlayBlender(opacity)
+                self.assert_close(self.reference(self.images[0], self.layers[0], opacity),
+                                  blender.blend(self.images[0], self.layers[0]))
+
+    def test_batch_matches_blend_modes(self):
+        for opacity in OPACITIES:
+            with self.subTest(opacity=opacity):
+                expected = np.stack([self.reference(image, layer, opacity)
+                                     for image, layer in zip(self.images, self.layers)])
+                out = np.empty_like(self.images)
+
+                blended = OverlayBlender(opacity).blend(self.images, self.layers, out=out)
+
+                self.assertIs(blended, out)
+                self.assert_close(expected, blended)
+
+    def test_transparent_overlay_keeps_image(self):
+        blended = OverlayBlender(0.8).blend(self.images, self.layers)
+        # при нулевой альфе изображения цвет обнуляется, как в blend_modes, поэтому проверяются видимые пиксели
+        transparent = (self.layers[..., 3] == 0) & (self.images[..., 3] > 0)
+        self.assert_close(self.images[transparent], blended[transparent])
+
+    def test_in_place(self):
+        expected = OverlayBlender(0.5).blend(self.images[0], self.layers[0])
+        pixels = self.images[0].copy()
+
+        OverlayBlender(0.5).blend(pixels, self.layers[0], out=pixels)
+
+        np.testing.assert_array_equal(expected, pixels)
+
+    def test_rejects_invalid_input(self):
+        with self.assertRaises(ValueError):
+            OverlayBlender(1.5)
+        with self.assertRaises(TypeError):
+            OverlayBlender(0.5).blend(self.images.astype(np.float32), self.layers)
+        with self.assertRaises(ValueError):
+            OverlayBlender(0.5).blend(self.images[..., :3], self.layers[..., :3])
+
+
+if __name__ == '__main__':
+    unittest.main()
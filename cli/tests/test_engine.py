@@ -0,0 +1,229 @@
+import asyncio
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from services.engine.blender import BlenderEngine
+from services.engine.enums import DEFAULT_ENGINE, DEFAULT_DEVICE
+from services.engine.worker import BlenderWorkerEngine
+from services.graphics import GraphicsGenerator
+
+FAKE_BLENDER = os.path.join(here, 'fake_blender.py')
+PROJECT_FILE = os.path.join(here, 'sources', 'project.blend')
+
+
+def rendered_frames(output: str):
+    # fake_blender кодирует номер кадра цветом: красный -- младший байт, зеленый -- старший
+    frames = {}
+    for file in os.listdir(output):
+        red, green, _, _ = Image.open(os.path.join(output, file)).getpixel((0, 0))
+        frames[int(file[:-len('.png')])] = red + green * 256
+    return frames
+
+
+class EngineTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.progress = []
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def output(self, name: str = "render") -> str:
+        return os.path.join(self.dir, name)
+
+    def track(self, rendered: int, total: int):
+        self.progress.append((rendered, total))
+
+
+class ShardsTest(EngineTestCase):
+    def test_split_covers_inclusive_range(self):
+        # конец диапазона у blender включается: range(0, 90) -- 91 кадр
+        for frames, shards in ((range(0, 90), 4), (range(1, 10), 3), (range(5, 7), 8), (range(0, 90), 1)):
+            with self.subTest(frames=frames, shards=shards):
+                parts = BlenderEngine._split_frames(frames, shards)
+
+                self.assertEqual(min(shards, frames.stop - frames.start + 1), len(parts))
+                self.assertEqual([frame for part in parts for frame in range(part.start, part.stop + 1)],
+                                 list(range(frames.start, frames.stop + 1)))
+                sizes = [part.stop - part.start + 1 for part in parts]
+                self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_single_frame_is_not_split(self):
+        self.assertEqual([7], BlenderEngine._split_frames(7, 4))
+        self.assertEqual(1, BlenderEngine._frames_count(7))
+
+    def test_shards_render_every_frame_once(self):
+        stats = BlenderEngine(FAKE_BLENDER).render(PROJECT_FILE, self.output(), range(1, 10), 8, 8, shards=3,
+                                                   threads=1, progress=self.track)
+
+        self.assertEqual({frame: frame for frame in range(1, 11)}, rendered_frames(self.output()))
+        self.assertEqual(10, stats.frames)
+        self.assertEqual([(rendered, 10) for rendered in range(1, 11)], self.progress)
+
+    def test_failed_shard_raises(self):
+        with mock.patch.dict(os.environ, {"FAKE_BLENDER_FAIL_FRAME": "5"}), self.assertRaises(RuntimeError) as error:
+            BlenderEngine(FAKE_BLENDER).render(PROJECT_FILE, self.output(), range(1, 10), 8, 8, shards=3)
+
+        self.assertIn("cannot render frame 5", str(error.exception))
+
+    def test_render_sequence_in_shards(self):
+        graphics = GraphicsGenerator(False, blender_path=FAKE_BLENDER, shards=4, threads=1)
+
+        sequence = graphics.render_sequence(PROJECT_FILE, self.output(), range(0, 9), 8, 8, [])
+
+        self.assertEqual([f"{frame}.png" for frame in range(0, 10)], [path.name for path in sequence])
+        self.assertEqual({frame: frame for frame in range(0, 10)}, rendered_frames(self.output()))
+
+    def test_shards_share_cores(self):
+        with mock.patch("os.cpu_count", return_value=8):
+            self.assertEqual(2, GraphicsGenerator(False, shards=4).render_threads())
+            self.assertEqual(3, GraphicsGenerator(False, shards=4, threads=3).render_threads())
+            self.assertIsNone(GraphicsGenerator(False).render_threads())
+
+
+class TimeoutTest(EngineTestCase):
+    DELAY = {"FAKE_BLENDER_DELAY": "5"}
+
+    def test_render_timeout_kills_blender(self):
+        started = time.monotonic()
+
+        with mock.patch.dict(os.environ, self.DELAY), self.assertRaises(TimeoutError):
+            BlenderEngine(FAKE_BLENDER).render(PROJECT_FILE, self.output(), range(0, 3), 8, 8, shards=2, timeout=0.5)
+
+        # процессы остановлены по таймауту, а не дождались конца кадра
+        self.assertLess(time.monotonic() - started, 4)
+
+    def test_cancelled_render_kills_blender(self):
+        async def cancel():
+            task = asyncio.ensure_future(BlenderEngine(FAKE_BLENDER).render_async(PROJECT_FILE, self.output(),
+                                                                                   range(0, 3), 8, 8))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            await task
+
+        started = time.monotonic()
+
+        with mock.patch.dict(os.environ, self.DELAY), self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel())
+
+        self.assertLess(time.monotonic() - started, 4)
+
+    def test_concurrent_async_renders(self):
+        engine = BlenderEngine(FAKE_BLENDER)
+
+        async def render_both():
+            return await asyncio.gather(
+                engine.render_async(PROJECT_FILE, self.output("first"), range(0, 4), 8, 8),
+                engine.render_async(PROJECT_FILE, self.output("second"), range(10, 12), 16, 16))
+
+        first, second = asyncio.run(render_both())
+
+        self.assertEqual((5, 3), (first.frames, second.frames))
+        self.assertEqual({frame: frame for frame in range(0, 5)}, rendered_frames(self.output("first")))
+        self.assertEqual({frame: frame for frame in range(10, 13)}, rendered_frames(self.output("second")))
+        self.assertEqual((16, 16), Image.open(os.path.join(self.output("second"), "10.png")).size)
+
+    def test_worker_timeout_restarts_worker(self):
+        engine = BlenderWorkerEngine(FAKE_BLENDER, start_timeout=30)
+        started = time.monotonic()
+
+        try:
+            with mock.patch.dict(os.environ, self.DELAY), self.assertRaises(TimeoutError):
+                engine.render(PROJECT_FILE, self.output("slow"), range(0, 3), 8, 8, timeout=0.5)
+
+            self.assertLess(time.monotonic() - started, 4)
+            worker = engine.worker(PROJECT_FILE, DEFAULT_ENGINE, DEFAULT_DEVICE, None, 0)
+            self.assertFalse(worker.alive)
+
+            # следующая задача запускает новый процесс
+            engine.render(PROJECT_FILE, self.output(), range(0, 1), 8, 8, timeout=30)
+            self.assertEqual({0: 0, 1: 1}, rendered_frames(self.output()))
+        finally:
+            engine.close()
+
+
+class WorkerTest(EngineTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.engine = BlenderWorkerEngine(FAKE_BLENDER, start_timeout=30)
+
+    def tearDown(self) -> None:
+        self.engine.close()
+        super().tearDown()
+
+    def worker(self, shard: int = 0):
+        return self.engine.worker(PROJECT_FILE, DEFAULT_ENGINE, DEFAULT_DEVICE, None, shard)
+
+    def test_worker_renders_jobs(self):
+        stats = self.engine.render(PROJECT_FILE, self.output(), range(3, 6), 8, 8, progress=self.track)
+
+        self.assertEqual({frame: frame for frame in range(3, 7)}, rendered_frames(self.output()))
+        self.assertEqual(4, stats.frames)
+        self.assertEqual([(rendered, 4) for rendered in range(1, 5)], self.progress)
+
+        # одиночный кадр -- задача из одного кадра
+        self.engine.render(PROJECT_FILE, self.output("single"), 9, 8, 8)
+        self.assertEqual({9: 9}, rendered_frames(self.output("single")))
+
+    def test_worker_is_reused_between_renders(self):
+        self.engine.render(PROJECT_FILE, self.output("first"), range(0, 1), 8, 8)
+        pid = self.worker().pid
+
+        self.engine.render(PROJECT_FILE, self.output("second"), range(2, 3), 8, 8)
+
+        self.assertIsNotNone(pid)
+        self.assertEqual(pid, self.worker().pid)
+        self.assertEqual({2: 2, 3: 3}, rendered_frames(self.output("second")))
+
+    def test_shards_get_their_own_workers(self):
+        self.engine.render(PROJECT_FILE, self.output(), range(0, 9), 8, 8, shards=2)
+
+        self.assertEqual({frame: frame for frame in range(0, 10)}, rendered_frames(self.output()))
+        self.assertNotEqual(self.worker(shard=0).pid, self.worker(shard=1).pid)
+
+    def test_worker_restarts_after_exit(self):
+        self.engine.render(PROJECT_FILE, self.output("first"), range(0, 1), 8, 8)
+        pid = self.worker().pid
+
+        # процесс blender упал между задачами: следующая задача запускает новый
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while self.worker().alive and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.engine.render(PROJECT_FILE, self.output("second"), range(0, 1), 8, 8)
+
+        self.assertNotEqual(pid, self.worker().pid)
+        self.assertEqual({0: 0, 1: 1}, rendered_frames(self.output("second")))
+
+    def test_failed_job_keeps_worker(self):
+        with mock.patch.dict(os.environ, {"FAKE_BLENDER_FAIL_FRAME": "2"}):
+            with self.assertRaises(RuntimeError) as error:
+                self.engine.render(PROJECT_FILE, self.output("failed"), range(0, 3), 8, 8)
+            pid = self.worker().pid
+
+        self.assertIn("cannot render frame 2", str(error.exception))
+
+        # ошибка задачи не останавливает процесс: следующая задача выполняется им же
+        self.engine.render(PROJECT_FILE, self.output(), range(3, 4), 8, 8)
+        self.assertEqual(pid, self.worker().pid)
+        self.assertEqual({3: 3, 4: 4}, rendered_frames(self.output()))
+
+    def test_extra_arguments_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.engine.render(PROJECT_FILE, self.output(), range(0, 1), 8, 8, params='-noaudio')
+
+
+if __name__ == '__main__':
+    unittest.main()
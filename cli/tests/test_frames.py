@@ -0,0 +1,182 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from services.frames import BaseFrameGenerator, FrameGeneratorLegacy, FrameGeneratorParams, ProcessingCache, UGCParams
+from services.plan import PLAN_DTYPE
+from services.video import ConcatManifest
+from services.waveforms import WaveformGeneratorInterface, WaveformGeneratorParams
+from settings import FFMPEG_PATH
+
+WIDTH, HEIGHT, FRAMERATE = 16, 16, 10
+TOLERANCE = 8
+
+
+class SolidFrameGenerator(BaseFrameGenerator):
+    # кадр -- заливка яркостью intensity; первый кадр рендерится дольше, чтобы следующие чанки его обогнали
+    def render(self, cache, frame):
+        if frame['skip']:
+            return None
+        if frame['frame'] == 0:
+            time.sleep(0.5)
+        return Image.new("RGB", (WIDTH, HEIGHT), (int(frame['intensity']),) * 3)
+
+    def frame_keys(self, plan):
+        return plan['intensity']
+
+
+def solid_plan(levels, skip=()) -> np.ndarray:
+    plan = np.zeros(len(levels), dtype=PLAN_DTYPE)
+    plan['frame'] = np.arange(len(levels))
+    plan['intensity'] = levels
+    plan['skip'][list(skip)] = True
+    return plan
+
+
+class SteppedWaveformGenerator(WaveformGeneratorInterface):
+    # по интенсивности на кадр; уровни перемешаны, чтобы в каждом окне их было больше, чем помещается в кэш
+    def __init__(self, frames_count: int, levels: int, max_intensity: float) -> None:
+        self.__intensities = (np.arange(frames_count) * 7 % levels) * max_intensity / (levels - 1)
+
+    def process(self, params: WaveformGeneratorParams) -> np.ndarray:
+        return self.__intensities
+
+    def duration(self) -> float:
+        return len(self.__intensities) / FRAMERATE
+
+    def output_rate(self, params: WaveformGeneratorParams) -> int:
+        return FRAMERATE
+
+
+def decoded_frames(path: str, width: int = WIDTH, height: int = HEIGHT) -> np.ndarray:
+    raw = subprocess.run([FFMPEG_PATH, '-loglevel', 'error', '-i', path, '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                         stdout=subprocess.PIPE, check=True).stdout
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, height, width, 3)
+
+
+def decoded_levels(path: str):
+    return [int(round(frame.mean())) for frame in decoded_frames(path)]
+
+
+@unittest.skipUnless(shutil.which(FFMPEG_PATH), "ffmpeg is not available")
+class StreamDispatchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.ugc_params = SimpleNamespace(width=WIDTH, height=HEIGHT, framerate=FRAMERATE)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def dispatch(self, plan: np.ndarray, dedupe: bool, chunk_size=None):
+        path = os.path.join(self.dir, "output.mp4")
+        generator_params = SimpleNamespace(output_type="video", output_path=path, audio_path=None, jobs=2,
+                                           chunk_size=chunk_size, dedupe=dedupe, encoder_threads=1)
+
+        SolidFrameGenerator()._dispatch(ProcessingCache(), plan, generator_params, self.ugc_params, False)
+        return decoded_levels(path)
+
+    def assert_levels(self, expected, levels):
+        self.assertEqual(len(expected), len(levels))
+        for level, actual in zip(expected, levels):
+            self.assertLessEqual(abs(level - actual), TOLERANCE, f"expected {expected}, decoded {levels}")
+
+    def test_frames_are_encoded_in_order(self):
+        levels = [(frame * 37) % 256 for frame in range(150)]
+
+        self.assert_levels(levels, self.dispatch(solid_plan(levels), dedupe=False, chunk_size=3))
+
+    def test_skipped_frames_are_dropped(self):
+        levels = [(frame * 37) % 256 for frame in range(20)]
+
+        self.assert_levels(levels[:15], self.dispatch(solid_plan(levels, skip=range(15, 20)), dedupe=False))
+
+    def test_runs_are_repeated(self):
+        levels = [0] * 40 + [200] * 70 + [100] * 5 + [50] * 100
+
+        self.assert_levels(levels, self.dispatch(solid_plan(levels), dedupe=True, chunk_size=1))
+
+
+class FramesManifestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.manifest_path = ConcatManifest.resolve_path(self.dir)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def dispatch(self, dedupe: bool):
+        generator_params = SimpleNamespace(output_type="frames", output_path=self.dir, jobs=1, chunk_size=None,
+                                           dedupe=dedupe)
+        ugc_params = SimpleNamespace(framerate=FRAMERATE)
+
+        SolidFrameGenerator()._dispatch(ProcessingCache(max_digits=4), solid_plan([0] * 5 + [100] * 5),
+                                        generator_params, ugc_params, False)
+
+    def test_frames_run_removes_stale_manifest(self):
+        self.dispatch(dedupe=True)
+        self.assertEqual(10, ConcatManifest.frames_count(self.manifest_path, FRAMERATE))
+
+        # кадры без --dedupe в том же каталоге: манифест прошлого запуска к ним не относится
+        self.dispatch(dedupe=False)
+        self.assertFalse(os.path.exists(self.manifest_path))
+
+
+@unittest.skipUnless(shutil.which(FFMPEG_PATH), "ffmpeg is not available")
+class QuantizedDispatchTest(unittest.TestCase):
+    LEVELS = 16
+    # несколько окон буфера переупорядочивания: следующее окно начинается с уровней, уже лежащих в кэше
+    FRAMES = 150
+    WIDTH, HEIGHT = 320, 480
+
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def render(self, frame_cache_size: int) -> np.ndarray:
+        waveform_params = WaveformGeneratorParams(smooth_factor=1, widening_factor=0.5, percussive_influence=1.0,
+                                                  harmonic_influence=1.0, percussive_margin=1.0, harmonic_margin=1.0)
+        path = os.path.join(self.dir, f"cache-{frame_cache_size}.mp4")
+
+        generator_params = FrameGeneratorParams(
+            shade_path=os.path.join(here, '..', 'sources', 'images', 'shade.png'),
+            output_path=path,
+            waveform_generator=SteppedWaveformGenerator(self.FRAMES, self.LEVELS, waveform_params.widening_factor),
+            graphics_generator=None,
+            jobs=1,
+            output_type="video",
+            intensity_levels=self.LEVELS,
+            frame_cache_size=frame_cache_size,
+            encoder_threads=1)
+
+        ugc_params = UGCParams(username="user", track_name="track", avatar_path=os.path.join(here, 'test.png'),
+                               avatar_size=100, framerate=FRAMERATE, width=self.WIDTH, height=self.HEIGHT,
+                               blur_radius=2, overlay_opacity=1.0, waveform_generator_params=waveform_params,
+                               graphics_generator_params=None)
+
+        FrameGeneratorLegacy(generator_params, ugc_params, False).process()
+        return decoded_frames(path, self.WIDTH, self.HEIGHT)
+
+    def test_small_frame_cache_keeps_every_frame(self):
+        # уровней в окне больше, чем вмещает кэш, и каждый встречается в окне несколько раз
+        expected = self.render(frame_cache_size=self.LEVELS)
+        frames = self.render(frame_cache_size=2)
+
+        self.assertEqual(self.FRAMES, len(frames))
+        np.testing.assert_array_equal(expected, frames)
+
+
+if __name__ == '__main__':
+    unittest.main()
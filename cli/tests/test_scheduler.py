@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import unittest
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from services.scheduler import ChunkScheduler
+
+SLOW = 0.5
+
+
+class SleepyGenerator:
+    # первый чанк считается дольше остальных
+    def square(self, cache, values):
+        if values[0] == 0:
+            time.sleep(SLOW)
+        return [value * value + cache for value in values]
+
+
+class ChunkSchedulerTest(unittest.TestCase):
+    def test_imap_unordered_yields_as_chunks_complete(self):
+        values = np.arange(8)
+
+        with ChunkScheduler(SleepyGenerator(), 1, jobs=2) as scheduler:
+            results = list(scheduler.imap_plan("square", values, chunk_size=2, ahead=4))
+
+        chunks = [chunk for chunk, _ in results]
+        self.assertNotEqual(0, chunks[0].start)
+        self.assertEqual(sorted(chunk.start for chunk in chunks), [0, 2, 4, 6])
+
+        for chunk, squares in results:
+            self.assertEqual([value * value + 1 for value in values[chunk]], squares)
+
+    def test_imap_unordered_stays_within_ahead(self):
+        with ChunkScheduler(SleepyGenerator(), 0, jobs=2) as scheduler:
+            order = [index for index, _ in scheduler.imap_unordered("square", [([value],) for value in range(6)],
+                                                                    ahead=2)]
+
+        # пока считается первый чанк, запущен только следующий за ним
+        self.assertEqual(sorted(order), list(range(6)))
+        self.assertLessEqual(set(order[:order.index(0)]), {1})
+
+    def test_single_worker_runs_in_order(self):
+        with ChunkScheduler(SleepyGenerator(), 0, jobs=1) as scheduler:
+            order = [index for index, _ in scheduler.imap_unordered("square", [([value],) for value in range(4)],
+                                                                    ahead=4)]
+
+        self.assertEqual([0, 1, 2, 3], order)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from services.smoothing import SmootherLoader
+
+
+class CumsumSmootherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        # огибающая, как ее сглаживает WaveformGenerator: неотрицательный float32
+        self.signal = np.abs(rng.standard_normal(1000)).astype(np.float32)
+
+    def assert_engines_agree(self, signal: np.ndarray, kernel_size: int) -> None:
+        expected = SmootherLoader.load("convolve").smooth(signal, kernel_size)
+        smoothed = SmootherLoader.load("cumsum").smooth(signal, kernel_size)
+
+        self.assertEqual(expected.shape, smoothed.shape)
+        self.assertTrue(np.allclose(expected, smoothed), f"kernel {kernel_size}, signal {len(signal)}")
+
+    def test_odd_kernels(self):
+        for kernel_size in (3, 7, 101, 999):
+            with self.subTest(kernel_size=kernel_size):
+                self.assert_engines_agree(self.signal, kernel_size)
+
+    def test_even_kernels(self):
+        for kernel_size in (2, 8, 100, 1000):
+            with self.subTest(kernel_size=kernel_size):
+                self.assert_engines_agree(self.signal, kernel_size)
+
+    def test_single_sample_kernel(self):
+        self.assert_engines_agree(self.signal, 1)
+        np.testing.assert_allclose(self.signal, SmootherLoader.load("cumsum").smooth(self.signal, 1), rtol=1e-6)
+
+    def test_kernel_longer_than_signal(self):
+        for signal_size, kernel_size in ((10, 25), (3, 200), (1, 3), (999, 1500)):
+            with self.subTest(signal_size=signal_size, kernel_size=kernel_size):
+                self.assert_engines_agree(self.signal[:signal_size], kernel_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
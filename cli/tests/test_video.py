@@ -0,0 +1,92 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here, '..'))
+
+from services.video import VideoStreamWriter
+from settings import FFMPEG_PATH
+
+WIDTH, HEIGHT, FRAMERATE = 16, 16, 10
+# яркости кадров разнесены, чтобы их порядок читался после сжатия в h264
+LEVELS = (0, 40, 80, 120, 160, 200, 240)
+TOLERANCE = 8
+
+
+def solid_frame(level: int) -> bytes:
+    return np.full((HEIGHT, WIDTH, 3), level, dtype=np.uint8).tobytes()
+
+
+@unittest.skipUnless(shutil.which(FFMPEG_PATH), "ffmpeg is not available")
+class VideoStreamWriterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "output.mp4")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def decoded_levels(self):
+        raw = subprocess.run([FFMPEG_PATH, '-loglevel', 'error', '-i', self.path,
+                              '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                             stdout=subprocess.PIPE, check=True).stdout
+        frames = np.frombuffer(raw, dtype=np.uint8).reshape(-1, HEIGHT, WIDTH, 3)
+        return [int(round(frame.mean())) for frame in frames]
+
+    def assert_levels(self, expected):
+        levels = self.decoded_levels()
+        self.assertEqual(len(expected), len(levels))
+        for level, actual in zip(expected, levels):
+            self.assertLessEqual(abs(level - actual), TOLERANCE, f"expected {expected}, decoded {levels}")
+
+    def test_out_of_order_frames_are_encoded_in_order(self):
+        order = (2, 0, 3, 1, 6, 4, 5)
+
+        with VideoStreamWriter(self.path, WIDTH, HEIGHT, FRAMERATE, buffer_size=4) as writer:
+            for frame_num in order:
+                writer.write(frame_num, solid_frame(LEVELS[frame_num]))
+
+        self.assert_levels(LEVELS)
+
+    def test_skipped_frames_are_dropped(self):
+        # пропущенный кадр не попадает в видео, но следующие за ним не ждут его вечно
+        with VideoStreamWriter(self.path, WIDTH, HEIGHT, FRAMERATE, buffer_size=4) as writer:
+            for frame_num in (1, 3, 2, 0, 4):
+                writer.write(frame_num, None if frame_num == 2 else solid_frame(LEVELS[frame_num]))
+
+        self.assert_levels([LEVELS[0], LEVELS[1], LEVELS[3], LEVELS[4]])
+
+    def test_rejects_duplicate_frames(self):
+        with VideoStreamWriter(self.path, WIDTH, HEIGHT, FRAMERATE) as writer:
+            writer.write(0, solid_frame(0))
+            writer.write(2, solid_frame(0))
+
+            with self.assertRaises(ValueError):
+                writer.write(0, solid_frame(0))
+            with self.assertRaises(ValueError):
+                writer.write(2, solid_frame(0))
+
+            writer.write(1, solid_frame(0))
+
+    def test_buffer_overflow(self):
+        with self.assertRaises(BufferError):
+            with VideoStreamWriter(self.path, WIDTH, HEIGHT, FRAMERATE, buffer_size=2) as writer:
+                for frame_num in (1, 2, 3):
+                    writer.write(frame_num, solid_frame(0))
+
+    def test_missing_frame_fails_on_close(self):
+        writer = VideoStreamWriter(self.path, WIDTH, HEIGHT, FRAMERATE).open()
+        writer.write(1, solid_frame(0))
+
+        with self.assertRaises(RuntimeError):
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,6 @@
 import argparse
 import sys
 
-import numpy as np
-from histos import Histos
-from packer import Packer
-
 
 def initArgParse():
     parser = argparse.ArgumentParser(
@@ -36,6 +32,11 @@ def main() -> None:
     parser = initArgParse()
     args = parser.parse_args()
 
+    # numpy нужен только для обработки, --help и --version обходятся без него
+    import numpy as np
+    from histos import Histos
+    from packer import Packer
+
     try:
         raw_intensities = np.load(args.input, allow_pickle=True)
 